@@ -1,21 +1,57 @@
 from django.contrib import admin
-from .models import Category, RecurringExpense, ExpensePayment
+from .categories import category_registry
+from .models import Category, RecurringExpense, ExpensePayment, ImportJob
+from .routers import use_replica
+
+class ReplicaChangelistMixin:
+    """Read changelist pages from the replica; actions are POSTs and stay on the primary"""
+    
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            # Changelists are template responses, which are rendered lazily
+            return response.render() if hasattr(response, 'render') else response
+
+class CategoryListFilter(admin.RelatedFieldListFilter):
+    """Filter by category, offering the choices from the category registry"""
+    
+    def field_choices(self, field, request, model_admin):
+        return [(category.pk, str(category)) for category in category_registry.snapshot().all()]
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ('name', 'description')
     search_fields = ('name',)
 
 @admin.register(RecurringExpense)
-class RecurringExpenseAdmin(admin.ModelAdmin):
-    list_display = ('name', 'amount', 'category', 'frequency', 'due_date', 'is_active')
-    list_filter = ('frequency', 'category', 'is_active')
+class RecurringExpenseAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
+    list_display = ('name', 'amount', 'category', 'frequency', 'due_date', 'is_active', 'is_satisfied', 'last_payment_date')
+    list_filter = ('frequency', ('category', CategoryListFilter), 'is_active')
     search_fields = ('name', 'description')
     date_hierarchy = 'due_date'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category').with_payment_status()
+    
+    @admin.display(boolean=True, ordering='is_satisfied', description='Paid')
+    def is_satisfied(self, obj):
+        return obj.is_satisfied
+    
+    @admin.display(ordering='last_payment_date', description='Last payment')
+    def last_payment_date(self, obj):
+        return obj.last_payment_date
 
 @admin.register(ExpensePayment)
-class ExpensePaymentAdmin(admin.ModelAdmin):
+class ExpensePaymentAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ('recurring_expense', 'payment_date', 'amount_paid')
-    list_filter = ('payment_date', 'recurring_expense__category')
+    list_filter = ('payment_date', ('recurring_expense__category', CategoryListFilter))
     search_fields = ('recurring_expense__name', 'notes')
     date_hierarchy = 'payment_date'
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'records_processed', 'expenses_created', 'payments_created', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at', 'finished_at')
@@ -0,0 +1,435 @@
+"""Helpers shared by the benchmark management commands"""
+import asyncio
+import importlib
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+
+from .cache import bump_categories_version, bump_user_version
+from .models import Category, RecurringExpense, ExpensePayment
+from .totals import rebuild_category_totals
+
+FREQUENCIES = [choice for choice, _ in RecurringExpense.FREQUENCY_CHOICES]
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """Run the enclosed block against a throwaway test database"""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_dataset(users=10, expenses=100, payments=1000, categories=20, seed=0, batch_size=5000):
+    """Bulk insert a deterministic dataset of users x expenses x payments
+
+    Returns the created users. Payment dates walk backwards from today so
+    that every user has both recent and historical payments.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+
+    category_objs = Category.objects.bulk_create(
+        [Category(name=f"Category {i}") for i in range(categories)]
+    )
+    # bulk_create() sends no signals, so tell the category registry
+    bump_categories_version()
+    user_objs = User.objects.bulk_create(
+        [User(username=f"bench{i}") for i in range(users)]
+    )
+
+    def expense_rows():
+        for user in user_objs:
+            for i in range(expenses):
+                yield RecurringExpense(
+                    user=user,
+                    name=f"Expense {i}",
+                    amount=Decimal(rng.randint(100, 100000)) / 100,
+                    category=rng.choice(category_objs) if category_objs and rng.random() > 0.1 else None,
+                    frequency=rng.choice(FREQUENCIES),
+                    due_date=today + timedelta(days=rng.randint(-60, 60)),
+                    is_active=rng.random() > 0.2,
+                )
+
+    expense_ids = []
+    for chunk in _chunks(expense_rows(), batch_size):
+        expense_ids.extend((obj.pk, obj.user_id) for obj in RecurringExpense.objects.bulk_create(chunk))
+
+    def payment_rows():
+        for expense_id, user_id in expense_ids:
+            for i in range(payments):
+                yield ExpensePayment(
+                    recurring_expense_id=expense_id,
+                    user_id=user_id,
+                    payment_date=today - timedelta(days=i * 3 + rng.randint(0, 2)),
+                    amount_paid=Decimal(rng.randint(100, 100000)) / 100,
+                )
+
+    for chunk in _chunks(payment_rows(), batch_size):
+        ExpensePayment.objects.bulk_create(chunk)
+
+    # bulk_create() bypasses the signals that keep the summaries current
+    rebuild_category_totals()
+    return user_objs
+
+
+def percentile(samples, fraction):
+    """The nearest-rank percentile of already sorted samples, e.g. 0.95 for p95"""
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def invalidate_user_data(user):
+    """Make the next request for the user miss every per-user cache, as after a write"""
+    bump_user_version(user.pk)
+
+
+def time_call(func, repeat=5):
+    """Call func repeat times and return (median, p95) wall time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), percentile(samples, 0.95)
+
+
+def build_backup(expenses=500, payments=100, categories=20, seed=0):
+    """Build an in-memory backup structure in the export_data schema"""
+    rng = random.Random(seed)
+    today = date.today()
+    category_data = [
+        {'id': 1000 + i, 'name': f"Category {i}", 'description': ''} for i in range(categories)
+    ]
+    expense_data = []
+    for i in range(expenses):
+        category = rng.choice(category_data) if category_data else None
+        expense_data.append({
+            'name': f"Imported {i}",
+            'amount': f"{rng.randint(100, 100000) / 100:.2f}",
+            'category_id': category['id'] if category else None,
+            'category_name': category['name'] if category else None,
+            'frequency': rng.choice(FREQUENCIES),
+            'due_date': (today + timedelta(days=rng.randint(-60, 60))).isoformat(),
+            'description': '',
+            'is_active': True,
+            'payments': [
+                {
+                    'payment_date': (today - timedelta(days=j)).isoformat(),
+                    'amount_paid': f"{rng.randint(100, 100000) / 100:.2f}",
+                    'notes': ''
+                }
+                for j in range(payments)
+            ]
+        })
+    return {
+        'export_date': today.isoformat(),
+        'username': 'bench',
+        'categories': category_data,
+        'expenses': expense_data,
+    }
+
+
+def import_row_by_row(user, data):
+    """The original import path: one probe and one INSERT per row, kept as a baseline"""
+    category_mapping = {}
+    for category_data in data['categories']:
+        category, created = Category.objects.get_or_create(
+            name=category_data['name'],
+            defaults={'description': category_data.get('description', '')}
+        )
+        category_mapping[category_data['id']] = category
+
+    for expense_data in data['expenses']:
+        category = None
+        if expense_data.get('category_id') and expense_data['category_id'] in category_mapping:
+            category = category_mapping[expense_data['category_id']]
+        elif expense_data.get('category_name'):
+            try:
+                category = Category.objects.get(name=expense_data['category_name'])
+            except Category.DoesNotExist:
+                category = Category.objects.create(name=expense_data['category_name'], description='')
+
+        if RecurringExpense.objects.filter(
+            user=user, name=expense_data['name'], amount=expense_data['amount']
+        ).first():
+            continue
+
+        expense = RecurringExpense.objects.create(
+            user=user,
+            name=expense_data['name'],
+            amount=expense_data['amount'],
+            category=category,
+            frequency=expense_data['frequency'],
+            due_date=date.fromisoformat(expense_data['due_date']),
+            description=expense_data.get('description', ''),
+            is_active=expense_data.get('is_active', True)
+        )
+        for payment_data in expense_data.get('payments', []):
+            ExpensePayment.objects.create(
+                recurring_expense=expense,
+                payment_date=date.fromisoformat(payment_data['payment_date']),
+                amount_paid=payment_data['amount_paid'],
+                notes=payment_data.get('notes', '')
+            )
+
+
+def measure(func, repeat=5, before=None):
+    """Like time_call(), but also count the queries of the last call
+
+    ``before`` is called ahead of every call, outside the measurement.
+    Returns a dict with median_ms, p95_ms and queries.
+    """
+    samples = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        query_count = len(queries)
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'queries': query_count,
+    }
+
+
+def bench_views(user, repeat=5, import_expenses=100, import_payments=10):
+    """Time the main views for a seeded user through the test client
+
+    Each GET view is measured cold, with the user's cached data invalidated
+    before every request so the queries run, and then warm, served from the
+    caches; the warm figures are the ``warm_`` keys. The import is measured
+    end to end: the upload request plus running the queued job, each time as
+    a new user so that nothing is skipped as a duplicate. Needs the test
+    environment (setup_test_environment()) so the test client's host is
+    allowed.
+    """
+    from .jobs import run_pending_jobs
+
+    client = Client()
+    client.force_login(user)
+
+    def get(name, **params):
+        def call():
+            response = client.get(reverse(name), params)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name} returned {response.status_code}")
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return call
+
+    results = {}
+    for view in ['home', 'dashboard', 'expense_chart_data', 'export_data']:
+        call = get(f'expenses:{view}')
+        results[view] = measure(call, repeat, before=lambda: invalidate_user_data(user))
+        warm = measure(call, repeat)
+        results[view].update({f'warm_{metric}': value for metric, value in warm.items()})
+
+    backup = json.dumps(
+        build_backup(expenses=import_expenses, payments=import_payments)
+    ).encode()
+    # Log every importing user in up front so the sessions are not timed
+    import_clients = []
+    for i in range(repeat):
+        import_clients.append(Client())
+        import_clients[-1].force_login(User.objects.create(username=f"bench-import-{i}"))
+    import_clients = iter(import_clients)
+
+    def import_backup():
+        response = next(import_clients).post(reverse('expenses:import_data'), {
+            'import_file': SimpleUploadedFile('backup.json', backup, content_type='application/json')
+        })
+        if response.status_code != 302:
+            raise RuntimeError(f"import_data returned {response.status_code}")
+        run_pending_jobs()
+
+    with tempfile.TemporaryDirectory() as media_root, \
+            override_settings(MEDIA_ROOT=media_root, EXPENSES_IMPORT_WORKER_THREADS=0):
+        results['import_data'] = measure(import_backup, repeat)
+    return results
+
+
+def check_thresholds(results, thresholds):
+    """List the measurements that exceed their limits
+
+    ``thresholds`` maps a view to limits on any of its measurements, such as
+    ``{"home": {"p95_ms": 50, "queries": 6}}``.
+    """
+    failures = []
+    for view, limits in thresholds.items():
+        if view not in results:
+            failures.append(f"{view}: no measurement")
+            continue
+        for metric, limit in limits.items():
+            value = results[view].get(metric)
+            if value is None:
+                failures.append(f"{view}.{metric}: no measurement")
+            elif value > limit:
+                failures.append(f"{view}.{metric}: {value} exceeds {limit}")
+    return failures
+
+
+def _reload_urls():
+    from . import urls
+    importlib.reload(urls)
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@contextmanager
+def async_views():
+    """Route the dashboard URLs to the async views, as recurringtracker/asgi.py does"""
+    try:
+        with override_settings(EXPENSES_ASYNC_VIEWS=True):
+            _reload_urls()
+            yield
+    finally:
+        _reload_urls()
+
+
+def _summarize(latencies, elapsed):
+    latencies.sort()
+    return {
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'median_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+    }
+
+
+def load_wsgi(path, cookie, concurrency=10, requests=100, before=None):
+    """Send GET requests from a pool of threads, like a threaded WSGI server
+
+    ``before`` is called ahead of every request, outside its latency.
+    """
+    application = get_wsgi_application()
+
+    def call(_):
+        if before is not None:
+            before()
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'testserver',
+            'HTTP_COOKIE': cookie,
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.url_scheme': 'http',
+        }
+        statuses = []
+        start = time.perf_counter()
+        response = application(environ, lambda status, headers: statuses.append(status))
+        b''.join(response)
+        response.close()
+        if not statuses[0].startswith('200'):
+            raise RuntimeError(f"{path} returned {statuses[0]}")
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(call, range(requests)))
+        elapsed = time.perf_counter() - start
+    return _summarize(latencies, elapsed)
+
+
+def load_asgi(path, cookie, concurrency=10, requests=100, before=None):
+    """Send GET requests to the ASGI application from concurrent clients on one event loop
+
+    ``before`` is called in a worker thread ahead of every request, outside
+    its latency.
+    """
+    application = get_asgi_application()
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+
+    async def call():
+        if before is not None:
+            await sync_to_async(before)()
+        messages = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            if not messages:
+                messages.append(None)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Only asked for again to watch for a disconnect
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        start = time.perf_counter()
+        await application(dict(scope), receive, send)
+        disconnect.set()
+        status = next(m['status'] for m in messages if m and m['type'] == 'http.response.start')
+        if status != 200:
+            raise RuntimeError(f"{path} returned {status}")
+        return (time.perf_counter() - start) * 1000
+
+    async def client(count, latencies):
+        for _ in range(count):
+            latencies.append(await call())
+
+    async def run():
+        latencies = []
+        share, extra = divmod(requests, concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(share + (i < extra), latencies) for i in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+    latencies, elapsed = asyncio.run(run())
+    return _summarize(latencies, elapsed)
@@ -0,0 +1,119 @@
+"""Per-user versioned caching of derived expense data
+
+Every user has a data version stored in the cache, and category changes
+bump a shared version because category names appear in everyone's data.
+Cached values are keyed on both versions, so bumping a version makes the
+old entries unreachable without having to find and delete them. The
+versions live in the configured cache backend; use a backend shared by
+all workers (such as the file backend) when running more than one process.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+CATEGORIES_VERSION_KEY = 'expenses:version:categories'
+
+
+def _user_version_key(user_id):
+    return f'expenses:version:user:{user_id}'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a lost version never reuses an old number
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def _aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def _bump_version(key):
+    _increment(key)
+    # Bump again once the change is committed, so a value computed from the
+    # old rows by a concurrent request in the meantime is never reused
+    transaction.on_commit(lambda: _increment(key))
+
+
+def get_user_version(user_id):
+    return _get_version(_user_version_key(user_id))
+
+
+def bump_user_version(user_id):
+    """Invalidate everything cached for one user"""
+    _bump_version(_user_version_key(user_id))
+
+
+def get_categories_version():
+    return _get_version(CATEGORIES_VERSION_KEY)
+
+
+def bump_categories_version():
+    """Invalidate everything cached for all users after a category change"""
+    _bump_version(CATEGORIES_VERSION_KEY)
+
+
+def data_version(user_id):
+    """A token that changes whenever the user's expenses or any category change"""
+    return f'{get_user_version(user_id)}.{get_categories_version()}'
+
+
+async def adata_version(user_id):
+    """data_version() for async code"""
+    return f'{await _aget_version(_user_version_key(user_id))}.{await _aget_version(CATEGORIES_VERSION_KEY)}'
+
+
+def cached_for_user(user_id, name, compute, timeout=24 * 60 * 60):
+    """Return compute() for the user, reusing the value until their data changes"""
+    key = f'expenses:{name}:{user_id}:{data_version(user_id)}'
+    value = cache.get(key)
+    if value is not None:
+        _record('hits')
+        return value
+    _record('misses')
+    value = compute()
+    cache.set(key, value, timeout=timeout)
+    return value
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    """Hit and miss counts for this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+async def acached_for_user(user_id, name, compute, timeout=24 * 60 * 60):
+    """cached_for_user() for async code, where compute() returns an awaitable"""
+    key = f'expenses:{name}:{user_id}:{await adata_version(user_id)}'
+    value = await cache.aget(key)
+    if value is not None:
+        _record('hits')
+        return value
+    _record('misses')
+    value = await compute()
+    await cache.aset(key, value, timeout=timeout)
+    return value
@@ -0,0 +1,85 @@
+"""An in-process copy of the Category table
+
+Categories are few and shared by everyone, so each process keeps all of them
+in memory, by ID and by name, and reloads them whenever the categories
+version from cache.py moves on. Category saves and deletes bump that version
+through signals, which invalidates the copy in every worker sharing the
+cache backend.
+
+Checking the version is a cache lookup, so callers take one snapshot() per
+request or export and resolve every row against it. The Category objects
+are shared between threads and must be treated as read-only; fetch a fresh
+instance before changing one.
+"""
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .cache import get_categories_version
+from .models import Category
+
+
+class CategorySnapshot:
+    """Every category as of one categories version, by ID and by name"""
+
+    def __init__(self, version, categories):
+        self.version = version
+        self._by_id = {category.pk: category for category in categories}
+        self._by_name = {}
+        for category in categories:
+            # The oldest category wins when names repeat
+            self._by_name.setdefault(category.name, category)
+
+    def get(self, pk):
+        """The category with this ID, or None for no or an unknown ID"""
+        return self._by_id.get(pk)
+
+    def by_name(self, name):
+        """The oldest category with this name, or None"""
+        return self._by_name.get(name)
+
+    def by_names(self):
+        """A copy of the name to category map, for callers that add to it"""
+        return dict(self._by_name)
+
+    def all(self):
+        """Every category, oldest first"""
+        return list(self._by_id.values())
+
+    def name(self, pk, default=None):
+        """The name of the category with this ID, or ``default``"""
+        category = self._by_id.get(pk)
+        return category.name if category is not None else default
+
+
+class CategoryRegistry:
+    """Hands out CategorySnapshots, loading a new one when the categories version changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self):
+        """The current categories, to be held for the rest of a request or export"""
+        # Read the version before the rows, so a change made while loading
+        # leaves a stale version behind and the next call loads again
+        version = get_categories_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            # Always the primary: a lagging replica would be kept until the
+            # next category change
+            snapshot = CategorySnapshot(version, list(Category.objects.using(DEFAULT_DB_ALIAS).order_by('id')))
+            # Rows read inside a transaction may never be committed, so they
+            # are only used by the caller and not kept for everyone else
+            if not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+                self._snapshot = snapshot
+        return snapshot
+
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,104 @@
+"""Conditional GET for views derived from one user's expenses
+
+The validators come from the user's data version in cache.py, which every
+change to their expenses, their payments or any category moves on,
+deletions included. The first request to see a version stamps it with a
+fresh ETag and the current time as Last-Modified, so working them out
+reads the cache and never the expense or payment tables. A client that
+already holds the current representation gets a 304 before the view runs
+any of its aggregation or serialization.
+
+The validators are stored with cache.get() and cache.add() directly rather
+than through cached_for_user(), as every conditional request reads them
+and counting those reads would swamp the hit rate of the cached data that
+cache_stats() reports.
+
+Losing the cache only costs clients one full response. Last-Modified has
+one-second precision, so clients should revalidate with If-None-Match;
+browsers send it alongside If-Modified-Since, and it takes precedence when
+both are present.
+"""
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .cache import adata_version, data_version
+
+VALIDATORS_TIMEOUT = 24 * 60 * 60
+
+
+def _validators():
+    """A new (ETag, Last-Modified timestamp) pair for the current data version"""
+    now = time.time_ns()
+    return f'"{now}"', now // 10 ** 9
+
+
+def _validators_key(user_id, version):
+    return f'expenses:validators:{user_id}:{version}'
+
+
+def user_data_validators(user):
+    """The (ETag, Last-Modified timestamp) of everything exported for the user"""
+    key = _validators_key(user.pk, data_version(user.pk))
+    validators = cache.get(key)
+    if validators is None:
+        # add() so that concurrent first requests agree on one pair
+        validators = _validators()
+        if not cache.add(key, validators, timeout=VALIDATORS_TIMEOUT):
+            validators = cache.get(key, validators)
+    return validators
+
+
+async def auser_data_validators(user):
+    """user_data_validators() for async code"""
+    key = _validators_key(user.pk, await adata_version(user.pk))
+    validators = await cache.aget(key)
+    if validators is None:
+        validators = _validators()
+        if not await cache.aadd(key, validators, timeout=VALIDATORS_TIMEOUT):
+            validators = await cache.aget(key, validators)
+    return validators
+
+
+def _finish(request, response, etag, last_modified):
+    # As django.views.decorators.http.condition() does
+    if request.method in ('GET', 'HEAD'):
+        if last_modified and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers.setdefault('ETag', etag)
+    return response
+
+
+def conditional_on_user_data(view):
+    """Answer conditional requests for a view of the requesting user's data
+    
+    This is django.views.decorators.http.condition() with both validators
+    taken from the user's data version, and with async views computing them with the
+    async ORM. Anonymous requests go straight to the view.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            if not user.is_authenticated:
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await auser_data_validators(user)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            etag, last_modified = user_data_validators(request.user)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+    return wrapper
@@ -0,0 +1,127 @@
+"""SQLite backend tuned for concurrent page loads and imports
+
+Use it as ``'ENGINE': 'expenses.db.sqlite3'``. On top of Django's SQLite
+backend it:
+
+* applies pragmas from ``OPTIONS`` to every new connection. WAL lets readers
+  carry on while a write is in progress, and ``busy_timeout`` makes SQLite
+  wait for a lock instead of failing straight away;
+* starts transactions with ``BEGIN IMMEDIATE`` unless ``transaction_mode``
+  says otherwise, so a transaction that reads and then writes takes the
+  write lock up front rather than failing to upgrade its read lock;
+* reads the number of host parameters a statement may have from the
+  SQLite library (32766 since 3.32) instead of assuming 999, so a batch of
+  bulk inserts goes in one statement;
+* retries statements that still fail with "database is locked" outside of
+  a transaction, including the BEGIN itself, with exponential backoff. The
+  retries happen in the cursor, below Django's execute wrappers and query
+  log, so a retried statement still counts as one query.
+
+Every option can be overridden in ``OPTIONS``; set a pragma to None to
+leave SQLite's default in place.
+"""
+import random
+import re
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base, features
+from django.utils.functional import cached_property
+
+PRAGMA_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,  # Bytes
+    'cache_size': -32000,  # Negative values are in KiB
+    'busy_timeout': 5000,  # Milliseconds
+}
+
+RETRY_DEFAULTS = {
+    'busy_retries': 5,
+    'busy_backoff': 0.05,  # Seconds before the first retry, doubled each time
+}
+
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def is_busy_error(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    """Django's SQLite cursor, retrying statements that find the database busy"""
+
+    def execute(self, query, params=None):
+        return self.db.retry_when_busy(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # A retry needs the parameters again, so a generator is read up front
+        return self.db.retry_when_busy(super().executemany, query, list(param_list))
+
+
+class DatabaseFeatures(features.DatabaseFeatures):
+    @cached_property
+    def max_query_params(self):
+        # Connection.getlimit() is new in Python 3.11
+        if not hasattr(base.Database.Connection, 'getlimit'):
+            return super().max_query_params
+        self.connection.ensure_connection()
+        return self.connection.connection.getlimit(base.Database.SQLITE_LIMIT_VARIABLE_NUMBER)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    features_class = DatabaseFeatures
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pragmas = dict(PRAGMA_DEFAULTS)
+        self.busy_retries = RETRY_DEFAULTS['busy_retries']
+        self.busy_backoff = RETRY_DEFAULTS['busy_backoff']
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for name, default in PRAGMA_DEFAULTS.items():
+            value = kwargs.pop(name, default)
+            if value is not None and not PRAGMA_VALUE.match(str(value)):
+                raise ImproperlyConfigured(
+                    f"settings.DATABASES[{self.alias!r}]['OPTIONS'][{name!r}] is not a valid pragma value."
+                )
+            self.pragmas[name] = value
+        self.busy_retries = kwargs.pop('busy_retries', RETRY_DEFAULTS['busy_retries'])
+        self.busy_backoff = kwargs.pop('busy_backoff', RETRY_DEFAULTS['busy_backoff'])
+
+        if self.transaction_mode is None:
+            self.transaction_mode = 'IMMEDIATE'
+        # The sqlite3 module has its own lock timeout in seconds; keep it in step
+        if self.pragmas['busy_timeout'] is not None:
+            kwargs.setdefault('timeout', int(self.pragmas['busy_timeout']) / 1000)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            # In-memory databases cannot use WAL
+            if value is None or (name == 'journal_mode' and self.is_in_memory_db()):
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.db = self
+        return cursor
+
+    def retry_when_busy(self, execute, *args):
+        """Call execute(*args), retrying with backoff while the database is busy"""
+        attempt = 0
+        while True:
+            try:
+                return execute(*args)
+            except base.Database.OperationalError as e:
+                # Inside a transaction the earlier statements would be lost
+                if self.in_atomic_block or attempt >= self.busy_retries or not is_busy_error(e):
+                    raise
+            # Jitter keeps waiting writers from retrying in lockstep
+            time.sleep(self.busy_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
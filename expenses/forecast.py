@@ -0,0 +1,37 @@
+"""Cash-flow forecasts built from the recurrence schedule"""
+from collections import defaultdict
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+
+from .schedule import occurrences
+
+
+def forecast(expenses, start, months):
+    """Total the outflow of expenses per month and per category
+
+    The window runs from ``start`` to the end of the month ``months - 1``
+    months later, so the first month only counts what is still to come.
+    Every expense is expanded across the whole window in one pass over the
+    schedule. ``expenses`` need ``amount``, ``frequency``, ``due_date`` and
+    ``category`` attributes.
+    """
+    first_month = start.replace(day=1)
+    end = first_month + relativedelta(months=months)
+
+    by_month = [Decimal('0.00')] * months
+    by_category = defaultdict(lambda: Decimal('0.00'))
+    for expense, occurrence in occurrences(expenses, start, end):
+        index = (occurrence.year - first_month.year) * 12 + occurrence.month - first_month.month
+        by_month[index] += expense.amount
+        by_category[expense.category.name if expense.category else None] += expense.amount
+
+    return {
+        'start': start,
+        'end': end,
+        'total': sum(by_month, Decimal('0.00')),
+        'by_month': [
+            (first_month + relativedelta(months=i), total) for i, total in enumerate(by_month)
+        ],
+        'by_category': sorted(by_category.items(), key=lambda item: (item[0] is None, item[0] or '')),
+    }
@@ -0,0 +1,19 @@
+"""Database functions tuned for the backends this project runs on"""
+from django.db.models import DateField, DateTimeField
+from django.db.models import functions
+
+
+class TruncMonth(functions.TruncMonth):
+    """TruncMonth that runs natively on SQLite for date columns
+
+    Django implements TruncMonth on SQLite with a Python user-defined
+    function called once per row. For a DateField the built-in date()
+    function gives the same result without leaving SQLite.
+    """
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        field = self.lhs.output_field
+        if not isinstance(field, DateField) or isinstance(field, DateTimeField):
+            return self.as_sql(compiler, connection, **extra_context)
+        sql, params = compiler.compile(self.lhs)
+        return f"date({sql}, 'start of month')", params
@@ -0,0 +1,603 @@
+import codecs
+import csv
+import datetime
+import gzip
+import json
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery
+
+from .cache import bump_categories_version, bump_user_version
+from .categories import category_registry
+from .models import RecurringExpense, Category, ExpensePayment
+from .totals import add_category_totals
+
+
+class InvalidBackup(Exception):
+    """The backup parsed but is missing required data or has unexpected records"""
+
+
+class BackupReader:
+    """Incrementally parse a backup file in the export_data schema
+
+    Iterating over the reader yields one expense dict at a time while only a
+    small window of the file is kept in memory. Every other top-level key
+    (export_date, username, categories) is collected into ``header`` as it
+    is reached, and ``header['expenses']`` is set once the list has been
+    seen. Malformed input raises json.JSONDecodeError.
+    """
+
+    def __init__(self, fileobj, chunk_size=64 * 1024):
+        self.header = {}
+        self._file = fileobj
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """Read the next chunk into the buffer, returning False at end of file"""
+        if self._eof:
+            return False
+        chunk = self._file.read(size or self._chunk_size)
+        if self._pos > self._chunk_size:
+            # Drop what has already been parsed
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += self._decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self._eof = True
+        return True
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def _next_char(self):
+        """Consume and return the next non-whitespace character, or '' at end of file"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                self._pos += 1
+                return self._buffer[self._pos - 1]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._next_char() != char:
+            raise self._error(f"Expecting '{char}'")
+
+    def _value(self):
+        """Decode the next complete JSON value"""
+        char = self._next_char()
+        if not char:
+            raise self._error("Expecting value")
+        self._pos -= 1
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Grow the reads so one large value isn't re-parsed for every chunk
+                size *= 2
+                if not self._fill(size):
+                    raise
+                continue
+            # A number or literal may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        char = self._next_char()
+        while char != '}':
+            self._pos -= 1
+            key = self._value()
+            if not isinstance(key, str):
+                raise self._error("Expecting property name")
+            self._expect(':')
+            if key == 'expenses':
+                self.header['expenses'] = True
+                yield from self._items()
+            else:
+                self.header[key] = self._value()
+            char = self._next_char()
+            if char == ',':
+                char = self._next_char()
+            elif char != '}':
+                raise self._error("Expecting ',' delimiter")
+        if self._next_char():
+            raise self._error("Extra data")
+
+    def _items(self):
+        self._expect('[')
+        char = self._next_char()
+        while char != ']':
+            self._pos -= 1
+            yield self._value()
+            char = self._next_char()
+            if char == ',':
+                char = self._next_char()
+            elif char != ']':
+                raise self._error("Expecting ',' delimiter")
+
+
+# Columns of the CSV export. Each row is a category, an expense or a payment
+# of the expense in the nearest expense row above it.
+CSV_FIELDS = [
+    'type', 'category_id', 'category_name', 'name', 'amount', 'frequency',
+    'due_date', 'description', 'is_active', 'payment_date', 'amount_paid', 'notes', 'sync_id',
+]
+
+
+class NDJSONBackupReader:
+    """Parse a backup written as newline-delimited JSON
+
+    The first line is a ``header`` record, followed by one ``category``
+    record per line and then one ``expense`` record (with its payments) per
+    line. Like BackupReader, iterating yields the expenses and fills in
+    ``header`` with the export metadata and the categories.
+    """
+
+    def __init__(self, fileobj):
+        self.header = {}
+        self._file = fileobj
+
+    def __iter__(self):
+        categories = []
+        started = False
+        for number, line in enumerate(self._file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            kind = record.pop('type', None) if isinstance(record, dict) else None
+            if kind == 'header' and number == 1:
+                self.header.update(record)
+            elif kind == 'category' and not started:
+                categories.append(record)
+            elif kind == 'expense':
+                if not started:
+                    self.header['categories'] = categories
+                    self.header['expenses'] = True
+                    started = True
+                yield record
+            else:
+                raise InvalidBackup(f"Unexpected record on line {number} of the backup file.")
+        if not started:
+            # A backup without any expenses
+            self.header['categories'] = categories
+            self.header['expenses'] = True
+
+
+class CSVBackupReader:
+    """Parse a backup written as CSV with the CSV_FIELDS columns
+
+    Payments follow the expense they belong to, so each expense is yielded
+    once the next expense (or the end of the file) is reached.
+    """
+
+    def __init__(self, fileobj):
+        self.header = {}
+        self._file = fileobj
+
+    def __iter__(self):
+        rows = csv.DictReader(line.decode('utf-8') for line in self._file)
+        if rows.fieldnames != CSV_FIELDS:
+            raise InvalidBackup("Unrecognized backup file format. Expected JSON, NDJSON or CSV.")
+
+        categories = []
+        expense = None
+        for row in rows:
+            kind = row['type']
+            if kind == 'category':
+                categories.append({
+                    'id': int(row['category_id']),
+                    'name': row['category_name'],
+                    'description': row['description'],
+                })
+            elif kind == 'expense':
+                if expense is not None:
+                    yield expense
+                else:
+                    self.header['categories'] = categories
+                    self.header['expenses'] = True
+                expense = {
+                    'name': row['name'],
+                    'amount': row['amount'],
+                    'category_id': int(row['category_id']) if row['category_id'] else None,
+                    'category_name': row['category_name'] or None,
+                    'frequency': row['frequency'],
+                    'due_date': row['due_date'],
+                    'description': row['description'],
+                    'is_active': row['is_active'] == 'true',
+                    'sync_id': row['sync_id'],
+                    'payments': [],
+                }
+            elif kind == 'payment' and expense is not None:
+                expense['payments'].append({
+                    'payment_date': row['payment_date'],
+                    'amount_paid': row['amount_paid'],
+                    'notes': row['notes'],
+                    'sync_id': row['sync_id'],
+                })
+            else:
+                raise InvalidBackup(f"Unexpected {kind!r} row on line {rows.line_num} of the backup file.")
+        if expense is not None:
+            yield expense
+        else:
+            self.header['categories'] = categories
+            self.header['expenses'] = True
+
+
+def open_backup(fileobj):
+    """Return a reader for a backup in any of the export formats
+
+    The format is detected from the content rather than the file name:
+    gzip-compressed files are decompressed as they are read, a first line
+    holding a complete ``header`` record is NDJSON, any other file starting
+    with ``{`` is the JSON document and everything else is read as CSV.
+    The file must be seekable.
+    """
+    if fileobj.read(2) == b'\x1f\x8b':
+        fileobj.seek(0)
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    else:
+        fileobj.seek(0)
+
+    head = fileobj.read(4096)
+    fileobj.seek(0)
+    if not head.lstrip().startswith(b'{'):
+        return CSVBackupReader(fileobj)
+    try:
+        first = json.loads(head.split(b'\n', 1)[0])
+    except ValueError:
+        first = None
+    if isinstance(first, dict) and first.get('type') == 'header':
+        return NDJSONBackupReader(fileobj)
+    return BackupReader(fileobj)
+
+
+class BackupImporter:
+    """Import backup records for one user as set-based upserts
+
+    Expenses and payments are identified by their fingerprint columns
+    (name and amount, and date, amount and notes within an expense), which
+    unique constraints back. Each batch of queued records is written with
+    one lookup of the expenses that already exist (and, for those, of their
+    payments), one INSERT OR IGNORE ... RETURNING each for expenses and
+    payments and one upsert of the category totals, so importing the same
+    backup again changes nothing. Existing expenses are left as they are,
+    but payments missing from them are added. Categories are resolved from a
+    single name lookup table. Each batch is written in a transaction of its
+    own; an import that stops part way keeps the batches written so far,
+    and running it again adds only the rest.
+    """
+
+    def __init__(self, user, batch_size=1000, progress=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.progress = progress
+        self.records_processed = 0
+        self.expenses_created = 0
+        self.expenses_skipped = 0
+        self.payments_created = 0
+
+        # Maps original category IDs from the backup to Category objects
+        self.category_mapping = {}
+        # Categories by name; the oldest category wins when names repeat
+        self.categories_by_name = category_registry.snapshot().by_names()
+
+        # Expenses waiting to be written, by fingerprint so repeats within
+        # the file merge, with the payments data queued for each
+        self._pending = {}
+        self._pending_rows = 0
+        self._expense_fingerprint = RecurringExpense._meta.get_field('fingerprint')
+        self._payment_fingerprint = ExpensePayment._meta.get_field('fingerprint')
+
+    def import_data(self, data):
+        """Import a complete backup structure"""
+        self.add_categories(data['categories'])
+        for expense_data in data['expenses']:
+            self.add_expense(expense_data)
+        self.flush()
+
+    def import_stream(self, reader):
+        """Import expenses from a BackupReader as they are parsed"""
+        categories_added = False
+        for expense_data in reader:
+            if not categories_added and 'categories' in reader.header:
+                self.add_categories(reader.header['categories'])
+                categories_added = True
+            self.add_expense(expense_data)
+
+        # Validate the data structure
+        if not all(key in reader.header for key in ['categories', 'expenses']):
+            raise InvalidBackup("Invalid backup file format. Missing required data.")
+        if not categories_added:
+            self.add_categories(reader.header['categories'])
+        self.flush()
+
+    def add_categories(self, categories_data):
+        """Map backup categories to existing ones by name, creating the missing ones"""
+        missing = {}
+        for category_data in categories_data:
+            name = category_data['name']
+            if name not in self.categories_by_name and name not in missing:
+                missing[name] = Category(name=name, description=category_data.get('description', ''))
+        if missing:
+            for category in Category.objects.bulk_create(missing.values()):
+                self.categories_by_name[category.name] = category
+            # bulk_create() sends no signals
+            bump_categories_version()
+
+        for category_data in categories_data:
+            self.category_mapping[category_data['id']] = self.categories_by_name[category_data['name']]
+
+    def resolve_category(self, expense_data):
+        """Find the category for an expense, by backup ID first and then by name"""
+        category_id = expense_data.get('category_id')
+        if category_id and category_id in self.category_mapping:
+            return self.category_mapping[category_id]
+
+        name = expense_data.get('category_name')
+        if not name:
+            return None
+        if name not in self.categories_by_name:
+            # Create a new category if it doesn't exist
+            self.categories_by_name[name] = Category.objects.create(name=name, description='')
+        return self.categories_by_name[name]
+
+    def add_expense(self, expense_data):
+        """Queue an expense and its payments, writing a batch once it is full"""
+        expense = RecurringExpense(
+            user=self.user,
+            name=expense_data['name'],
+            amount=RecurringExpense._meta.get_field('amount').to_python(expense_data['amount']),
+            category=self.resolve_category(expense_data),
+            frequency=expense_data['frequency'],
+            due_date=datetime.date.fromisoformat(expense_data['due_date']),
+            description=expense_data.get('description', ''),
+            is_active=expense_data.get('is_active', True),
+            # Backups keep each expense's sync_id, so deltas can be applied on top
+            sync_id=uuid.UUID(expense_data['sync_id']) if expense_data.get('sync_id') else uuid.uuid4()
+        )
+        payments = expense_data.get('payments', [])
+        key = self._expense_fingerprint.compute(expense)
+        if key in self._pending:
+            # A repeat within the file; the first one wins but payments merge
+            self.expenses_skipped += 1
+            self._pending[key][1].extend(payments)
+        else:
+            self._pending[key] = (expense, list(payments))
+        self._pending_rows += 1 + len(payments)
+
+        if self._pending_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the queued records as one batch and report progress"""
+        if not self._pending:
+            return
+
+        # Each batch commits on its own, so a long import only holds the
+        # database's write lock for one batch at a time
+        with transaction.atomic():
+            self._write_pending()
+
+        self.records_processed += self._pending_rows
+        self._pending = {}
+        self._pending_rows = 0
+        if self.progress:
+            self.progress(self.records_processed)
+
+    def _write_pending(self):
+        """Upsert all queued expenses and then their payments"""
+        # Expenses that already exist keep their row; the lookup tells them
+        # apart from new ones, which need their totals applied
+        existing = {}
+        for pk, key, sync_id in RecurringExpense.objects.filter(user=self.user).filter(
+            Q(fingerprint__in=self._pending.keys()) |
+            Q(sync_id__in=[expense.sync_id for expense, _ in self._pending.values()])
+        ).values_list('pk', 'fingerprint', 'sync_id'):
+            existing[key] = existing[sync_id] = pk
+
+        new = []
+        existing_pks = []
+        for key, (expense, _) in self._pending.items():
+            pk = existing.get(key, existing.get(expense.sync_id))
+            if pk is None:
+                new.append(expense)
+            else:
+                expense.pk = pk
+                existing_pks.append(pk)
+                self.expenses_skipped += 1
+
+        # Only the rows this statement wrote come back, so an expense that a
+        # concurrent import of the same backup wrote first is skipped here
+        # rather than counted, and its totals are not applied twice
+        inserted = dict(_insert_returning(new, ['fingerprint', 'id']))
+        created = []
+        raced = []
+        for expense in new:
+            if expense.fingerprint in inserted:
+                expense.pk = inserted[expense.fingerprint]
+                created.append(expense)
+            else:
+                raced.append(expense)
+        self.expenses_created += len(created)
+        if raced:
+            # Find the other import's rows so the payments go to them
+            winners = {}
+            for pk, key, sync_id in RecurringExpense.objects.filter(user=self.user).filter(
+                Q(fingerprint__in=[expense.fingerprint for expense in raced]) |
+                Q(sync_id__in=[expense.sync_id for expense in raced])
+            ).values_list('pk', 'fingerprint', 'sync_id'):
+                winners[key] = winners[sync_id] = pk
+            for expense in raced:
+                expense.pk = winners.get(expense.fingerprint, winners.get(expense.sync_id))
+                self.expenses_skipped += 1
+
+        # The raw inserts skip the signals that maintain the category totals
+        deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+        for expense in created:
+            if expense.is_active:
+                deltas[expense.category_id][0] += expense.amount
+                deltas[expense.category_id][1] += 1
+        add_category_totals(self.user.pk, deltas)
+
+        # Only the expenses that already existed can have the payments already.
+        # Payments are recorded once per expense by content and by sync_id, so
+        # a payment edited since the backup was taken is not added again.
+        # Payments of the other import's expenses are left to ON CONFLICT.
+        recorded = set()
+        if existing_pks:
+            for expense_id, key, sync_id in ExpensePayment.objects.filter(
+                recurring_expense__in=existing_pks
+            ).values_list('recurring_expense_id', 'fingerprint', 'sync_id'):
+                recorded.update([(expense_id, key), (expense_id, sync_id)])
+        payments = []
+        for expense, payments_data in self._pending.values():
+            if expense.pk is None:
+                # A conflicting row that could not be found again
+                continue
+            for payment_data in payments_data:
+                payment = ExpensePayment(
+                    recurring_expense=expense,
+                    user=self.user,
+                    payment_date=datetime.date.fromisoformat(payment_data['payment_date']),
+                    amount_paid=Decimal(payment_data['amount_paid']),
+                    notes=payment_data.get('notes', ''),
+                    sync_id=uuid.UUID(payment_data['sync_id']) if payment_data.get('sync_id') else uuid.uuid4()
+                )
+                keys = [(expense.pk, self._payment_fingerprint.compute(payment)), (expense.pk, payment.sync_id)]
+                if not recorded.intersection(keys):
+                    recorded.update(keys)
+                    payments.append(payment)
+        self.payments_created += len(_insert_returning(payments, ['id']))
+        if created or payments:
+            bump_user_version(self.user.pk)
+
+
+def _insert_returning(objs, returning):
+    """INSERT OR IGNORE the objects, returning the given fields of the rows written
+
+    Unlike bulk_create(ignore_conflicts=True), this tells which rows were
+    dropped as conflicts: those are left out of the result. Fields are
+    filled in by pre_save() as bulk_create() does, but no signals are sent.
+    """
+    if not objs:
+        return []
+    model = type(objs[0])
+    opts = model._meta
+    using = router.db_for_write(model)
+    connection = connections[using]
+    fields = [field for field in opts.concrete_fields if field is not opts.pk]
+    returning_fields = [opts.get_field(name) for name in returning]
+    batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    rows = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            query = InsertQuery(model, on_conflict=OnConflict.IGNORE)
+            query.insert_values(fields, objs[start:start + batch_size])
+            compiler = query.get_compiler(using=using)
+            compiler.returning_fields = returning_fields
+            for sql, params in compiler.as_sql():
+                cursor.execute(sql, params)
+                rows.extend(cursor.fetchall())
+    return rows
+
+
+def apply_delta(user, data):
+    """Apply a delta export (see expenses.sync) to the user's data
+
+    Tombstoned expenses and payments are deleted first. Every expense and
+    payment in the delta existed when it was exported, so each is then
+    updated when its sync_id is known and created otherwise. Rows are saved
+    one at a time so the signal handlers keep the totals and caches
+    current, which is cheap for a delta but not meant for full backups.
+    Callers are expected to wrap the call in a transaction. Returns the
+    number of rows created, updated and deleted.
+    """
+    if not all(key in data for key in ['categories', 'expenses', 'payments', 'deleted']):
+        raise InvalidBackup("Invalid delta file format. Missing required data.")
+    counts = dict.fromkeys([
+        'expenses_created', 'expenses_updated', 'expenses_deleted',
+        'payments_created', 'payments_updated', 'payments_deleted',
+    ], 0)
+
+    deleted = data['deleted']
+    for sync_id in deleted.get('payments', []):
+        payment = ExpensePayment.objects.filter(recurring_expense__user=user, sync_id=sync_id).first()
+        if payment is not None:
+            payment.delete()
+            counts['payments_deleted'] += 1
+    for expense in RecurringExpense.objects.filter(user=user, sync_id__in=deleted.get('expenses', [])):
+        expense.delete()
+        counts['expenses_deleted'] += 1
+
+    # Categories are matched by ID within the delta and by name, as in a full import
+    importer = BackupImporter(user)
+    importer.add_categories(data['categories'])
+    amount_field = RecurringExpense._meta.get_field('amount')
+    expenses = {
+        expense.sync_id: expense
+        for expense in RecurringExpense.objects.filter(
+            user=user, sync_id__in=[row['sync_id'] for row in data['expenses']]
+        )
+    }
+    for expense_data in data['expenses']:
+        sync_id = uuid.UUID(expense_data['sync_id'])
+        expense = expenses.get(sync_id)
+        if expense is None:
+            expense = expenses[sync_id] = RecurringExpense(user=user, sync_id=sync_id)
+            counts['expenses_created'] += 1
+        else:
+            counts['expenses_updated'] += 1
+        expense.name = expense_data['name']
+        expense.amount = amount_field.to_python(expense_data['amount'])
+        expense.category = importer.resolve_category(expense_data)
+        expense.frequency = expense_data['frequency']
+        expense.due_date = datetime.date.fromisoformat(expense_data['due_date'])
+        expense.description = expense_data.get('description', '')
+        expense.is_active = expense_data.get('is_active', True)
+        expense.save()
+
+    # Payments of expenses that the delta did not change are looked up together
+    missing = {uuid.UUID(row['expense_sync_id']) for row in data['payments']} - expenses.keys()
+    if missing:
+        for expense in RecurringExpense.objects.filter(user=user, sync_id__in=missing):
+            expenses[expense.sync_id] = expense
+    payments = {
+        payment.sync_id: payment
+        for payment in ExpensePayment.objects.filter(
+            recurring_expense__user=user, sync_id__in=[row['sync_id'] for row in data['payments']]
+        )
+    }
+    for payment_data in data['payments']:
+        expense = expenses.get(uuid.UUID(payment_data['expense_sync_id']))
+        if expense is None:
+            raise InvalidBackup("Invalid delta file. A payment belongs to an unknown expense.")
+        sync_id = uuid.UUID(payment_data['sync_id'])
+        payment = payments.get(sync_id)
+        if payment is None:
+            payment = payments[sync_id] = ExpensePayment(sync_id=sync_id)
+            counts['payments_created'] += 1
+        else:
+            counts['payments_updated'] += 1
+        payment.recurring_expense = expense
+        payment.payment_date = datetime.date.fromisoformat(payment_data['payment_date'])
+        payment.amount_paid = Decimal(payment_data['amount_paid'])
+        payment.notes = payment_data.get('notes', '')
+        payment.save()
+
+    return counts
@@ -0,0 +1,197 @@
+"""Background execution of backup imports
+
+Uploads are saved as ImportJob rows and processed outside the request,
+either by a small in-process thread pool (EXPENSES_IMPORT_WORKER_THREADS)
+or by ``manage.py run_import_worker``. Both claim a job with a conditional
+UPDATE, so a job is only ever run by one worker at a time.
+
+A running job writes its progress to its row after every batch, which
+also refreshes updated_at. A job that has not done so for
+EXPENSES_IMPORT_STALE_SECONDS lost its worker, for example to a restart,
+and is put back in the queue by run_pending_jobs() or when its status is
+polled. Imports match rows by fingerprint, so the rerun adds only what the
+first attempt had not written. After EXPENSES_IMPORT_MAX_ATTEMPTS the job
+is marked failed instead.
+"""
+import csv
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .importers import BackupImporter, InvalidBackup, open_backup
+from .models import ImportJob
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.EXPENSES_IMPORT_WORKER_THREADS,
+            thread_name_prefix='expenses-import'
+        )
+    return _executor
+
+
+def _schedule(job_id):
+    """Hand a pending job to the thread pool, if there is one, once committed"""
+    if settings.EXPENSES_IMPORT_WORKER_THREADS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job_id))
+
+
+def enqueue_import(user, upload):
+    """Save an uploaded backup as a pending job and schedule it once committed"""
+    job = ImportJob.objects.create(user=user, file=upload)
+    _schedule(job.pk)
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_import_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def describe_import_error(exc):
+    """Turn an import failure into a message for the user"""
+    if isinstance(exc, InvalidBackup):
+        return str(exc)
+    if isinstance(exc, json.JSONDecodeError):
+        return "Invalid JSON file. Please upload a valid backup file."
+    if isinstance(exc, (csv.Error, gzip.BadGzipFile, EOFError, UnicodeDecodeError)):
+        return "Invalid backup file. Please upload a valid backup file."
+    if isinstance(exc, ValidationError):
+        return f"Validation error: {str(exc)}"
+    return f"Error importing data: {str(exc)}"
+
+
+def run_import_job(job_id):
+    """Run a pending import job, returning False if it was already claimed"""
+    claimed = ImportJob.objects.filter(pk=job_id, status='PENDING').update(
+        status='RUNNING',
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = ImportJob.objects.select_related('user').get(pk=job_id)
+
+    # Each batch has been committed by the time it is reported, so the row
+    # shows the progress and updated_at shows the worker is still alive
+    def report_progress(count):
+        ImportJob.objects.filter(pk=job_id).update(records_processed=count, updated_at=timezone.now())
+
+    # Batches commit as they are written rather than in one transaction
+    # that would hold the write lock for the whole import
+    importer = BackupImporter(job.user, progress=report_progress)
+    try:
+        with job.file.open('rb') as import_file:
+            importer.import_stream(open_backup(import_file))
+    except Exception as e:
+        job.status = 'FAILED'
+        job.error = describe_import_error(e)
+        job.records_processed = importer.records_processed
+        if importer.records_processed:
+            # Rows are matched by fingerprint, so a retry adds only the rest
+            job.error += (
+                f" The first {importer.records_processed} records were imported;"
+                " importing the file again adds the rest."
+            )
+    else:
+        job.status = 'DONE'
+        job.records_processed = importer.records_processed
+        job.expenses_created = importer.expenses_created
+        job.expenses_skipped = importer.expenses_skipped
+        job.payments_created = importer.payments_created
+
+    # The upload is no longer needed once the job has finished
+    job.file.delete(save=False)
+    job.finished_at = timezone.now()
+    job.save()
+    return True
+
+
+def is_stale(job):
+    """Whether a running job has stopped reporting progress"""
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPENSES_IMPORT_STALE_SECONDS)
+    return job.status == 'RUNNING' and job.updated_at < cutoff
+
+
+def requeue_stale_jobs():
+    """Put running jobs that lost their worker back in the queue
+    
+    Jobs that have already been tried EXPENSES_IMPORT_MAX_ATTEMPTS times
+    are marked failed instead. Returns the IDs of the requeued jobs.
+    """
+    now = timezone.now()
+    # Conditional on updated_at, so a worker that reports progress in the
+    # meantime keeps its job
+    stale = ImportJob.objects.filter(
+        status='RUNNING',
+        updated_at__lt=now - timedelta(seconds=settings.EXPENSES_IMPORT_STALE_SECONDS)
+    )
+    for job in stale.filter(attempts__gte=settings.EXPENSES_IMPORT_MAX_ATTEMPTS):
+        failed = stale.filter(pk=job.pk).update(
+            status='FAILED',
+            error=(
+                f"The import stopped {job.attempts} times without finishing. Records it had"
+                " imported were kept; importing the file again adds the rest."
+            ),
+            file='',
+            updated_at=now,
+            finished_at=now
+        )
+        if failed:
+            # As for a finished job, the upload is no longer needed
+            job.file.delete(save=False)
+
+    requeued = []
+    for job_id in stale.values_list('pk', flat=True):
+        if stale.filter(pk=job_id).update(status='PENDING', updated_at=now):
+            requeued.append(job_id)
+    return requeued
+
+
+def recover_stale_jobs():
+    """Requeue stale jobs and hand them to the thread pool, if there is one"""
+    for job_id in requeue_stale_jobs():
+        _schedule(job_id)
+
+
+def run_pending_jobs():
+    """Run pending jobs, and stale ones again, oldest first and return how many were processed"""
+    requeue_stale_jobs()
+    processed = 0
+    job_ids = list(
+        ImportJob.objects.filter(status='PENDING').order_by('created_at').values_list('pk', flat=True)
+    )
+    for job_id in job_ids:
+        if run_import_job(job_id):
+            processed += 1
+    return processed
+
+
+def job_status(job):
+    """Describe a job for the JSON status endpoint"""
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'records_processed': job.records_processed,
+        'expenses_created': job.expenses_created,
+        'expenses_skipped': job.expenses_skipped,
+        'payments_created': job.payments_created,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from expenses.bench import async_views, invalidate_user_data, load_asgi, load_wsgi, scratch_database, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of the sync views under WSGI with the async views under ASGI, "
+        "with the user's cached data invalidated before each request and then warm"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=50, help="Expenses per user")
+        parser.add_argument('--payments', type=int, default=100, help="Payments per expense")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per view and server")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            with scratch_database():
+                user = seed_dataset(
+                    users=options['users'],
+                    expenses=options['expenses'],
+                    payments=options['payments'],
+                )[0]
+                client = Client()
+                client.force_login(user)
+                cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+                load = {'concurrency': options['concurrency'], 'requests': options['requests']}
+                cold = dict(load, before=lambda: invalidate_user_data(user))
+                for name in ['expenses:home', 'expenses:expense_chart_data']:
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    cache.clear()
+                    self.report('WSGI, sync', load_wsgi(reverse(name), cookie, **cold))
+                    self.report('WSGI, sync, warm', load_wsgi(reverse(name), cookie, **load))
+                    with async_views():
+                        cache.clear()
+                        self.report('ASGI, async', load_asgi(reverse(name), cookie, **cold))
+                        self.report('ASGI, async, warm', load_asgi(reverse(name), cookie, **load))
+        finally:
+            teardown_test_environment()
+
+    def report(self, label, result):
+        self.stdout.write(
+            f"  {label}: {result['requests_per_s']:.0f} req/s, "
+            f"median {result['median_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms"
+        )
@@ -0,0 +1,81 @@
+import json
+import platform
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from expenses.bench import bench_views, check_thresholds, scratch_database, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database and time the main views through the test client, "
+        "with the user's cached data invalidated before each request and then warm"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=50, help="Expenses per user")
+        parser.add_argument('--payments', type=int, default=100, help="Payments per expense")
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument(
+            '--thresholds',
+            help="JSON file of per-view limits, e.g. {\"home\": {\"p95_ms\": 50, \"queries\": 6}}"
+        )
+
+    def handle(self, *args, **options):
+        thresholds = None
+        if options['thresholds']:
+            with open(options['thresholds']) as f:
+                thresholds = json.load(f)
+
+        dataset = {key: options[key] for key in ['users', 'expenses', 'payments', 'categories', 'seed']}
+        setup_test_environment()
+        try:
+            with scratch_database():
+                cache.clear()
+                total = options['users'] * options['expenses'] * options['payments']
+                self.stdout.write(f"Seeding {total} payments...")
+                user = seed_dataset(**dataset)[0]
+                results = bench_views(
+                    user,
+                    repeat=options['repeat'],
+                    import_expenses=options['expenses'],
+                    import_payments=options['payments'],
+                )
+        finally:
+            teardown_test_environment()
+
+        for view, result in results.items():
+            self.stdout.write(
+                f"{view}: median {result['median_ms']:.1f}ms, "
+                f"p95 {result['p95_ms']:.1f}ms, {result['queries']} queries"
+            )
+            if 'warm_median_ms' in result:
+                self.stdout.write(
+                    f"  warm: median {result['warm_median_ms']:.1f}ms, "
+                    f"p95 {result['warm_p95_ms']:.1f}ms, {result['warm_queries']} queries"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'date': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'dataset': dict(dataset, repeat=options['repeat']),
+                    'results': results,
+                }, f, indent=4)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if thresholds is not None:
+            failures = check_thresholds(results, thresholds)
+            if failures:
+                raise CommandError("Regressions found:\n  " + "\n  ".join(failures))
+            self.stdout.write(self.style.SUCCESS("All measurements are within the thresholds"))
@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from expenses.bench import build_backup, import_row_by_row, scratch_database
+from expenses.importers import BackupImporter
+
+
+class Command(BaseCommand):
+    help = "Compare import throughput of the batched importer against the row-by-row path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=500)
+        parser.add_argument('--payments', type=int, default=100, help="Payments per expense")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        data = build_backup(expenses=options['expenses'], payments=options['payments'])
+        rows = options['expenses'] * (options['payments'] + 1)
+
+        def batched(user, data):
+            BackupImporter(user, batch_size=options['batch_size']).import_data(data)
+
+        with scratch_database():
+            for label, run in [('row by row', import_row_by_row), ('batched', batched)]:
+                user = User.objects.create(username=label.replace(' ', '_'))
+                start = time.perf_counter()
+                statements = []
+
+                def count(execute, sql, params, many, context):
+                    statements.append(sql)
+                    return execute(sql, params, many, context)
+
+                with connection.execute_wrapper(count), transaction.atomic():
+                    run(user, data)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{label}: {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), "
+                    f"{len(statements)} statements"
+                )
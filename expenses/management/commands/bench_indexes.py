@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.bench import scratch_database, seed_dataset, time_call
+from expenses.models import CategoryTotal, RecurringExpense, ExpensePayment
+
+
+def hot_queries(user):
+    """The home, chart and export queries, keyed by a short label"""
+    today = timezone.now().date()
+    return {
+        'home: category totals': CategoryTotal.objects.filter(
+            user=user, expense_count__gt=0
+        ).select_related('category').order_by('category'),
+        'home: active expenses': RecurringExpense.objects.filter(
+            user=user, is_active=True
+        ).order_by('due_date'),
+        'home: upcoming': RecurringExpense.objects.filter(
+            user=user, is_active=True, due_date__lte=today + timedelta(days=30)
+        ).order_by('due_date')[:5],
+        'home: recent payments': ExpensePayment.objects.filter(
+            recurring_expense__user=user, payment_date__gte=today - timedelta(days=30)
+        ).select_related('recurring_expense').order_by('-payment_date'),
+        'chart: totals per category': CategoryTotal.objects.filter(
+            user=user, category__isnull=False, expense_count__gt=0
+        ).select_related('category').order_by('category'),
+        'export: payments': ExpensePayment.objects.filter(recurring_expense__user=user),
+    }
+
+
+class Command(BaseCommand):
+    help = "Seed a scratch database and compare query plans with and without the hot-path indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--expenses', type=int, default=100, help="Expenses per user")
+        parser.add_argument('--payments', type=int, default=1000, help="Payments per expense")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with scratch_database() as connection:
+            total = options['users'] * options['expenses'] * options['payments']
+            self.stdout.write(f"Seeding {total} payments...")
+            user = seed_dataset(
+                users=options['users'],
+                expenses=options['expenses'],
+                payments=options['payments'],
+            )[0]
+
+            self.report("Without indexes", connection, user, options['repeat'], drop=True)
+            self.report("With indexes", connection, user, options['repeat'], drop=False)
+
+    def report(self, title, connection, user, repeat, drop):
+        models = [RecurringExpense, ExpensePayment]
+        if drop:
+            with connection.schema_editor() as editor:
+                for model in models:
+                    for index in model._meta.indexes:
+                        editor.remove_index(model, index)
+        else:
+            with connection.schema_editor() as editor:
+                for model in models:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for label, queryset in hot_queries(user).items():
+            median, p95 = time_call(lambda: list(queryset.all()), repeat=repeat)
+            self.stdout.write(f"  {label}: median {median:.1f}ms, p95 {p95:.1f}ms")
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"      {line}")
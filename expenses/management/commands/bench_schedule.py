@@ -0,0 +1,81 @@
+import random
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.bench import FREQUENCIES
+from expenses.schedule import occurrences
+
+STEPS = {
+    'DAILY': relativedelta(days=1),
+    'WEEKLY': relativedelta(weeks=1),
+    'MONTHLY': relativedelta(months=1),
+    'QUARTERLY': relativedelta(months=3),
+    'YEARLY': relativedelta(years=1),
+}
+
+
+def occurrences_one_by_one(expenses, start, end):
+    """Step every expense with relativedelta, as a per-expense loop would"""
+    for expense in expenses:
+        step = STEPS[expense.frequency]
+        k = 0
+        current = expense.due_date
+        while current < end:
+            if current >= start:
+                yield expense, current
+            k += 1
+            current = expense.due_date + step * k
+
+
+class Command(BaseCommand):
+    help = "Time the batched schedule engine over many expenses and a multi-year window"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=100000)
+        parser.add_argument('--years', type=int, default=5)
+        parser.add_argument(
+            '--frequencies', default=','.join(FREQUENCIES),
+            help="Comma separated frequencies to draw from"
+        )
+        parser.add_argument('--baseline', type=int, default=1000, help="Expenses to run through the per-expense loop")
+
+    def handle(self, *args, **options):
+        frequencies = options['frequencies'].split(',')
+        if not set(frequencies) <= set(FREQUENCIES):
+            raise CommandError(f"Frequencies must be among {', '.join(FREQUENCIES)}")
+
+        rng = random.Random(0)
+        start = date.today()
+        end = start + relativedelta(years=options['years'])
+        expenses = [
+            SimpleNamespace(
+                id=i,
+                frequency=rng.choice(frequencies),
+                due_date=start + timedelta(days=rng.randint(-800, 400)),
+            )
+            for i in range(options['expenses'])
+        ]
+
+        began = time.perf_counter()
+        count = sum(1 for _ in occurrences(expenses, start, end))
+        elapsed = time.perf_counter() - began
+        self.stdout.write(
+            f"batched: {len(expenses)} expenses, {count} occurrences in {elapsed:.2f}s "
+            f"({count / elapsed:,.0f} occurrences/s)"
+        )
+
+        sample = expenses[:options['baseline']]
+        began = time.perf_counter()
+        expected = sorted((e.id, d) for e, d in occurrences_one_by_one(sample, start, end))
+        elapsed = time.perf_counter() - began
+        self.stdout.write(
+            f"one by one: {len(sample)} expenses, {len(expected)} occurrences in {elapsed:.2f}s "
+            f"({len(expected) / elapsed:,.0f} occurrences/s)"
+        )
+
+        if sorted((e.id, d) for e, d in occurrences(sample, start, end)) != expected:
+            raise CommandError("Batched schedule does not match the per-expense loop")
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.totals import rebuild_category_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-user category totals from the expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users (default: everyone)")
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = list(User.objects.filter(username__in=options['usernames']))
+            missing = set(options['usernames']) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        count = rebuild_category_totals(users)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} category totals"))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from expenses.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued backup imports, retrying ones whose worker stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to wait between polls")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending_jobs()
+            if processed:
+                self.stdout.write(f"Processed {processed} import job(s)")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,187 @@
+"""In-process request metrics in the Prometheus text exposition format
+
+MetricsMiddleware times every request and, through a database execute
+wrapper, counts the queries it runs and the time spent in them. Samples are
+aggregated per URL name in this process only; with several workers each
+one reports its own numbers and Prometheus sums them. Recording a request
+costs a few perf_counter() calls and one short lock, so it can stay on.
+"""
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+
+from .cache import cache_stats
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNRESOLVED = '<unresolved>'
+
+
+class _ViewStats:
+    __slots__ = ('buckets', 'count', 'duration', 'queries', 'query_duration')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+
+
+class MetricsRegistry:
+    """Per view totals, safe to update from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, duration, queries, query_duration):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = _ViewStats()
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.count += 1
+            stats.duration += duration
+            stats.queries += queries
+            stats.query_duration += query_duration
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def snapshot(self):
+        """Return {view: _ViewStats} copies taken under the lock"""
+        with self._lock:
+            copies = {}
+            for view, stats in self._views.items():
+                copy = _ViewStats()
+                copy.buckets = list(stats.buckets)
+                copy.count = stats.count
+                copy.duration = stats.duration
+                copy.queries = stats.queries
+                copy.query_duration = stats.query_duration
+                copies[view] = copy
+            return copies
+
+
+registry = MetricsRegistry()
+
+
+class _QueryTimer:
+    """Database execute wrapper that counts queries and their wall time"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Stay async under ASGI so async views are not pushed onto a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self._wrap_connections(stack, timer)
+            response = self.get_response(request)
+        self._record(request, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        # Connections belong to a thread, so the wrappers are installed on the
+        # thread that the async ORM runs this request's queries on
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(self._wrap_connections)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self._record(request, time.perf_counter() - start, timer)
+        return response
+
+    def _wrap_connections(self, stack, timer):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+
+    def _record(self, request, duration, timer):
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else UNRESOLVED
+        registry.record(view, duration, timer.queries, timer.duration)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Render the collected metrics in the Prometheus text format"""
+    lines = [
+        '# HELP expenses_request_duration_seconds Request latency by URL name.',
+        '# TYPE expenses_request_duration_seconds histogram',
+    ]
+    views = sorted(registry.snapshot().items())
+    for view, stats in views:
+        label = f'view="{_escape(view)}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append(f'expenses_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'expenses_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+        lines.append(f'expenses_request_duration_seconds_sum{{{label}}} {_number(stats.duration)}')
+        lines.append(f'expenses_request_duration_seconds_count{{{label}}} {stats.count}')
+
+    lines += [
+        '# HELP expenses_db_queries_total Database queries run while serving requests, by URL name.',
+        '# TYPE expenses_db_queries_total counter',
+    ]
+    for view, stats in views:
+        lines.append(f'expenses_db_queries_total{{view="{_escape(view)}"}} {stats.queries}')
+
+    lines += [
+        '# HELP expenses_db_query_duration_seconds_total Time spent in database queries, by URL name.',
+        '# TYPE expenses_db_query_duration_seconds_total counter',
+    ]
+    for view, stats in views:
+        lines.append(
+            f'expenses_db_query_duration_seconds_total{{view="{_escape(view)}"}} {_number(stats.query_duration)}'
+        )
+
+    cache = cache_stats()
+    lines += [
+        '# HELP expenses_cache_lookups_total Derived data cache lookups, by result.',
+        '# TYPE expenses_cache_lookups_total counter',
+        f'expenses_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+        f'expenses_cache_lookups_total{{result="miss"}} {cache["misses"]}',
+    ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expensepayment',
+            index=models.Index(fields=['recurring_expense', 'payment_date'], name='payment_expense_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringexpense',
+            index=models.Index(fields=['user', 'is_active', 'due_date'], name='expense_user_active_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringexpense',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'due_date'], name='expense_active_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringexpense',
+            index=models.Index(fields=['user', 'category'], name='expense_user_category_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:26
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_category_totals(apps, schema_editor):
+    RecurringExpense = apps.get_model('expenses', 'RecurringExpense')
+    CategoryTotal = apps.get_model('expenses', 'CategoryTotal')
+    rows = RecurringExpense.objects.filter(is_active=True).values('user', 'category').annotate(
+        total=Sum('amount'),
+        expense_count=Count('id')
+    ).order_by()
+    CategoryTotal.objects.bulk_create([
+        CategoryTotal(
+            user_id=row['user'],
+            category_id=row['category'],
+            total=row['total'],
+            expense_count=row['expense_count']
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_importjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('user', 'category'), name='unique_user_category_total'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user',), name='unique_user_uncategorized_total')],
+            },
+        ),
+        migrations.RunPython(populate_category_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_categorytotal'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recurringexpense',
+            index=models.Index(fields=['user', 'due_date', 'id'], name='expense_user_due_id_idx'),
+        ),
+    ]
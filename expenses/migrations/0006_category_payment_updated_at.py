@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_payment_updated_at(apps, schema_editor):
+    # Creation is the latest change known for payments that already exist
+    ExpensePayment = apps.get_model('expenses', 'ExpensePayment')
+    ExpensePayment.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_keyset_pagination_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='expensepayment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_payment_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_category_payment_updated_at'),
+    ]
+
+    # Existing rows need distinct values, so the columns start out nullable
+    # and are filled in and tightened by the next two migrations
+    operations = [
+        migrations.AddField(
+            model_name='recurringexpense',
+            name='sync_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensepayment',
+            name='sync_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+    ]
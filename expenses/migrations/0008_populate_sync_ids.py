@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:33
+
+import uuid
+
+from django.db import migrations
+
+
+def populate_sync_ids(apps, schema_editor):
+    for model_name in ['RecurringExpense', 'ExpensePayment']:
+        model = apps.get_model('expenses', model_name)
+        rows = list(model.objects.filter(sync_id__isnull=True).only('pk'))
+        for row in rows:
+            row.sync_id = uuid.uuid4()
+        model.objects.bulk_update(rows, ['sync_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_add_sync_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_sync_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:34
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_populate_sync_ids'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('EXPENSE', 'Expense'), ('PAYMENT', 'Payment')], max_length=10)),
+                ('sync_id', models.UUIDField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='expensepayment',
+            name='sync_id',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='recurringexpense',
+            name='sync_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='expensepayment',
+            index=models.Index(fields=['updated_at'], name='payment_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringexpense',
+            index=models.Index(fields=['user', 'updated_at'], name='expense_user_updated_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recurringexpense',
+            constraint=models.UniqueConstraint(fields=('user', 'sync_id'), name='unique_user_expense_sync_id'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:05
+
+import expenses.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_sync_ids_tombstones'),
+    ]
+
+    # Nullable until the next migration has filled in existing rows
+    operations = [
+        migrations.AddField(
+            model_name='recurringexpense',
+            name='fingerprint',
+            field=expenses.models.FingerprintField(null=True, sources=('name', 'amount')),
+        ),
+        migrations.AddField(
+            model_name='expensepayment',
+            name='fingerprint',
+            field=expenses.models.FingerprintField(null=True, sources=('payment_date', 'amount_paid', 'notes')),
+        ),
+    ]
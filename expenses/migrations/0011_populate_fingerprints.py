@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:05
+
+import hashlib
+
+from django.db import migrations
+
+
+def fingerprint(*values):
+    # expenses.models.fingerprint() as of this migration
+    parts = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def populate(model, owner, sources):
+    """Fingerprint every row, keeping rows that repeat an owner's content apart
+
+    The first row with given content gets the plain fingerprint. Later
+    repeats, which the unique constraint would reject, get one salted with
+    their primary key, so no existing data has to be merged or dropped.
+    """
+    seen = set()
+    rows = list(model.objects.order_by('pk').only('pk', owner, *sources))
+    for row in rows:
+        value = fingerprint(*(getattr(row, source) for source in sources))
+        if (getattr(row, owner), value) in seen:
+            value = fingerprint(*(getattr(row, source) for source in sources), f'duplicate {row.pk}')
+        seen.add((getattr(row, owner), value))
+        row.fingerprint = value
+    model.objects.bulk_update(rows, ['fingerprint'], batch_size=500)
+
+
+def populate_fingerprints(apps, schema_editor):
+    populate(apps.get_model('expenses', 'RecurringExpense'), 'user_id', ['name', 'amount'])
+    populate(
+        apps.get_model('expenses', 'ExpensePayment'),
+        'recurring_expense_id',
+        ['payment_date', 'amount_paid', 'notes']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_add_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_fingerprints, migrations.RunPython.noop),
+    ]
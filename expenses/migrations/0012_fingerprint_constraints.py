@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:05
+
+import expenses.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0011_populate_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recurringexpense',
+            name='fingerprint',
+            field=expenses.models.FingerprintField(sources=('name', 'amount')),
+        ),
+        migrations.AlterField(
+            model_name='expensepayment',
+            name='fingerprint',
+            field=expenses.models.FingerprintField(sources=('payment_date', 'amount_paid', 'notes')),
+        ),
+        migrations.AddConstraint(
+            model_name='recurringexpense',
+            constraint=models.UniqueConstraint(fields=('user', 'fingerprint'), name='unique_user_expense_fingerprint', violation_error_message='An expense with this name and amount already exists.'),
+        ),
+        migrations.AddConstraint(
+            model_name='expensepayment',
+            constraint=models.UniqueConstraint(fields=('recurring_expense', 'fingerprint'), name='unique_expense_payment_fingerprint', violation_error_message='This payment has already been recorded.'),
+        ),
+    ]
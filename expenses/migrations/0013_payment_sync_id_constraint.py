@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:19
+
+import uuid
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def separate_repeated_sync_ids(apps, schema_editor):
+    """Give payments imported twice under one sync_id a new one, keeping the oldest row's"""
+    ExpensePayment = apps.get_model('expenses', 'ExpensePayment')
+    repeated = ExpensePayment.objects.values('recurring_expense', 'sync_id').annotate(
+        rows=Count('pk')
+    ).filter(rows__gt=1)
+    for group in repeated:
+        rows = list(ExpensePayment.objects.filter(
+            recurring_expense=group['recurring_expense'], sync_id=group['sync_id']
+        ).order_by('pk').only('pk')[1:])
+        for row in rows:
+            row.sync_id = uuid.uuid4()
+        ExpensePayment.objects.bulk_update(rows, ['sync_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_fingerprint_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(separate_repeated_sync_ids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='expensepayment',
+            constraint=models.UniqueConstraint(fields=('recurring_expense', 'sync_id'), name='unique_expense_payment_sync_id'),
+        ),
+    ]
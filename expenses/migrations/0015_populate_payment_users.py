@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:27
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_payment_users(apps, schema_editor):
+    RecurringExpense = apps.get_model('expenses', 'RecurringExpense')
+    ExpensePayment = apps.get_model('expenses', 'ExpensePayment')
+    ExpensePayment.objects.update(user_id=Subquery(
+        RecurringExpense.objects.filter(pk=OuterRef('recurring_expense_id')).values('user_id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0014_add_payment_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_payment_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0015_populate_payment_users'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expensepayment',
+            name='user',
+            field=models.ForeignKey(blank=True, editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='expensepayment',
+            index=models.Index(fields=['user', 'payment_date', 'id'], name='payment_user_date_id_idx'),
+        ),
+    ]
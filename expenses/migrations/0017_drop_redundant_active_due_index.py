@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_payment_user_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recurringexpense',
+            name='expense_user_active_due_idx',
+        ),
+    ]
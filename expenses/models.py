@@ -1,13 +1,81 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Exists, F, OuterRef, Subquery
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
+import hashlib
+import uuid
+
+from .cache import bump_user_version
 
 # Create your models here.
 
+def fingerprint(*values):
+    """A stable digest of the values that identify a row's content"""
+    parts = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+class FingerprintField(models.CharField):
+    """A fingerprint() of other fields, recomputed whenever the row is saved
+    
+    Like auto_now, the value is set in pre_save(), so bulk_create() fills it
+    in too, but QuerySet.update() and save(update_fields=...) without this
+    field leave it stale. Rows that repeated another row's content when the
+    field was added were salted with their primary key by migration 0011;
+    they keep that fingerprint until one of the source fields changes.
+    """
+    
+    def __init__(self, *args, sources=(), **kwargs):
+        self.sources = tuple(sources)
+        kwargs.setdefault('max_length', 64)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+    
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['sources'] = self.sources
+        del kwargs['max_length'], kwargs['editable']
+        return name, path, args, kwargs
+    
+    def compute(self, model_instance):
+        values = []
+        for source in self.sources:
+            field = model_instance._meta.get_field(source)
+            value = field.to_python(getattr(model_instance, field.attname))
+            if isinstance(field, models.DecimalField):
+                # '75', '75.0' and '75.00' are the same amount
+                value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+            values.append(value)
+        if model_instance.pk is not None:
+            salted = fingerprint(*values, f'duplicate {model_instance.pk}')
+            if getattr(model_instance, self.attname) == salted:
+                return salted
+        return fingerprint(*values)
+    
+    def pre_save(self, model_instance, add):
+        value = self.compute(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
+
+def _validate_fingerprint(instance, exclude):
+    """Fill in the fingerprint before validation, so forms check its unique constraint
+    
+    Forms exclude the field because it isn't editable; it is checked unless
+    one of the fields it is computed from is excluded as well.
+    """
+    exclude = set(exclude or ())
+    field = instance._meta.get_field('fingerprint')
+    if not exclude.intersection(field.sources):
+        instance.fingerprint = field.compute(instance)
+        exclude.discard('fingerprint')
+    return exclude
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Categories"
@@ -15,6 +83,54 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class RecurringExpenseQuerySet(models.QuerySet):
+    # Columns that list views render
+    ROW_FIELDS = ('id', 'name', 'amount', 'category_name', 'frequency', 'due_date', 'is_active')
+    
+    def for_user(self, user):
+        return self.filter(user=user)
+    
+    def active(self):
+        return self.filter(is_active=True)
+    
+    def list_rows(self):
+        """Expenses for list views, with their category and without long text columns"""
+        return self.select_related('category').defer('description', 'category__description')
+    
+    def rows(self, *extra):
+        """Read-only named tuples of ROW_FIELDS plus any ``extra`` annotations
+        
+        Rows carry ``category_name`` instead of a Category, so rendering them
+        never touches another table or builds model instances.
+        """
+        return self.annotate(category_name=F('category__name')).values_list(
+            *self.ROW_FIELDS, *extra, named=True
+        )
+    
+    def with_payment_status(self, since=None):
+        """Annotate whether each expense is paid for its current period
+        
+        An expense is satisfied by a payment made on or after its due date,
+        within the window starting at ``since`` (30 days ago by default),
+        that covers the full amount. The latest payment's date and amount
+        are annotated as ``last_payment_date`` and ``last_amount_paid``.
+        """
+        if since is None:
+            since = timezone.now().date() - timedelta(days=30)
+        
+        payments = ExpensePayment.objects.filter(recurring_expense=OuterRef('pk'))
+        satisfying = payments.filter(
+            payment_date__gte=since,
+            amount_paid__gte=OuterRef('amount')
+        ).filter(payment_date__gte=OuterRef('due_date'))
+        latest = payments.order_by('-payment_date', '-id')
+        
+        return self.annotate(
+            is_satisfied=Exists(satisfying),
+            last_payment_date=Subquery(latest.values('payment_date')[:1]),
+            last_amount_paid=Subquery(latest.values('amount_paid')[:1]),
+        )
+
 class RecurringExpense(models.Model):
     FREQUENCY_CHOICES = [
         ('DAILY', 'Daily'),
@@ -38,12 +154,95 @@ class RecurringExpense(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     is_active = models.BooleanField(default=True)
+    # Identifies the expense across exports, so delta backups can be applied
+    sync_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    # A user has one expense per name and amount, which imports upsert on
+    fingerprint = FingerprintField(sources=['name', 'amount'])
+    
+    objects = RecurringExpenseQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'sync_id'], name='unique_user_expense_sync_id'),
+            models.UniqueConstraint(
+                fields=['user', 'fingerprint'],
+                name='unique_user_expense_fingerprint',
+                violation_error_message='An expense with this name and amount already exists.'
+            ),
+        ]
+        indexes = [
+            # Dashboard lists: active expenses for a user, ordered by due date
+            models.Index(
+                fields=['user', 'due_date'],
+                name='expense_active_due_idx',
+                condition=models.Q(is_active=True)
+            ),
+            # Per-category totals for the chart and export
+            models.Index(fields=['user', 'category'], name='expense_user_category_idx'),
+            # Keyset pages of all of a user's expenses by (due_date, id)
+            models.Index(fields=['user', 'due_date', 'id'], name='expense_user_due_id_idx'),
+            # Delta exports of the expenses changed since a sync token
+            models.Index(fields=['user', 'updated_at'], name='expense_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.amount} ({self.get_frequency_display()})"
+    
+    def save(self, *args, **kwargs):
+        # The signal handlers read the stored row's contribution to the
+        # category totals before the write and apply the difference after
+        # it; one transaction (BEGIN IMMEDIATE on our backend) keeps two
+        # concurrent edits from both subtracting the same old contribution
+        using = kwargs.get('using') or router.db_for_write(RecurringExpense, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+    
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(RecurringExpense, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            # Subtract what the row holds now rather than what this copy was
+            # loaded with, which a concurrent edit may have changed
+            stored = RecurringExpense.objects.using(using).filter(pk=self.pk).values(
+                'user_id', 'category_id', 'amount', 'is_active'
+            ).first()
+            for name, value in (stored or {}).items():
+                setattr(self, name, value)
+            return super().delete(using, keep_parents)
+    
+    def validate_constraints(self, exclude=None):
+        super().validate_constraints(_validate_fingerprint(self, exclude))
+
+def _record_payment_deletions(rows):
+    """Leave a tombstone for each deleted (user_id, sync_id) and invalidate those users"""
+    Tombstone.objects.bulk_create([
+        Tombstone(user_id=user_id, kind='PAYMENT', sync_id=sync_id) for user_id, sync_id in rows
+    ])
+    for user_id in {user_id for user_id, _ in rows}:
+        bump_user_version(user_id)
+
+class ExpensePaymentQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the payments, recording each deletion for delta exports
+        
+        Payments have no delete signal handlers, so that deleting an expense
+        or a user removes its payments in one query instead of loading them.
+        Deleting payments themselves goes through here or
+        ExpensePayment.delete() instead.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = list(self.values_list('user_id', 'sync_id'))
+            result = super().delete()
+            _record_payment_deletions(rows)
+        return result
+    
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class ExpensePayment(models.Model):
     recurring_expense = models.ForeignKey(RecurringExpense, on_delete=models.CASCADE)
+    # The expense's user, copied on save so a user's payments can be paged
+    # through an index without joining the expenses
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, editable=False)
     payment_date = models.DateField()
     amount_paid = models.DecimalField(
         max_digits=10,
@@ -52,6 +251,130 @@ class ExpensePayment(models.Model):
     )
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Identifies the payment across exports, so delta backups can be applied
+    sync_id = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
+    # An expense has one payment per date, amount and notes, which imports upsert on
+    fingerprint = FingerprintField(sources=['payment_date', 'amount_paid', 'notes'])
+    
+    objects = ExpensePaymentQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recurring_expense', 'fingerprint'],
+                name='unique_expense_payment_fingerprint',
+                violation_error_message='This payment has already been recorded.'
+            ),
+            models.UniqueConstraint(fields=['recurring_expense', 'sync_id'], name='unique_expense_payment_sync_id'),
+        ]
+        indexes = [
+            # Recent payments for a user's expenses within a date range
+            models.Index(fields=['recurring_expense', 'payment_date'], name='payment_expense_date_idx'),
+            # Keyset pages of all of a user's payments by (payment_date, id)
+            models.Index(fields=['user', 'payment_date', 'id'], name='payment_user_date_id_idx'),
+            # Delta exports of the payments changed since a sync token
+            models.Index(fields=['updated_at'], name='payment_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.recurring_expense.name} - {self.payment_date} - {self.amount_paid}"
+    
+    def save(self, *args, **kwargs):
+        self.user_id = self.recurring_expense.user_id
+        super().save(*args, **kwargs)
+    
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(ExpensePayment, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            result = super().delete(using, keep_parents)
+            _record_payment_deletions([(self.user_id, self.sync_id)])
+        return result
+    
+    def validate_constraints(self, exclude=None):
+        super().validate_constraints(_validate_fingerprint(self, exclude))
+
+class Tombstone(models.Model):
+    """A deleted expense or payment, kept so delta exports can report the deletion
+    
+    Rows are written by the signal handlers in expenses.signals when an
+    expense or payment is deleted on its own; payments deleted along with
+    their expense are covered by the expense's tombstone.
+    """
+    KIND_CHOICES = [
+        ('EXPENSE', 'Expense'),
+        ('PAYMENT', 'Payment'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    sync_id = models.UUIDField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.sync_id} deleted {self.deleted_at}"
+
+class CategoryTotal(models.Model):
+    """Running total of a user's active expenses in one category
+    
+    Rows are kept up to date by the signal handlers in expenses.signals and
+    can be recomputed with `manage.py rebuild_category_totals`. A null
+    category holds the user's uncategorized expenses.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    expense_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'category'],
+                condition=models.Q(category__isnull=False),
+                name='unique_user_category_total'
+            ),
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(category__isnull=True),
+                name='unique_user_uncategorized_total'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.category or 'Uncategorized'}: {self.total}"
+
+class ImportJob(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file = models.FileField(upload_to='imports/')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    records_processed = models.PositiveIntegerField(default=0)
+    expenses_created = models.PositiveIntegerField(default=0)
+    expenses_skipped = models.PositiveIntegerField(default=0)
+    payments_created = models.PositiveIntegerField(default=0)
+    # How many times a worker has claimed the job; stale jobs are retried
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # The worker picks up pending jobs oldest first
+            models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Import #{self.pk} by {self.user} ({self.get_status_display()})"
@@ -0,0 +1,143 @@
+"""Route reporting reads to a read-only replica
+
+Set EXPENSES_READ_REPLICA to the alias of a replica database, such as a
+periodically refreshed copy of the SQLite file. Reads of expenses models
+made inside use_replica() (or a view decorated with replica_view) then go
+to that alias. Everything else, including sessions and users, stays on the
+primary.
+
+Once a request writes anything it is pinned to the primary for the rest of
+the request, and ReplicaPinningMiddleware sets a short-lived cookie so the
+same browser keeps reading from the primary until the replica has caught
+up.
+
+Views whose results are cached behind the user's data version, such as the
+chart and the forecast, must not use the replica: a value read from a
+lagging replica would be stored under the current version and served until
+the user's next change rather than until the replica catches up.
+"""
+import contextvars
+import functools
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'expenses_pin_primary'
+
+
+class _RoutingState:
+    __slots__ = ('replica', 'pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.replica = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+# A mutable object rather than plain flags, so that a write made in a
+# sync_to_async() thread still pins the request that the thread serves
+_state = contextvars.ContextVar('expenses_routing_state', default=None)
+
+
+@contextmanager
+def use_replica():
+    """Send reads of expenses models to the replica within the block"""
+    state = _state.get()
+    token = None
+    if state is None:
+        state = _RoutingState()
+        token = _state.set(state)
+    previous = state.replica
+    state.replica = True
+    try:
+        yield
+    finally:
+        state.replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+def replica_view(view):
+    """Decorate a read-only view so its reads go to the replica"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            with use_replica():
+                return await view(*args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with use_replica():
+                return view(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = settings.EXPENSES_READ_REPLICA
+        state = _state.get()
+        if replica and state and state.replica and not state.pinned and model._meta.app_label == 'expenses':
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, settings.EXPENSES_READ_REPLICA}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica is a copy of the primary and is never migrated itself
+        if db == settings.EXPENSES_READ_REPLICA:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Give each request its routing state and keep recent writers on the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = _RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, request, response)
+
+    async def __acall__(self, request):
+        state = _RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, request, response)
+
+    def _pin(self, state, request, response):
+        if settings.EXPENSES_READ_REPLICA and state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.EXPENSES_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
@@ -0,0 +1,107 @@
+"""Recurrence schedules for many expenses at once
+
+The occurrences of an expense fall on its due date plus a whole number of
+frequency steps, so occurrence 1 of a past-due expense is exactly what
+calculate_next_recurrence() returns. Month based frequencies are anchored on
+the due date's day and clamped to the end of shorter months, the same way
+``due_date + relativedelta(months=k)`` behaves.
+
+Rather than stepping each expense with relativedelta, expenses are grouped
+by frequency and their occurrences are found with integer arithmetic on day
+ordinals and month indexes, reading the resulting dates from lookup tables
+that are built once per window.
+"""
+import calendar
+from collections import defaultdict
+from datetime import date
+
+DAY_STEPS = {
+    'DAILY': 1,
+    'WEEKLY': 7,
+}
+
+MONTH_STEPS = {
+    'MONTHLY': 1,
+    'QUARTERLY': 3,
+    'YEARLY': 12,
+}
+
+
+def _month_index(value):
+    return value.year * 12 + value.month - 1
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class _MonthTable:
+    """Clamped dates for every (month, day of month) pair in a window"""
+
+    def __init__(self, first_month, last_month):
+        self.first_month = first_month
+        self.rows = []
+        for index in range(first_month, last_month + 1):
+            year, month = divmod(index, 12)
+            month += 1
+            length = calendar.monthrange(year, month)[1]
+            self.rows.append([date(year, month, min(day, length)) for day in range(1, 32)])
+
+    def get(self, month_index, day):
+        return self.rows[month_index - self.first_month][day - 1]
+
+
+def occurrences(expenses, start, end):
+    """Yield (expense, date) for every occurrence in the window [start, end)
+
+    ``expenses`` can be any iterable of objects with ``frequency`` and
+    ``due_date`` attributes, such as a RecurringExpense queryset. Results are
+    grouped by frequency and ordered by date within each expense; sort them
+    if a single timeline is needed.
+    """
+    if start >= end:
+        return
+
+    groups = defaultdict(list)
+    for expense in expenses:
+        groups[expense.frequency].append(expense)
+
+    start_ordinal = start.toordinal()
+    end_ordinal = end.toordinal()
+    days = None
+    months = None
+
+    for frequency, group in groups.items():
+        if frequency in DAY_STEPS:
+            step = DAY_STEPS[frequency]
+            if days is None:
+                days = [date.fromordinal(o) for o in range(start_ordinal, end_ordinal)]
+            for expense in group:
+                due = expense.due_date.toordinal()
+                first = due if due >= start_ordinal else due + _ceil_div(start_ordinal - due, step) * step
+                for ordinal in range(first, end_ordinal, step):
+                    yield expense, days[ordinal - start_ordinal]
+
+        elif frequency in MONTH_STEPS:
+            step = MONTH_STEPS[frequency]
+            first_month = _month_index(start)
+            last_month = _month_index(end)
+            if months is None:
+                months = _MonthTable(first_month, last_month)
+            for expense in group:
+                due = expense.due_date
+                anchor = _month_index(due)
+                first = anchor if anchor >= first_month else anchor + _ceil_div(first_month - anchor, step) * step
+                for index in range(first, last_month + 1, step):
+                    occurrence = months.get(index, due.day)
+                    if occurrence < start:
+                        continue
+                    if occurrence >= end:
+                        break
+                    yield expense, occurrence
+
+        else:
+            # Unknown frequencies never recur, like calculate_next_recurrence
+            for expense in group:
+                if start <= expense.due_date < end:
+                    yield expense, expense.due_date
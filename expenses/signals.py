@@ -0,0 +1,93 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_categories_version, bump_user_version
+from .models import Category, CategoryTotal, ExpensePayment, RecurringExpense, Tombstone
+from .totals import apply_category_delta
+
+
+@receiver(pre_save, sender=RecurringExpense)
+def remember_expense_contribution(sender, instance, raw, using, **kwargs):
+    """Record the stored row's user and what it contributes to the totals before it changes
+    
+    RecurringExpense.save() runs this, the write and update_totals_on_save()
+    in one transaction.
+    """
+    instance._previous_contribution = None
+    instance._previous_user_id = None
+    if instance.pk and not raw:
+        stored = sender.objects.using(using).filter(pk=instance.pk).values_list(
+            'user_id', 'category_id', 'amount', 'is_active'
+        ).first()
+        if stored:
+            instance._previous_user_id = stored[0]
+            if stored[3]:
+                instance._previous_contribution = stored[:3]
+
+
+@receiver(post_save, sender=RecurringExpense)
+def update_totals_on_save(sender, instance, raw, using, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_contribution', None)
+    if previous:
+        user_id, category_id, amount = previous
+        apply_category_delta(user_id, category_id, -amount, -1, using=using)
+    if instance.is_active:
+        apply_category_delta(instance.user_id, instance.category_id, instance.amount, 1, using=using)
+    bump_user_version(instance.user_id)
+    previous_user_id = getattr(instance, '_previous_user_id', None)
+    if previous_user_id is not None and previous_user_id != instance.user_id:
+        # Payments carry their expense's user
+        ExpensePayment.objects.using(using).filter(recurring_expense=instance).update(user_id=instance.user_id)
+        bump_user_version(previous_user_id)
+
+
+def _deleted_directly(origin, model):
+    """Whether a delete started from ``model`` rather than cascading from its owner"""
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+@receiver(post_delete, sender=RecurringExpense)
+def update_totals_on_delete(sender, instance, using, origin=None, **kwargs):
+    if instance.is_active:
+        apply_category_delta(instance.user_id, instance.category_id, -instance.amount, -1, using=using)
+    bump_user_version(instance.user_id)
+    # Expenses deleted along with their user leave nobody to sync with
+    if _deleted_directly(origin, RecurringExpense):
+        Tombstone.objects.using(using).create(user_id=instance.user_id, kind='EXPENSE', sync_id=instance.sync_id)
+
+
+@receiver(post_save, sender=ExpensePayment)
+def invalidate_on_payment_save(sender, instance, raw, **kwargs):
+    if not raw:
+        bump_user_version(instance.user_id)
+
+
+# Payments deliberately have no delete handlers, which would stop deleting an
+# expense or a user from removing its payments with a single query; see
+# ExpensePaymentQuerySet.delete()
+
+
+@receiver(pre_delete, sender=Category)
+def move_totals_to_uncategorized(sender, instance, **kwargs):
+    """Expenses in a deleted category become uncategorized, so their totals move too"""
+    for row in CategoryTotal.objects.filter(category=instance):
+        apply_category_delta(row.user_id, None, row.total, row.expense_count)
+
+
+@receiver(pre_delete, sender=Category)
+def touch_expenses_of_deleted_category(sender, instance, **kwargs):
+    """Mark the category's expenses as changed, so deltas send them uncategorized
+    
+    SET_NULL clears their category with a plain UPDATE that leaves
+    updated_at alone.
+    """
+    RecurringExpense.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_caches(sender, **kwargs):
+    bump_categories_version()
@@ -1,17 +1,50 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.conf import settings
+from django.core.management import call_command
+from django.urls import resolve, reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta, date
 from decimal import Decimal
 from dateutil.relativedelta import relativedelta
 from django.core.exceptions import ValidationError
+import functools
+import gzip
 import json
+import os
+import re
+import shutil
+import sqlite3
 import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
 
-from .models import Category, RecurringExpense, ExpensePayment
-from .views import calculate_next_recurrence
+from .models import Category, RecurringExpense, ExpensePayment, CategoryTotal, ImportJob, Tombstone, fingerprint
+from .views import calculate_next_recurrence, async_expense_chart_data, async_home, home, iter_export_json
+import io
+
+from .importers import CSV_FIELDS, BackupImporter, BackupReader, CSVBackupReader, InvalidBackup, NDJSONBackupReader, open_backup, apply_delta
+from .jobs import run_import_job, run_pending_jobs
+from .schedule import occurrences
+from .cache import bump_categories_version, bump_user_version, cache_stats, get_categories_version
+from .conditional import user_data_validators
+from .forecast import forecast
+from .metrics import registry, UNRESOLVED
+from .pagination import encode_cursor, keyset_queryset
+from .bench import async_views, bench_views, check_thresholds, percentile, seed_dataset
+from asgiref.sync import sync_to_async
+from .routers import PIN_COOKIE, use_replica
+from .sync import SYNC_OVERLAP, make_sync_token
+from django.core.cache import cache
+from .categories import category_registry
+from .totals import add_category_totals
+from . import importers
 
 class CategoryModelTest(TestCase):
     def setUp(self):
@@ -336,6 +369,283 @@ class HomeViewTest(TestCase):
         # Should include our payment
         self.assertIn(self.payment, recent)
 
+class HomeViewQueryCountTest(TestCase):
+    # Session, user, category totals, recent payments, upcoming, the expenses
+    # table and reloading the category registry after the categories changed
+    MAX_QUERIES = 7
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.today = timezone.now().date()
+    
+    def create_expenses(self, count):
+        """Create one categorized expense, with a recent payment, per category"""
+        # Names continue from earlier calls, as a user's expenses are unique by name and amount
+        start = RecurringExpense.objects.filter(user=self.user).count()
+        for i in range(start, start + count):
+            category = Category.objects.create(name=f"Category {i}")
+            expense = RecurringExpense.objects.create(
+                name=f"Expense {i}",
+                amount=Decimal('10.00'),
+                category=category,
+                frequency="MONTHLY",
+                due_date=self.today - timedelta(days=1),
+                user=self.user
+            )
+            ExpensePayment.objects.create(
+                recurring_expense=expense,
+                payment_date=self.today,
+                amount_paid=Decimal('10.00')
+            )
+    
+    def count_home_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('expenses:home'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+    
+    def test_home_query_count_is_bounded(self):
+        """Test that the home view runs a fixed, small number of queries"""
+        self.create_expenses(3)
+        self.assertLessEqual(self.count_home_queries(), self.MAX_QUERIES)
+    
+    def test_home_query_count_does_not_grow_with_data(self):
+        """Test that more categories and payments do not add queries"""
+        self.create_expenses(2)
+        small = self.count_home_queries()
+        
+        self.create_expenses(40)
+        large = self.count_home_queries()
+        
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.MAX_QUERIES)
+    
+    def test_home_satisfied_expense_has_next_recurrence(self):
+        """Test that a paid upcoming expense is marked satisfied with its next due date"""
+        self.create_expenses(1)
+        expense = RecurringExpense.objects.get(user=self.user)
+        
+        response = self.client.get(reverse('expenses:home'))
+        upcoming = response.context['upcoming_payments']
+        
+        self.assertEqual(len(upcoming), 1)
+        self.assertTrue(upcoming[0]['is_satisfied'])
+        self.assertEqual(upcoming[0]['next_recurrence'], calculate_next_recurrence(expense))
+
+class PaymentStatusQuerySetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.today = timezone.now().date()
+        self.expense = RecurringExpense.objects.create(
+            name='Internet',
+            amount=Decimal('50.00'),
+            frequency='MONTHLY',
+            due_date=self.today - timedelta(days=5),
+            user=self.user
+        )
+    
+    def add_payment(self, days_ago, amount):
+        return ExpensePayment.objects.create(
+            recurring_expense=self.expense,
+            payment_date=self.today - timedelta(days=days_ago),
+            amount_paid=Decimal(amount)
+        )
+    
+    def get_annotated(self):
+        return RecurringExpense.objects.with_payment_status().get(pk=self.expense.pk)
+    
+    def test_unpaid_expense(self):
+        """Test that an expense without payments is not satisfied"""
+        expense = self.get_annotated()
+        self.assertFalse(expense.is_satisfied)
+        self.assertIsNone(expense.last_payment_date)
+        self.assertIsNone(expense.last_amount_paid)
+    
+    def test_payment_rules(self):
+        """Test that only full payments on or after the due date count"""
+        # Before the due date, then on it but short
+        self.add_payment(days_ago=6, amount='50.00')
+        self.add_payment(days_ago=5, amount='49.99')
+        expense = self.get_annotated()
+        self.assertFalse(expense.is_satisfied)
+        self.assertEqual(expense.last_payment_date, self.today - timedelta(days=5))
+        self.assertEqual(expense.last_amount_paid, Decimal('49.99'))
+        
+        self.add_payment(days_ago=2, amount='60.00')
+        expense = self.get_annotated()
+        self.assertTrue(expense.is_satisfied)
+        self.assertEqual(expense.last_payment_date, self.today - timedelta(days=2))
+        self.assertEqual(expense.last_amount_paid, Decimal('60.00'))
+    
+    def test_payment_window(self):
+        """Test that payments before the window do not count"""
+        self.expense.due_date = self.today - timedelta(days=40)
+        self.expense.save()
+        self.add_payment(days_ago=35, amount='50.00')
+        self.assertFalse(self.get_annotated().is_satisfied)
+        
+        since = self.today - timedelta(days=60)
+        self.assertTrue(
+            RecurringExpense.objects.with_payment_status(since=since).get(pk=self.expense.pk).is_satisfied
+        )
+    
+    def test_single_query(self):
+        """Test that the annotations are computed in the same query"""
+        self.add_payment(days_ago=1, amount='50.00')
+        with CaptureQueriesContext(connection) as queries:
+            expenses = list(RecurringExpense.objects.filter(user=self.user).with_payment_status())
+            self.assertTrue(expenses[0].is_satisfied)
+        self.assertEqual(len(queries), 1)
+
+class ExpenseQuerySetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            password='testpassword'
+        )
+        self.category = Category.objects.create(name='Utilities', description='x' * 1000)
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 5),
+            description='A long description',
+            user=self.user
+        )
+        RecurringExpense.objects.create(
+            name='Old Gym',
+            amount=Decimal('30.00'),
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 5),
+            is_active=False,
+            user=self.user
+        )
+        RecurringExpense.objects.create(
+            name='Other',
+            amount=Decimal('10.00'),
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 5),
+            user=self.other_user
+        )
+    
+    def test_for_user_and_active(self):
+        """Test that for_user() and active() narrow the expenses"""
+        self.assertEqual(RecurringExpense.objects.for_user(self.user).count(), 2)
+        self.assertEqual(list(RecurringExpense.objects.for_user(self.user).active()), [self.expense])
+    
+    def test_list_rows(self):
+        """Test that list rows load the category in the same query and skip long text"""
+        with CaptureQueriesContext(connection) as queries:
+            expense = RecurringExpense.objects.for_user(self.user).active().list_rows().get()
+            self.assertEqual(expense.category.name, 'Utilities')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertEqual(expense.get_deferred_fields(), {'description'})
+    
+    def test_rows(self):
+        """Test that rows are named tuples with the category name"""
+        rows = list(RecurringExpense.objects.for_user(self.user).order_by('name').rows())
+        self.assertEqual(rows[0].name, 'Electricity')
+        self.assertEqual(rows[0].category_name, 'Utilities')
+        self.assertEqual(rows[0].amount, Decimal('75.00'))
+        self.assertIsNone(rows[1].category_name)
+        self.assertEqual(rows[0]._fields, RecurringExpense.objects.none().ROW_FIELDS)
+
+class HotPathIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.today = timezone.now().date()
+    
+    def test_active_expenses_use_index(self):
+        """Test that active expenses ordered by due date are read from an index"""
+        plan = RecurringExpense.objects.filter(
+            user=self.user,
+            is_active=True
+        ).order_by('due_date').explain()
+        self.assertIn('expense_active_due_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+    
+    def payment_plan(self, url):
+        """The query plan of the payments query behind a page"""
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # The query that selects from the payments, not one with a payments subquery
+        sql = next(
+            query['sql'] for query in queries
+            if re.match(r'SELECT (?:(?!SELECT).)* FROM "expenses_expensepayment"', query['sql'])
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+    
+    def test_recent_payments_use_index(self):
+        """Test that the recent payments date range is searched through the user's payments index"""
+        plan = self.payment_plan(reverse('expenses:home'))
+        self.assertRegex(plan, r'payment_user_date_id_idx \(user_id=\? AND payment_date>\?\)')
+    
+    def test_trend_uses_index(self):
+        """Test that the trend's date range is searched through the user's payments index"""
+        plan = self.payment_plan(reverse('expenses:expense_trend_data'))
+        self.assertRegex(plan, r'payment_user_date_id_idx \(user_id=\? AND payment_date>\? AND payment_date<\?\)')
+    
+    def test_payment_pages_use_index(self):
+        """Test that deep keyset pages of a user's payments seek straight to the cursor"""
+        queryset = keyset_queryset(
+            ExpensePayment.objects.filter(user=self.user).values_list('id', 'payment_date', named=True),
+            'payment_date',
+            cursor=encode_cursor([self.today, 1])
+        )
+        plan = queryset[:51].explain()
+        self.assertRegex(plan, r'payment_user_date_id_idx \(user_id=\? AND payment_date>\?\)')
+        self.assertNotIn('TEMP B-TREE', plan)
+    
+    def test_payments_follow_their_expense_user(self):
+        """Test that payments carry their expense's user, also when the expense changes hands"""
+        expense = RecurringExpense.objects.create(
+            name='Rent',
+            amount=Decimal('1000.00'),
+            frequency='MONTHLY',
+            due_date=self.today,
+            user=self.user,
+            is_active=False
+        )
+        payment = ExpensePayment.objects.create(recurring_expense=expense, payment_date=self.today, amount_paid=Decimal('1000.00'))
+        self.assertEqual(payment.user, self.user)
+        
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        expense.user = other
+        expense.save()
+        payment.refresh_from_db()
+        self.assertEqual(payment.user, other)
+    
+    def test_expense_pages_use_index(self):
+        """Test that deep keyset pages of expenses seek straight to the cursor"""
+        queryset = keyset_queryset(
+            RecurringExpense.objects.for_user(self.user).rows('description'),
+            'due_date',
+            cursor=encode_cursor([self.today, 1])
+        )
+        plan = queryset[:51].explain()
+        self.assertRegex(plan, r'expense_user_due_id_idx \(user_id=\? AND due_date>\?\)')
+        self.assertNotIn('TEMP B-TREE', plan)
+
 class RecurringExpenseValidationTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -612,6 +922,7 @@ class AdminSiteTest(TestCase):
         # Verify the category was created
         self.assertTrue(Category.objects.filter(name='New Category').exists())
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPENSES_IMPORT_WORKER_THREADS=0)
 class DataExportImportTests(TestCase):
     def setUp(self):
         # Create a test user
@@ -682,6 +993,137 @@ class DataExportImportTests(TestCase):
         self.assertEqual(len(data['expenses'][0]['payments']), 1)
         self.assertEqual(data['expenses'][0]['payments'][0]['amount_paid'], '100.00')
     
+    def test_export_data_streaming(self):
+        """Test that the streaming export writes the same backup"""
+        response = self.client.get(reverse('expenses:export_data'), {'stream': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        
+        streamed = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        buffered = json.loads(self.client.get(reverse('expenses:export_data')).content.decode('utf-8'))
+        for key in ['export_date', 'sync_token']:
+            streamed.pop(key)
+            buffered.pop(key)
+        self.assertEqual(streamed, buffered)
+    
+    def test_export_matches_pretty_printed_json(self):
+        """Test that the incremental writer produces the same text as json.dumps(indent=4)"""
+        for i in range(3):
+            RecurringExpense.objects.create(
+                name=f'Extra {i}',
+                amount=Decimal('5.00'),
+                frequency='WEEKLY',
+                due_date=date.today(),
+                description='Line one\nLine two',
+                user=self.user
+            )
+        content = self.client.get(reverse('expenses:export_data')).content.decode('utf-8')
+        self.assertEqual(content, json.dumps(json.loads(content), indent=4))
+        
+        # A user without any expenses still gets a valid backup
+        User.objects.create_user(username='empty', password='emptypassword')
+        self.client.login(username='empty', password='emptypassword')
+        content = self.client.get(reverse('expenses:export_data')).content.decode('utf-8')
+        self.assertEqual(json.loads(content)['expenses'], [])
+        self.assertEqual(content, json.dumps(json.loads(content), indent=4))
+    
+    def test_export_query_count_does_not_grow_with_data(self):
+        """Test that payments are prefetched rather than queried per expense"""
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('expenses:export_data'))
+        
+        for i in range(20):
+            category = Category.objects.create(name=f'Category {i}')
+            expense = RecurringExpense.objects.create(
+                name=f'Expense {i}',
+                amount=Decimal('10.00'),
+                category=category,
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+            ExpensePayment.objects.create(
+                recurring_expense=expense,
+                payment_date=date.today(),
+                amount_paid=Decimal('10.00')
+            )
+        
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('expenses:export_data'))
+        
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))['expenses']), 21)
+        self.assertEqual(len(small), len(large))
+    
+    def export(self, **params):
+        response = self.client.get(reverse('expenses:export_data'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+    
+    def test_export_formats_round_trip(self):
+        """Test that every format, compressed or not, imports back to the same data"""
+        self.payment.notes = 'Paid, late\nwith "fees"'
+        self.payment.save()
+        RecurringExpense.objects.create(
+            name='No Category',
+            amount=Decimal('5.00'),
+            frequency='WEEKLY',
+            due_date=date.today(),
+            user=self.user,
+            is_active=False
+        )
+        
+        def snapshot(user):
+            return [
+                (e.name, e.amount, e.category.name if e.category else None, e.frequency, e.is_active,
+                 [(p.payment_date, p.amount_paid, p.notes) for p in e.expensepayment_set.order_by('id')])
+                for e in RecurringExpense.objects.filter(user=user).order_by('name')
+            ]
+        
+        expected = snapshot(self.user)
+        for export_format in ['json', 'ndjson', 'csv']:
+            for params in [{}, {'gzip': '1'}, {'gzip': '1', 'stream': '1'}]:
+                with self.subTest(format=export_format, **params):
+                    content = self.export(format=export_format, **params)
+                    user = User.objects.create_user(username=f'restore-{export_format}-{len(params)}')
+                    importer = BackupImporter(user)
+                    importer.import_stream(open_backup(io.BytesIO(content)))
+                    self.assertEqual(importer.payments_created, 1)
+                    self.assertEqual(snapshot(user), expected)
+    
+    def test_compact_formats_are_smaller(self):
+        """Test that NDJSON has one record per line and both compact formats beat pretty JSON"""
+        response = self.client.get(reverse('expenses:export_data'), {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('.ndjson"', response['Content-Disposition'])
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['type'] for line in lines], ['header', 'category', 'expense'])
+        
+        pretty = len(self.export())
+        self.assertLess(len(response.content), pretty)
+        self.assertLess(len(self.export(format='csv')), pretty)
+        
+        response = self.client.get(reverse('expenses:export_data'), {'format': 'csv', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.csv.gz"', response['Content-Disposition'])
+    
+    def test_export_rejects_unknown_format(self):
+        """Test that an unknown format is a client error"""
+        response = self.client.get(reverse('expenses:export_data'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_import_detects_compressed_csv(self):
+        """Test that an uploaded gzip-compressed CSV backup is imported"""
+        upload = SimpleUploadedFile('backup.bin', self.export(format='csv', gzip='1'))
+        self.expense.delete()
+        self.client.post(reverse('expenses:import_data'), {'import_file': upload})
+        self.assertEqual(run_pending_jobs(), 1)
+        
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, 'DONE', job.error)
+        self.assertEqual(job.expenses_created, 1)
+        self.assertEqual(job.payments_created, 1)
+    
     def test_import_data(self):
         """Test that data can be imported correctly"""
         # Create a sample export data
@@ -726,6 +1168,9 @@ class DataExportImportTests(TestCase):
         # Check that the response redirects to the home page
         self.assertRedirects(response, reverse('expenses:home'))
         
+        # Run the queued import job
+        self.assertEqual(run_pending_jobs(), 1)
+        
         # Check that the new category was created
         self.assertTrue(Category.objects.filter(name='New Category').exists())
         
@@ -736,6 +1181,14 @@ class DataExportImportTests(TestCase):
         new_expense = RecurringExpense.objects.get(name='New Expense')
         self.assertTrue(ExpensePayment.objects.filter(recurring_expense=new_expense).exists())
     
+    def test_import_page_has_one_polling_script(self):
+        """Test that the import page script is in the page body once and not in its title"""
+        response = self.client.get(reverse('expenses:import_data'))
+        content = response.content.decode()
+        self.assertEqual(content.count('<script>'), 1)
+        title = content[content.index('<title>'):content.index('</title>')]
+        self.assertNotIn('script', title)
+    
     def test_import_invalid_data(self):
         """Test handling of invalid import data"""
         # Create invalid JSON data
@@ -748,7 +1201,2090 @@ class DataExportImportTests(TestCase):
         # Check that the response redirects to the home page
         self.assertRedirects(response, reverse('expenses:home'))
         
+        # Run the queued import job, which should fail
+        run_pending_jobs()
+        self.assertEqual(ImportJob.objects.get().status, 'FAILED')
+        
         # Check that no new data was created
         self.assertEqual(Category.objects.count(), 1)
         self.assertEqual(RecurringExpense.objects.count(), 1)
         self.assertEqual(ExpensePayment.objects.count(), 1)
+
+class BackupImporterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.existing_category = Category.objects.create(name='Utilities')
+        RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.existing_category,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+    
+    def make_expense(self, name, amount='10.00', payments=2, **extra):
+        expense = {
+            'name': name,
+            'amount': amount,
+            'frequency': 'MONTHLY',
+            'due_date': date.today().isoformat(),
+            'payments': [
+                {
+                    'payment_date': (date.today() - timedelta(days=i)).isoformat(),
+                    'amount_paid': amount,
+                    'notes': ''
+                }
+                for i in range(payments)
+            ]
+        }
+        expense.update(extra)
+        return expense
+    
+    def test_import_skips_existing_and_repeated_expenses(self):
+        """Test that existing and repeated (name, amount) pairs are skipped but their payments merge"""
+        data = {
+            'categories': [],
+            'expenses': [
+                self.make_expense('Electricity', '75'),
+                self.make_expense('Water'),
+                self.make_expense('Water', '10.0'),
+            ]
+        }
+        importer = BackupImporter(self.user)
+        importer.import_data(data)
+        
+        self.assertEqual(importer.expenses_created, 1)
+        self.assertEqual(importer.expenses_skipped, 2)
+        # The existing expense gains its payments; the repeat's are the same as the first Water's
+        self.assertEqual(importer.payments_created, 4)
+        self.assertEqual(RecurringExpense.objects.filter(user=self.user, name='Water').count(), 1)
+    
+    def test_import_resolves_categories(self):
+        """Test that categories are matched by backup ID, then by name, and created when missing"""
+        data = {
+            'categories': [
+                {'id': 7, 'name': 'Utilities', 'description': ''},
+                {'id': 8, 'name': 'Streaming', 'description': 'Video'},
+            ],
+            'expenses': [
+                self.make_expense('Gas', category_id=7, category_name='Utilities'),
+                self.make_expense('Video', category_id=8, category_name='Streaming'),
+                self.make_expense('Gym', category_id=99, category_name='Fitness'),
+                self.make_expense('Cash', category_id=None, category_name=None),
+            ]
+        }
+        BackupImporter(self.user).import_data(data)
+        
+        expenses = {e.name: e for e in RecurringExpense.objects.filter(user=self.user)}
+        self.assertEqual(expenses['Gas'].category, self.existing_category)
+        self.assertEqual(expenses['Video'].category.description, 'Video')
+        self.assertEqual(expenses['Gym'].category.name, 'Fitness')
+        self.assertIsNone(expenses['Cash'].category)
+        self.assertEqual(Category.objects.filter(name='Utilities').count(), 1)
+    
+    def test_import_inserts_in_batches(self):
+        """Test that the number of queries depends on the batch count, not the row count"""
+        data = {
+            'categories': [],
+            'expenses': [self.make_expense(f'Expense {i}', payments=5) for i in range(40)]
+        }
+        importer = BackupImporter(self.user, batch_size=100)
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_data(data)
+        
+        self.assertEqual(importer.expenses_created, 40)
+        self.assertEqual(importer.payments_created, 200)
+        self.assertEqual(ExpensePayment.objects.filter(recurring_expense__user=self.user).count(), 200)
+        # 240 rows in three batches of ~100 rows, each a lookup of the
+        # expenses, their INSERT, one upsert of the totals and the payments'
+        # INSERT, inside the batch's own transaction
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 3 * 4)
+    
+    def test_reimport_is_idempotent(self):
+        """Test that importing the same backup again writes nothing"""
+        data = {
+            'categories': [],
+            'expenses': [self.make_expense(f'Expense {i}', payments=5) for i in range(40)]
+        }
+        BackupImporter(self.user, batch_size=100).import_data(data)
+        before = list(ExpensePayment.objects.order_by('id').values_list('id', 'updated_at'))
+        
+        importer = BackupImporter(self.user, batch_size=100)
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_data(data)
+        self.assertEqual(importer.expenses_created, 0)
+        self.assertEqual(importer.expenses_skipped, 40)
+        self.assertEqual(importer.payments_created, 0)
+        self.assertEqual(list(ExpensePayment.objects.order_by('id').values_list('id', 'updated_at')), before)
+        # Per batch, a lookup of the expenses and then of their payments,
+        # inside the batch's own transaction (a savepoint within the test's)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2 * 3)
+        
+        # A payment added to the backup later is the only one written
+        data['expenses'][0]['payments'].append({'payment_date': '2020-01-01', 'amount_paid': '10.00', 'notes': ''})
+        importer = BackupImporter(self.user)
+        importer.import_data(data)
+        self.assertEqual(importer.payments_created, 1)
+        self.assertEqual(ExpensePayment.objects.count(), 201)
+    
+    def test_conflicting_rows_are_not_counted(self):
+        """Test that rows a concurrent import wrote first are not counted or totalled again"""
+        data = {
+            'categories': [{'id': 7, 'name': 'Utilities', 'description': ''}],
+            'expenses': [self.make_expense('Water', payments=3, category_id=7)]
+        }
+        insert_returning = importers._insert_returning
+        
+        def concurrent_insert(objs, returning):
+            if objs and isinstance(objs[0], RecurringExpense):
+                # Another import records the expense and its first payment in the meantime
+                expense = RecurringExpense.objects.create(
+                    name='Water',
+                    amount=Decimal('10.00'),
+                    category=self.existing_category,
+                    frequency='MONTHLY',
+                    due_date=date.today(),
+                    user=self.user
+                )
+                ExpensePayment.objects.create(recurring_expense=expense, payment_date=date.today(), amount_paid=Decimal('10.00'))
+            return insert_returning(objs, returning)
+        
+        importer = BackupImporter(self.user)
+        with mock.patch('expenses.importers._insert_returning', concurrent_insert):
+            importer.import_data(data)
+        self.assertEqual(importer.expenses_created, 0)
+        self.assertEqual(importer.expenses_skipped, 1)
+        self.assertEqual(importer.payments_created, 2)
+        self.assertEqual(ExpensePayment.objects.filter(recurring_expense__name='Water').count(), 3)
+        # Electricity and the one Water expense
+        total = CategoryTotal.objects.get(user=self.user, category=self.existing_category)
+        self.assertEqual((total.total, total.expense_count), (Decimal('85.00'), 2))
+    
+    def test_totals_upsert_creates_and_adds(self):
+        """Test that one upsert adds to existing totals and creates missing ones"""
+        add_category_totals(self.user.pk, {
+            self.existing_category.pk: (Decimal('5.50'), 1),
+            None: (Decimal('2.25'), 2),
+        })
+        add_category_totals(self.user.pk, {None: (Decimal('1.00'), 1)})
+        totals = {
+            total.category_id: (total.total, total.expense_count)
+            for total in CategoryTotal.objects.filter(user=self.user)
+        }
+        # Utilities already holds Electricity
+        self.assertEqual(totals, {self.existing_category.pk: (Decimal('80.50'), 2), None: (Decimal('3.25'), 3)})
+    
+    def test_salted_duplicates_can_be_saved(self):
+        """Test that rows salted apart by the fingerprint migration keep their fingerprint"""
+        original = RecurringExpense.objects.get(name='Electricity')
+        salted = fingerprint('Electricity', Decimal('75.00'), f'duplicate {original.pk}')
+        RecurringExpense.objects.filter(pk=original.pk).update(fingerprint=salted)
+        RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        
+        original.refresh_from_db()
+        original.description = 'Old meter'
+        original.full_clean()
+        original.save()
+        original.refresh_from_db()
+        self.assertEqual(original.fingerprint, salted)
+        
+        # Once its content changes the row gets a plain fingerprint
+        original.amount = Decimal('80.00')
+        original.save()
+        self.assertEqual(original.fingerprint, fingerprint('Electricity', Decimal('80.00')))
+    
+    def test_reimport_matches_payments_by_sync_id(self):
+        """Test that a payment edited since the backup was taken is not imported again"""
+        expense = self.make_expense('Water', payments=1, sync_id=str(uuid.uuid4()))
+        expense['payments'][0]['sync_id'] = str(uuid.uuid4())
+        data = {'categories': [], 'expenses': [expense]}
+        BackupImporter(self.user).import_data(data)
+        payment = ExpensePayment.objects.get(recurring_expense__name='Water')
+        payment.notes = 'Paid late'
+        payment.save()
+        
+        importer = BackupImporter(self.user)
+        importer.import_data(data)
+        self.assertEqual(importer.payments_created, 0)
+        self.assertEqual(
+            list(ExpensePayment.objects.filter(recurring_expense__name='Water').values_list('sync_id', 'notes')),
+            [(uuid.UUID(expense['payments'][0]['sync_id']), 'Paid late')]
+        )
+    
+    def test_fingerprint_constraints_are_validated(self):
+        """Test that forms report a repeated expense or payment instead of failing on save"""
+        expense = RecurringExpense(
+            name='Electricity',
+            amount=Decimal('75.0'),
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        with self.assertRaisesMessage(ValidationError, 'An expense with this name and amount already exists.'):
+            expense.full_clean(exclude=['fingerprint'])
+        
+        existing = RecurringExpense.objects.get(name='Electricity')
+        ExpensePayment.objects.create(recurring_expense=existing, payment_date=date.today(), amount_paid=Decimal('75.00'))
+        payment = ExpensePayment(recurring_expense=existing, payment_date=date.today(), amount_paid=Decimal('75'))
+        with self.assertRaisesMessage(ValidationError, 'This payment has already been recorded.'):
+            payment.full_clean(exclude=['fingerprint'])
+        payment.notes = 'Second charge'
+        payment.full_clean(exclude=['fingerprint'])
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPENSES_IMPORT_WORKER_THREADS=0)
+class BackupReaderTest(TestCase):
+    def setUp(self):
+        self.data = {
+            'export_date': '2025-01-01T00:00:00+00:00',
+            'username': 'testuser',
+            'categories': [{'id': 1, 'name': 'Café', 'description': ''}],
+            'expenses': [
+                {
+                    'name': f'Expense {i}',
+                    'amount': '12.50',
+                    'category_id': 1,
+                    'frequency': 'MONTHLY',
+                    'due_date': '2025-01-31',
+                    'is_active': i % 2 == 0,
+                    'payments': [{'payment_date': '2025-01-31', 'amount_paid': '12.50', 'notes': 'ü'}],
+                    'count': 1234567,
+                }
+                for i in range(5)
+            ]
+        }
+        self.content = json.dumps(self.data, indent=4, ensure_ascii=False).encode('utf-8')
+    
+    def test_reader_matches_json_loads_at_any_chunk_size(self):
+        """Test that chunk boundaries inside strings, numbers and UTF-8 sequences are handled"""
+        for chunk_size in [1, 2, 3, 7, 64, 100000]:
+            reader = BackupReader(io.BytesIO(self.content), chunk_size=chunk_size)
+            expenses = list(reader)
+            self.assertEqual(expenses, self.data['expenses'])
+            self.assertEqual(reader.header['categories'], self.data['categories'])
+            self.assertEqual(reader.header['username'], 'testuser')
+    
+    def test_reader_yields_before_reading_whole_file(self):
+        """Test that the first expense is produced without reading the rest of the file"""
+        stream = io.BytesIO(self.content)
+        first = next(iter(BackupReader(stream, chunk_size=64)))
+        self.assertEqual(first['name'], 'Expense 0')
+        self.assertLess(stream.tell(), len(self.content))
+    
+    def test_reader_rejects_malformed_json(self):
+        """Test that malformed input raises JSONDecodeError"""
+        for content in [b'', b'This is not valid JSON', b'{"expenses": [{}', b'{"a": 1} trailing', b'[1, 2]']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(BackupReader(io.BytesIO(content), chunk_size=4))
+    
+    def test_open_backup_detects_format(self):
+        """Test that the reader is picked from the content, compressed or not"""
+        ndjson = b'{"type":"header","export_date":"2025-01-01"}\n{"type":"expense","name":"A"}\n'
+        csv_content = (','.join(CSV_FIELDS) + '\n').encode('utf-8')
+        for content, reader_class in [
+            (self.content, BackupReader),
+            (json.dumps(self.data).encode('utf-8'), BackupReader),
+            (ndjson, NDJSONBackupReader),
+            (csv_content, CSVBackupReader),
+        ]:
+            for data in [content, gzip.compress(content)]:
+                reader = open_backup(io.BytesIO(data))
+                self.assertIsInstance(reader, reader_class)
+        
+        reader = open_backup(io.BytesIO(gzip.compress(ndjson)))
+        self.assertEqual([expense['name'] for expense in reader], ['A'])
+        self.assertEqual(reader.header, {'export_date': '2025-01-01', 'categories': [], 'expenses': True})
+    
+    def test_compact_readers_reject_unexpected_records(self):
+        """Test that out of place NDJSON records and CSV rows are rejected"""
+        header = ','.join(CSV_FIELDS) + '\n'
+        for reader in [
+            NDJSONBackupReader(io.BytesIO(b'{"type":"header"}\n{"type":"bogus"}\n')),
+            NDJSONBackupReader(io.BytesIO(b'{"type":"header"}\n{"type":"expense"}\n{"type":"category"}\n')),
+            CSVBackupReader(io.BytesIO((header + 'payment,,,,,,,,,2025-01-01,1.00,\n').encode('utf-8'))),
+            CSVBackupReader(io.BytesIO(b'name,amount\nRent,10\n')),
+        ]:
+            with self.assertRaises(InvalidBackup):
+                list(reader)
+    
+    def test_import_reports_processed_records(self):
+        """Test that the importer reports progress as records are flushed"""
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        progress = []
+        importer = BackupImporter(user, batch_size=4, progress=progress.append)
+        importer.import_stream(BackupReader(io.BytesIO(self.content), chunk_size=16))
+        
+        self.assertEqual(importer.records_processed, 10)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 10)
+        self.assertEqual(importer.expenses_created, 5)
+        self.assertEqual(Category.objects.get(name='Café').recurringexpense_set.count(), 5)
+    
+    def test_import_missing_expenses_creates_nothing(self):
+        """Test that a backup without the expenses list is rejected as a whole"""
+        User.objects.create_user(username='testuser', password='testpassword')
+        client = Client()
+        client.login(username='testuser', password='testpassword')
+        content = json.dumps({'categories': [{'id': 1, 'name': 'Orphan', 'description': ''}]})
+        upload = SimpleUploadedFile('backup.json', content.encode('utf-8'), content_type='application/json')
+        
+        response = client.post(reverse('expenses:import_data'), {'import_file': upload})
+        self.assertRedirects(response, reverse('expenses:home'))
+        run_pending_jobs()
+        
+        self.assertEqual(ImportJob.objects.get().error, "Invalid backup file format. Missing required data.")
+        self.assertFalse(Category.objects.filter(name='Orphan').exists())
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPENSES_IMPORT_WORKER_THREADS=0)
+class ImportJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.backup = json.dumps({
+            'categories': [],
+            'expenses': [
+                {
+                    'name': 'Gym',
+                    'amount': '30.00',
+                    'frequency': 'MONTHLY',
+                    'due_date': date.today().isoformat(),
+                    'payments': [
+                        {'payment_date': date.today().isoformat(), 'amount_paid': '30.00', 'notes': ''}
+                    ]
+                }
+            ]
+        }).encode('utf-8')
+    
+    def upload(self):
+        upload = SimpleUploadedFile('backup.json', self.backup, content_type='application/json')
+        return self.client.post(
+            reverse('expenses:import_data'),
+            {'import_file': upload},
+            HTTP_ACCEPT='application/json'
+        )
+    
+    def test_upload_only_enqueues(self):
+        """Test that the upload returns a job id without importing anything"""
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        
+        self.assertEqual(ImportJob.objects.get(pk=job_id).status, 'PENDING')
+        self.assertFalse(RecurringExpense.objects.filter(name='Gym').exists())
+        
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(status['status'], 'PENDING')
+    
+    def test_status_reports_counts_when_done(self):
+        """Test that the status endpoint reports the finished job's counts"""
+        response = self.upload()
+        job_id = response.json()['job_id']
+        self.assertTrue(run_import_job(job_id))
+        
+        status = self.client.get(reverse('expenses:import_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'DONE')
+        self.assertEqual(status['records_processed'], 2)
+        self.assertEqual(status['expenses_created'], 1)
+        self.assertEqual(status['payments_created'], 1)
+        self.assertIsNotNone(status['finished_at'])
+        self.assertFalse(ImportJob.objects.get(pk=job_id).file)
+    
+    def test_job_runs_only_once(self):
+        """Test that a job that has been claimed is not run again"""
+        job_id = self.upload().json()['job_id']
+        self.assertTrue(run_import_job(job_id))
+        self.assertFalse(run_import_job(job_id))
+        self.assertEqual(RecurringExpense.objects.filter(name='Gym').count(), 1)
+    
+    def test_status_is_private(self):
+        """Test that users cannot see each other's import jobs"""
+        job_id = self.upload().json()['job_id']
+        User.objects.create_user(username='other', password='otherpassword')
+        self.client.login(username='other', password='otherpassword')
+        response = self.client.get(reverse('expenses:import_status', args=[job_id]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_worker_command_drains_queue(self):
+        """Test that run_import_worker --once processes pending jobs"""
+        job_id = self.upload().json()['job_id']
+        call_command('run_import_worker', '--once', stdout=io.StringIO())
+        self.assertEqual(ImportJob.objects.get(pk=job_id).status, 'DONE')
+    
+    def test_failed_import_keeps_written_batches(self):
+        """Test that batches commit as they go, so a later bad record only stops the rest"""
+        expenses = [
+            {'name': name, 'amount': '10.00', 'frequency': 'MONTHLY', 'due_date': date.today().isoformat()}
+            for name in ['Gym', 'Rent', 'Water']
+        ]
+        self.backup = json.dumps({
+            'categories': [],
+            'expenses': expenses + [{'name': 'Broken', 'amount': '10.00'}],
+        }).encode('utf-8')
+        job_id = self.upload().json()['job_id']
+        
+        with mock.patch('expenses.jobs.BackupImporter', functools.partial(BackupImporter, batch_size=2)):
+            self.assertTrue(run_import_job(job_id))
+        job = ImportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, 'FAILED')
+        self.assertIn('importing the file again adds the rest', job.error)
+        self.assertEqual(job.records_processed, 2)
+        self.assertEqual(set(RecurringExpense.objects.values_list('name', flat=True)), {'Gym', 'Rent'})
+    
+    def test_progress_is_written_to_the_job(self):
+        """Test that each reported batch refreshes the job's progress and updated_at"""
+        job_id = self.upload().json()['job_id']
+        seen = []
+        
+        def import_stream(importer, reader):
+            importer.progress(5)
+            seen.append(ImportJob.objects.values_list('records_processed', 'updated_at').get(pk=job_id))
+            claimed_at = seen[-1][1]
+            time.sleep(0.01)
+            importer.progress(10)
+            seen.append(ImportJob.objects.values_list('records_processed', 'updated_at').get(pk=job_id))
+            self.assertGreater(seen[-1][1], claimed_at)
+        
+        with mock.patch.object(BackupImporter, 'import_stream', import_stream):
+            run_import_job(job_id)
+        self.assertEqual([records for records, _ in seen], [5, 10])
+        status = self.client.get(reverse('expenses:import_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'DONE')
+    
+    def stall(self, job_id, attempts=1):
+        """Leave the job as a worker that died part way through would"""
+        ImportJob.objects.filter(pk=job_id).update(
+            status='RUNNING',
+            attempts=attempts,
+            updated_at=timezone.now() - timedelta(hours=1)
+        )
+    
+    def test_stale_job_is_run_again(self):
+        """Test that a running job whose worker stopped is picked up by the worker again"""
+        job_id = self.upload().json()['job_id']
+        self.stall(job_id)
+        
+        self.assertEqual(run_pending_jobs(), 1)
+        job = ImportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, 'DONE')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(RecurringExpense.objects.filter(name='Gym').count(), 1)
+    
+    def test_live_job_is_left_alone(self):
+        """Test that a running job that reported progress recently is not taken over"""
+        job_id = self.upload().json()['job_id']
+        ImportJob.objects.filter(pk=job_id).update(status='RUNNING', attempts=1)
+        
+        self.assertEqual(run_pending_jobs(), 0)
+        self.assertEqual(ImportJob.objects.get(pk=job_id).status, 'RUNNING')
+    
+    def test_job_that_keeps_stalling_fails(self):
+        """Test that a job is given up on after the configured number of attempts"""
+        job_id = self.upload().json()['job_id']
+        self.stall(job_id, attempts=settings.EXPENSES_IMPORT_MAX_ATTEMPTS)
+        
+        self.assertEqual(run_pending_jobs(), 0)
+        job = ImportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, 'FAILED')
+        self.assertIn('stopped 3 times', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(job.file)
+    
+    @override_settings(EXPENSES_IMPORT_WORKER_THREADS=1)
+    def test_polling_a_stale_job_requeues_it(self):
+        """Test that without a worker command the status poll hands a stale job back to the pool"""
+        job_id = self.upload().json()['job_id']
+        self.stall(job_id)
+        
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            status = self.client.get(reverse('expenses:import_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'PENDING')
+        self.assertEqual(len(callbacks), 1)
+    
+    @override_settings(EXPENSES_IMPORT_WORKER_THREADS=1)
+    def test_upload_schedules_worker_after_commit(self):
+        """Test that the thread pool is only handed the job once the upload commits"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.upload()
+        self.assertEqual(len(callbacks), 1)
+
+class ScheduleEngineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.today = timezone.now().date()
+    
+    def make_expense(self, frequency, due_date):
+        return RecurringExpense(
+            name=frequency.title(),
+            amount=Decimal('10.00'),
+            frequency=frequency,
+            due_date=due_date,
+            user=self.user
+        )
+    
+    def test_first_recurrence_matches_calculate_next_recurrence(self):
+        """Test that the occurrence after a past due date is calculate_next_recurrence()"""
+        for frequency, _ in RecurringExpense.FREQUENCY_CHOICES:
+            for days_ago in [1, 7, 30, 31, 90, 365]:
+                expense = self.make_expense(frequency, self.today - timedelta(days=days_ago))
+                start = expense.due_date + timedelta(days=1)
+                first = next(occurrences([expense], start, start + timedelta(days=400)))
+                self.assertEqual(first, (expense, calculate_next_recurrence(expense)))
+    
+    def test_month_end_clamping(self):
+        """Test that month based schedules clamp to month end without drifting"""
+        expense = self.make_expense('MONTHLY', date(2024, 1, 31))
+        dates = [d for _, d in occurrences([expense], date(2024, 1, 1), date(2024, 6, 1))]
+        self.assertEqual(dates, [
+            date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31)
+        ])
+        
+        leap_day = self.make_expense('YEARLY', date(2024, 2, 29))
+        dates = [d for _, d in occurrences([leap_day], date(2025, 1, 1), date(2029, 1, 1))]
+        self.assertEqual(dates, [date(2025, 2, 28), date(2026, 2, 28), date(2027, 2, 28), date(2028, 2, 29)])
+    
+    def test_window_is_half_open(self):
+        """Test that occurrences include the start date and exclude the end date"""
+        expense = self.make_expense('WEEKLY', date(2024, 1, 1))
+        dates = [d for _, d in occurrences([expense], date(2024, 1, 8), date(2024, 1, 22))]
+        self.assertEqual(dates, [date(2024, 1, 8), date(2024, 1, 15)])
+        
+        # Nothing happens before the first due date
+        future = self.make_expense('DAILY', date(2024, 3, 1))
+        self.assertEqual(list(occurrences([future], date(2024, 1, 1), date(2024, 3, 1))), [])
+    
+    def test_matches_relativedelta_for_many_expenses(self):
+        """Test the batched engine against stepping each expense with relativedelta"""
+        steps = {
+            'DAILY': relativedelta(days=1),
+            'WEEKLY': relativedelta(weeks=1),
+            'MONTHLY': relativedelta(months=1),
+            'QUARTERLY': relativedelta(months=3),
+            'YEARLY': relativedelta(years=1),
+        }
+        start, end = date(2024, 1, 15), date(2026, 3, 10)
+        expenses = [
+            self.make_expense(frequency, date(2022, 11, 1) + timedelta(days=i * 37))
+            for i in range(25)
+            for frequency in steps
+        ]
+        expected = set()
+        for index, expense in enumerate(expenses):
+            k = 0
+            while expense.due_date + steps[expense.frequency] * k < end:
+                occurrence = expense.due_date + steps[expense.frequency] * k
+                if occurrence >= start:
+                    expected.add((index, occurrence))
+                k += 1
+        
+        positions = {id(expense): index for index, expense in enumerate(expenses)}
+        actual = [(positions[id(expense)], d) for expense, d in occurrences(expenses, start, end)]
+        self.assertEqual(len(actual), len(expected))
+        self.assertEqual(set(actual), expected)
+
+class CategoryTotalTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.utilities = Category.objects.create(name='Utilities')
+        self.rent = Category.objects.create(name='Rent')
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.utilities,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+    
+    def totals(self):
+        return {
+            (row.category.name if row.category else None): (row.total, row.expense_count)
+            for row in CategoryTotal.objects.filter(user=self.user, expense_count__gt=0).select_related('category')
+        }
+    
+    def test_totals_follow_expense_changes(self):
+        """Test that creating, editing, deactivating and deleting expenses updates the totals"""
+        RecurringExpense.objects.create(
+            name='Water',
+            amount=Decimal('25.00'),
+            category=self.utilities,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('100.00'), 2)})
+        
+        self.expense.category = self.rent
+        self.expense.amount = Decimal('80.00')
+        self.expense.save()
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('25.00'), 1), 'Rent': (Decimal('80.00'), 1)})
+        
+        self.expense.is_active = False
+        self.expense.save()
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('25.00'), 1)})
+        
+        self.expense.is_active = True
+        self.expense.category = None
+        self.expense.save()
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('25.00'), 1), None: (Decimal('80.00'), 1)})
+        
+        self.expense.delete()
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('25.00'), 1)})
+    
+    def test_deleting_category_moves_total_to_uncategorized(self):
+        """Test that expenses left without a category keep counting as uncategorized"""
+        self.utilities.delete()
+        self.assertEqual(self.totals(), {None: (Decimal('75.00'), 1)})
+    
+    def test_import_updates_totals(self):
+        """Test that bulk imported expenses are added to the totals"""
+        BackupImporter(self.user).import_data({
+            'categories': [],
+            'expenses': [
+                {
+                    'name': 'Rent',
+                    'amount': '900.00',
+                    'category_name': 'Rent',
+                    'frequency': 'MONTHLY',
+                    'due_date': date.today().isoformat(),
+                },
+                {
+                    'name': 'Old Gym',
+                    'amount': '30.00',
+                    'category_name': 'Rent',
+                    'frequency': 'MONTHLY',
+                    'due_date': date.today().isoformat(),
+                    'is_active': False,
+                },
+            ]
+        })
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('75.00'), 1), 'Rent': (Decimal('900.00'), 1)})
+    
+    def test_rebuild_repairs_totals(self):
+        """Test that rebuilding recomputes totals that drifted"""
+        RecurringExpense.objects.filter(pk=self.expense.pk).update(amount=Decimal('60.00'))
+        CategoryTotal.objects.create(user=self.user, category=self.rent, total=Decimal('5.00'), expense_count=1)
+        
+        call_command('rebuild_category_totals', 'testuser', stdout=io.StringIO())
+        self.assertEqual(self.totals(), {'Utilities': (Decimal('60.00'), 1)})
+    
+    def test_chart_reads_totals(self):
+        """Test that the chart data comes from the totals in a single query"""
+        RecurringExpense.objects.create(
+            name='Rent',
+            amount=Decimal('1000.00'),
+            category=self.rent,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        client = Client()
+        client.login(username='testuser', password='testpassword')
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('expenses:expense_chart_data'))
+        data = response.json()
+        
+        self.assertEqual(data['labels'], ['Utilities', 'Rent'])
+        self.assertEqual(data['datasets'][0]['data'], [75.0, 1000.0])
+        # Session, user, the totals and loading the category registry, as
+        # the categories are new
+        self.assertEqual(len(queries), 4)
+
+class ChartCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.category = Category.objects.create(name='Utilities')
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.url = reverse('expenses:expense_chart_data')
+    
+    def test_repeat_load_reads_no_expense_data(self):
+        """Test that a cached chart is served without touching expense tables"""
+        first = self.client.get(self.url).json()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url).json()
+        
+        self.assertEqual(first, second)
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('expenses_', tables)
+    
+    def test_expense_change_invalidates(self):
+        """Test that editing an expense or a category bumps the user's cached chart"""
+        self.client.get(self.url)
+        self.expense.amount = Decimal('80.00')
+        self.expense.save()
+        self.assertEqual(self.client.get(self.url).json()['datasets'][0]['data'], [80.0])
+        
+        self.category.name = 'Power'
+        self.category.save()
+        self.assertEqual(self.client.get(self.url).json()['labels'], ['Power'])
+    
+    def test_cache_is_per_user(self):
+        """Test that users never see each other's cached chart"""
+        self.client.get(self.url)
+        User.objects.create_user(username='other', password='otherpassword')
+        other = Client()
+        other.login(username='other', password='otherpassword')
+        self.assertEqual(other.get(self.url).json()['labels'], [])
+    
+    def test_hit_and_miss_counters(self):
+        """Test that the counters record cache hits and misses"""
+        before = cache_stats()
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        after = cache_stats()
+        # Only the chart is counted, not its conditional GET validators
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        
+        # Only staff can read the counters
+        self.assertEqual(self.client.get(reverse('expenses:cache_stats')).status_code, 302)
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        stats = self.client.get(reverse('expenses:cache_stats')).json()
+        self.assertIn('hit_rate', stats)
+
+class ExpenseTrendTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.url = reverse('expenses:expense_trend_data')
+        
+        utilities = Category.objects.create(name='Utilities')
+        self.electricity = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=utilities,
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 5),
+            user=self.user
+        )
+        self.misc = RecurringExpense.objects.create(
+            name='Misc',
+            amount=Decimal('10.00'),
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 5),
+            user=self.user
+        )
+        for payment_date, expense, amount in [
+            (date(2024, 1, 5), self.electricity, '75.00'),
+            (date(2024, 1, 31), self.misc, '10.00'),
+            (date(2024, 3, 5), self.electricity, '80.00'),
+            (date(2024, 4, 1), self.electricity, '70.00'),
+        ]:
+            ExpensePayment.objects.create(
+                recurring_expense=expense,
+                payment_date=payment_date,
+                amount_paid=Decimal(amount)
+            )
+    
+    def test_monthly_totals_fill_empty_months(self):
+        """Test that totals are grouped by month, with zeros for months without payments"""
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {'start': '2024-01', 'end': '2024-03'}).json()
+        
+        self.assertEqual(data['labels'], ['Jan 2024', 'Feb 2024', 'Mar 2024'])
+        self.assertEqual(data['datasets'], [{'label': 'Monthly Expenses', 'data': [85.0, 0.0, 80.0]}])
+        # Session, user and one grouped payments query
+        self.assertEqual(len(queries), 3)
+        # Months are truncated by SQLite itself rather than a Python function
+        self.assertNotIn('django_date_trunc', queries[-1]['sql'])
+    
+    def test_split_by_category(self):
+        """Test that by_category returns one series per category"""
+        data = self.client.get(self.url, {'start': '2024-01', 'end': '2024-04', 'by_category': '1'}).json()
+        series = {dataset['label']: dataset['data'] for dataset in data['datasets']}
+        self.assertEqual(series, {
+            'Utilities': [75.0, 0.0, 80.0, 70.0],
+            'Uncategorized': [10.0, 0.0, 0.0, 0.0],
+        })
+    
+    def test_months_parameter(self):
+        """Test that months counts back from the end month"""
+        data = self.client.get(self.url, {'end': '2024-04', 'months': '2'}).json()
+        self.assertEqual(data['labels'], ['Mar 2024', 'Apr 2024'])
+        self.assertEqual(data['datasets'][0]['data'], [80.0, 70.0])
+        
+        # By default the last 12 months up to the current one are reported
+        data = self.client.get(self.url).json()
+        self.assertEqual(len(data['labels']), 12)
+        self.assertEqual(data['labels'][-1], timezone.now().date().strftime('%b %Y'))
+    
+    def test_invalid_range(self):
+        """Test that malformed or oversized ranges are rejected"""
+        for params in [{'start': '2024-13'}, {'months': '0'}, {'months': 'x'},
+                       {'start': '2024-05', 'end': '2024-01'}, {'start': '2000-01', 'end': '2024-01'},
+                       {'end': '9999-12'}, {'end': '0001-01'}]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class ForecastTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.url = reverse('expenses:expense_forecast')
+        cache.clear()
+        
+        self.utilities = Category.objects.create(name='Utilities')
+        self.today = timezone.now().date()
+    
+    def test_forecast_totals(self):
+        """Test that occurrences are totalled per month and per category"""
+        expenses = [
+            RecurringExpense(name='Rent', amount=Decimal('1000.00'), frequency='MONTHLY',
+                             due_date=date(2024, 1, 31), user=self.user),
+            RecurringExpense(name='Power', amount=Decimal('50.00'), frequency='WEEKLY',
+                             due_date=date(2024, 1, 1), category=self.utilities, user=self.user),
+            RecurringExpense(name='Insurance', amount=Decimal('600.00'), frequency='YEARLY',
+                             due_date=date(2023, 3, 15), category=self.utilities, user=self.user),
+        ]
+        result = forecast(expenses, date(2024, 2, 10), 2)
+        
+        self.assertEqual(result['end'], date(2024, 4, 1))
+        # Rent falls on Feb 29 and Mar 31; Mondays from Feb 12 on; insurance in March
+        self.assertEqual(result['by_month'], [
+            (date(2024, 2, 1), Decimal('1000.00') + 3 * Decimal('50.00')),
+            (date(2024, 3, 1), Decimal('1000.00') + 4 * Decimal('50.00') + Decimal('600.00')),
+        ])
+        self.assertEqual(result['by_category'], [
+            ('Utilities', 7 * Decimal('50.00') + Decimal('600.00')),
+            (None, Decimal('2000.00')),
+        ])
+        self.assertEqual(result['total'], Decimal('2950.00'))
+    
+    def test_forecast_endpoint(self):
+        """Test that the endpoint covers active expenses over the requested months"""
+        RecurringExpense.objects.create(
+            name='Rent',
+            amount=Decimal('1000.00'),
+            frequency='MONTHLY',
+            due_date=self.today.replace(day=1) + relativedelta(months=1),
+            user=self.user
+        )
+        RecurringExpense.objects.create(
+            name='Old Gym',
+            amount=Decimal('30.00'),
+            frequency='MONTHLY',
+            due_date=self.today,
+            is_active=False,
+            user=self.user
+        )
+        
+        data = self.client.get(self.url, {'months': '24'}).json()
+        self.assertEqual(data['months'], 24)
+        self.assertEqual(len(data['by_month']), 24)
+        self.assertEqual(data['by_month'][0], {'month': self.today.strftime('%Y-%m'), 'total': '0.00'})
+        self.assertEqual(data['by_month'][1]['total'], '1000.00')
+        self.assertEqual(data['by_category'], [{'category': 'Uncategorized', 'total': '23000.00'}])
+        self.assertEqual(data['total'], '23000.00')
+    
+    def test_forecast_is_cached_until_data_changes(self):
+        """Test that repeat requests are served from the cache until an expense changes"""
+        RecurringExpense.objects.create(
+            name='Rent',
+            amount=Decimal('1000.00'),
+            frequency='MONTHLY',
+            due_date=self.today,
+            user=self.user
+        )
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url).json()
+        # Only the session and user lookups
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(data['total'], '12000.00')
+        
+        RecurringExpense.objects.filter(name='Rent').get().delete()
+        self.assertEqual(self.client.get(self.url).json()['total'], '0.00')
+    
+    def test_invalid_months(self):
+        """Test that out of range month counts are rejected"""
+        for months in ['0', '121', 'x']:
+            response = self.client.get(self.url, {'months': months})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class KeysetApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        
+        # Several expenses share a due date so pages have to break ties on id
+        self.expenses = []
+        for i in range(7):
+            self.expenses.append(RecurringExpense.objects.create(
+                name=f"Expense {i}",
+                amount=Decimal('10.00'),
+                frequency='MONTHLY',
+                due_date=date(2024, 1, 1) + timedelta(days=i // 3),
+                is_active=i != 6,
+                user=self.user
+            ))
+        other = RecurringExpense.objects.create(
+            name='Other',
+            amount=Decimal('10.00'),
+            frequency='MONTHLY',
+            due_date=date(2024, 1, 1),
+            user=self.other_user
+        )
+        for expense in [self.expenses[0], self.expenses[1], other]:
+            for n, day in enumerate([1, 1, 2]):
+                ExpensePayment.objects.create(
+                    recurring_expense=expense,
+                    payment_date=date(2024, 2, day),
+                    amount_paid=Decimal('10.00'),
+                    notes=f'Payment {n}'
+                )
+    
+    def fetch_all(self, url, params):
+        """Follow next links, returning the result ids and the number of pages"""
+        ids = []
+        pages = 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(item['id'] for item in data['results'])
+            pages += 1
+            if not data['next']:
+                self.assertIsNone(data['next_cursor'])
+                return ids, pages
+            response = self.client.get(data['next'])
+    
+    def test_expense_pages(self):
+        """Test that paging visits every expense once in (due_date, id) order"""
+        ids, pages = self.fetch_all(reverse('expenses:expense_list_api'), {'limit': 2})
+        self.assertEqual(ids, [expense.id for expense in self.expenses])
+        self.assertEqual(pages, 4)
+        
+        ids, pages = self.fetch_all(reverse('expenses:expense_list_api'), {'limit': 2, 'active': '1'})
+        self.assertEqual(ids, [expense.id for expense in self.expenses[:6]])
+    
+    def test_expense_fields(self):
+        """Test that expenses are serialized like the backup"""
+        data = self.client.get(reverse('expenses:expense_list_api'), {'limit': 1}).json()
+        self.assertEqual(data['results'], [{
+            'id': self.expenses[0].id,
+            'name': 'Expense 0',
+            'amount': '10.00',
+            'category_name': None,
+            'frequency': 'MONTHLY',
+            'due_date': '2024-01-01',
+            'description': '',
+            'is_active': True,
+        }])
+    
+    def test_payment_pages(self):
+        """Test that payments are paged in (payment_date, id) order for the user only"""
+        expected = list(ExpensePayment.objects.filter(
+            recurring_expense__user=self.user
+        ).order_by('payment_date', 'id').values_list('id', flat=True))
+        ids, pages = self.fetch_all(reverse('expenses:payment_list_api'), {'limit': 4})
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 2)
+        
+        ids, _ = self.fetch_all(reverse('expenses:payment_list_api'), {'expense': self.expenses[1].id})
+        self.assertEqual(ids, list(self.expenses[1].expensepayment_set.order_by('payment_date', 'id').values_list('id', flat=True)))
+    
+    def test_pages_use_keyset_not_offset(self):
+        """Test that later pages filter on the cursor instead of skipping rows"""
+        url = reverse('expenses:expense_list_api')
+        data = self.client.get(url, {'limit': 2}).json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(data['next'])
+        sql = queries[-1]['sql']
+        self.assertNotIn('OFFSET', sql)
+        self.assertIn('"due_date" >', sql)
+    
+    def test_invalid_parameters(self):
+        """Test that malformed cursors and limits are rejected"""
+        for url in [reverse('expenses:expense_list_api'), reverse('expenses:payment_list_api')]:
+            for params in [{'cursor': 'not-a-cursor'}, {'limit': '0'}, {'limit': '501'}, {'limit': 'x'}]:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.staff = User.objects.create_user(
+            username='staffuser',
+            password='testpassword',
+            is_staff=True
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        registry.reset()
+    
+    def test_requests_are_recorded_per_view(self):
+        """Test that latency, query count and query time are recorded by URL name"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('expenses:home'))
+        home_queries = len(queries)
+        self.client.get(reverse('expenses:home'))
+        self.client.get('/no-such-page/')
+        
+        stats = registry.snapshot()
+        home = stats['expenses:home']
+        self.assertEqual(home.count, 2)
+        self.assertEqual(sum(home.buckets), 2)
+        self.assertEqual(home.queries, 2 * home_queries)
+        self.assertGreater(home.query_duration, 0)
+        self.assertGreaterEqual(home.duration, home.query_duration)
+        self.assertEqual(stats[UNRESOLVED].count, 1)
+    
+    def test_metrics_endpoint_is_staff_only(self):
+        """Test that only staff can read the metrics"""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 302)
+    
+    def test_prometheus_format(self):
+        """Test that the metrics are rendered in the Prometheus text format"""
+        self.client.get(reverse('expenses:home'))
+        self.client.login(username='staffuser', password='testpassword')
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE expenses_request_duration_seconds histogram', body)
+        self.assertIn('expenses_request_duration_seconds_bucket{view="expenses:home",le="+Inf"} 1', body)
+        self.assertIn('expenses_request_duration_seconds_count{view="expenses:home"} 1', body)
+        self.assertRegex(body, r'expenses_db_queries_total\{view="expenses:home"\} [1-9]')
+        self.assertIn('expenses_cache_lookups_total{result="hit"}', body)
+        
+        # Buckets are cumulative
+        buckets = [
+            int(line.rsplit(' ', 1)[1]) for line in body.splitlines()
+            if line.startswith('expenses_request_duration_seconds_bucket{view="expenses:home"')
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+
+
+class BenchExpensesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def test_bench_views(self):
+        """Test that every view is measured against a seeded dataset"""
+        user = seed_dataset(users=2, expenses=5, payments=3, categories=3)[0]
+        results = bench_views(user, repeat=2, import_expenses=3, import_payments=2)
+        
+        self.assertEqual(
+            set(results),
+            {'home', 'dashboard', 'expense_chart_data', 'export_data', 'import_data'}
+        )
+        for result in results.values():
+            self.assertLessEqual(result['median_ms'], result['p95_ms'])
+            self.assertGreater(result['queries'], 0)
+        # Cold requests run the queries that the caches save warm ones; the
+        # export streams from the database either way
+        for view in ['home', 'expense_chart_data']:
+            self.assertLessEqual(results[view]['warm_median_ms'], results[view]['warm_p95_ms'])
+            self.assertGreater(results[view]['queries'], results[view]['warm_queries'])
+        # Every import ran as its own user, so nothing was skipped
+        self.assertEqual(RecurringExpense.objects.filter(user__username__startswith='bench-import-').count(), 6)
+    
+    def test_percentile(self):
+        """Test the nearest-rank percentile shared by the benchmarks"""
+        samples = list(range(1, 21))
+        self.assertEqual(percentile(samples, 0.95), 19)
+        self.assertEqual(percentile(samples, 1), 20)
+        self.assertEqual(percentile([5.0], 0.95), 5.0)
+    
+    def test_check_thresholds(self):
+        """Test that measurements over their limits are reported"""
+        results = {'home': {'median_ms': 10.0, 'p95_ms': 20.0, 'queries': 6}}
+        self.assertEqual(check_thresholds(results, {'home': {'p95_ms': 20, 'queries': 6}}), [])
+        self.assertEqual(check_thresholds(results, {'home': {'queries': 5}, 'export_data': {'p95_ms': 1}}), [
+            'home.queries: 6 exceeds 5',
+            'export_data: no measurement',
+        ])
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.today = timezone.now().date()
+        utilities = Category.objects.create(name='Utilities')
+        expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=utilities,
+            frequency='MONTHLY',
+            due_date=self.today - timedelta(days=2),
+            user=self.user
+        )
+        RecurringExpense.objects.create(
+            name='Misc',
+            amount=Decimal('10.00'),
+            frequency='MONTHLY',
+            due_date=self.today + timedelta(days=3),
+            user=self.user
+        )
+        ExpensePayment.objects.create(
+            recurring_expense=expense,
+            payment_date=self.today,
+            amount_paid=Decimal('75.00')
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+        registry.reset()
+    
+    def test_urls_switch_to_async_views(self):
+        """Test that the async views are only routed when enabled"""
+        self.assertEqual(resolve(reverse('expenses:home')).func, home)
+        with async_views():
+            self.assertEqual(resolve(reverse('expenses:home')).func, async_home)
+            self.assertEqual(resolve(reverse('expenses:expense_chart_data')).func, async_expense_chart_data)
+        self.assertEqual(resolve(reverse('expenses:home')).func, home)
+    
+    async def test_async_home_matches_sync(self):
+        """Test that the async home page has the same context as the sync one"""
+        sync_response = await sync_to_async(self.client.get)(reverse('expenses:home'))
+        expected = await sync_to_async(self.home_context)(sync_response)
+        # Render every section again rather than from the fragment cache
+        await sync_to_async(cache.clear)()
+        registry.reset()
+        await self.async_client.aforce_login(self.user)
+        with async_views():
+            response = await self.async_client.get(reverse('expenses:home'))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'expenses/home.html')
+        context = await sync_to_async(self.home_context)(response)
+        self.assertEqual(context, expected)
+        self.assertTrue(context['upcoming_payments'][0]['is_satisfied'])
+        
+        # The metrics middleware stays async and still sees the queries
+        self.assertGreater(registry.snapshot()['expenses:home'].queries, 2)
+    
+    def home_context(self, response):
+        keys = ['total_by_category', 'upcoming_payments', 'expenses', 'recent_payments']
+        return {key: list(response.context[key]) for key in keys}
+    
+    async def test_async_chart_matches_sync(self):
+        """Test that the async chart data is the same as the sync data and is cached"""
+        expected = (await sync_to_async(self.client.get)(reverse('expenses:expense_chart_data'))).json()
+        await self.async_client.aforce_login(self.user)
+        cache.clear()
+        with async_views():
+            first = await self.async_client.get(reverse('expenses:expense_chart_data'))
+            hits = cache_stats()['hits']
+            second = await self.async_client.get(reverse('expenses:expense_chart_data'))
+        
+        self.assertEqual(first.json(), expected)
+        self.assertEqual(second.json(), expected)
+        # The chart; its conditional GET validators are not counted
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+
+
+class SQLiteBackendStressTest(unittest.TestCase):
+    """Concurrent writers and readers against a file database of their own
+    
+    A plain unittest TestCase, as Django's test cases forbid connections to
+    databases that are not in settings.DATABASES.
+    """
+    alias = 'stress'
+    writers = 8
+    transactions = 25
+    readers = 4
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        connections.settings[self.alias] = connections.configure_settings({
+            'default': {},
+            self.alias: {
+                'ENGINE': 'expenses.db.sqlite3',
+                'NAME': os.path.join(directory, 'stress.sqlite3'),
+                'OPTIONS': {'busy_timeout': 200, 'busy_retries': 20, 'busy_backoff': 0.01},
+            }
+        })[self.alias]
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(self.close_connection)
+        
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE stress (id INTEGER PRIMARY KEY, writer INTEGER, seq INTEGER)')
+    
+    def close_connection(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+    
+    def run_in_threads(self, targets):
+        errors = []
+        
+        def run(target):
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self.close_connection()
+        
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+    
+    def test_pragmas_are_applied(self):
+        """Test that every connection gets the configured pragmas"""
+        with connections[self.alias].cursor() as cursor:
+            pragmas = {}
+            for name in ['journal_mode', 'synchronous', 'busy_timeout', 'cache_size']:
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 200, 'cache_size': -32000})
+        self.assertEqual(connections[self.alias].transaction_mode, 'IMMEDIATE')
+    
+    def test_busy_retry_counts_as_one_query(self):
+        """Test that execute wrappers and the query log see a retried statement once"""
+        # Another connection holds the write lock for a while
+        other = sqlite3.connect(connections[self.alias].settings_dict['NAME'], check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.5, other.rollback)
+        release.start()
+        self.addCleanup(release.cancel)
+        
+        calls = []
+        
+        def count(execute, sql, params, many, context):
+            calls.append(sql)
+            return execute(sql, params, many, context)
+        
+        connection = connections[self.alias]
+        with mock.patch('expenses.db.sqlite3.base.time.sleep', wraps=time.sleep) as sleep, \
+                connection.execute_wrapper(count), CaptureQueriesContext(connection) as queries:
+            with connection.cursor() as cursor:
+                cursor.execute('INSERT INTO stress (writer, seq) VALUES (%s, %s)', [0, 0])
+        self.assertTrue(sleep.called)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(queries), 1)
+    
+    def test_concurrent_writes_and_reads(self):
+        """Test that read-then-write transactions from many threads all commit"""
+        done = threading.Event()
+        reads = []
+        
+        def write(writer):
+            def target():
+                for _ in range(self.transactions):
+                    # Reading first is what fails to upgrade to a write lock
+                    # under BEGIN DEFERRED when another thread is writing
+                    with transaction.atomic(using=self.alias):
+                        with connections[self.alias].cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*) FROM stress WHERE writer = %s', [writer])
+                            seq = cursor.fetchone()[0]
+                            cursor.execute('INSERT INTO stress (writer, seq) VALUES (%s, %s)', [writer, seq])
+            return target
+        
+        def read():
+            while not done.is_set():
+                with connections[self.alias].cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM stress')
+                    reads.append(cursor.fetchone()[0])
+        
+        reader_threads = [threading.Thread(target=read) for _ in range(self.readers)]
+        for thread in reader_threads:
+            thread.start()
+        try:
+            errors = self.run_in_threads([write(i) for i in range(self.writers)])
+        finally:
+            done.set()
+            for thread in reader_threads:
+                thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertTrue(reads)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT writer, COUNT(*), MAX(seq) FROM stress GROUP BY writer')
+            rows = cursor.fetchall()
+        self.assertEqual(sorted(rows), [(i, self.transactions, self.transactions - 1) for i in range(self.writers)])
+    
+    def test_concurrent_edits_keep_category_totals(self):
+        """Test that concurrent edits of one expense leave its category total right"""
+        with connections[self.alias].schema_editor() as editor:
+            for model in [User, Category, RecurringExpense, ExpensePayment, CategoryTotal]:
+                editor.create_model(model)
+        user = User.objects.db_manager(self.alias).create_user(username='testuser', password='testpassword')
+        expense = RecurringExpense(
+            name='Electricity',
+            amount=Decimal('1.00'),
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user_id=user.pk
+        )
+        expense.save(using=self.alias)
+        
+        def edit(writer):
+            def target():
+                for i in range(self.transactions):
+                    # Each save replaces whatever the other threads stored last
+                    copy = RecurringExpense.objects.using(self.alias).get(pk=expense.pk)
+                    copy.amount = Decimal(writer * 100 + i + 1)
+                    copy.save(using=self.alias)
+            return target
+        
+        errors = self.run_in_threads([edit(i) for i in range(self.writers)])
+        self.assertEqual(errors, [])
+        stored = RecurringExpense.objects.using(self.alias).get(pk=expense.pk)
+        total = CategoryTotal.objects.using(self.alias).get(user_id=user.pk, category=None)
+        self.assertEqual((total.total, total.expense_count), (stored.amount, 1))
+
+
+@override_settings(EXPENSES_READ_REPLICA='replica')
+class ReplicaRoutingTest(TransactionTestCase):
+    # The replica mirrors the test database, so rows must be committed for it to see them
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword',
+            is_staff=True,
+            is_superuser=True
+        )
+        category = Category.objects.create(name='Utilities')
+        expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=category,
+            frequency='MONTHLY',
+            due_date=timezone.now().date(),
+            user=self.user
+        )
+        ExpensePayment.objects.create(
+            recurring_expense=expense,
+            payment_date=timezone.now().date(),
+            amount_paid=Decimal('75.00')
+        )
+        self.client.force_login(self.user)
+        # Logging in wrote the session, which would pin the client to the primary
+        self.client.cookies.pop(PIN_COOKIE, None)
+        cache.clear()
+        # The category registry loads from the primary once per process
+        category_registry.snapshot().all()
+    
+    def expense_query_aliases(self, method, url, **kwargs):
+        """Return the response and the aliases that expenses tables were read from"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        aliases = set()
+        for alias, queries in [('default', primary), ('replica', replica)]:
+            if any('"expenses_' in query['sql'] and query['sql'].startswith('SELECT') for query in queries):
+                aliases.add(alias)
+        return response, aliases
+    
+    def test_reporting_views_read_from_replica(self):
+        """Test that report views and admin changelists read from the replica"""
+        for url in [
+            reverse('expenses:expense_trend_data'),
+            reverse('expenses:expense_list_api'),
+            reverse('expenses:payment_list_api'),
+            reverse('admin:expenses_recurringexpense_changelist'),
+            reverse('admin:expenses_expensepayment_changelist'),
+        ]:
+            with self.subTest(url=url):
+                response, aliases = self.expense_query_aliases('get', url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(aliases, {'replica'})
+    
+    def test_other_views_read_from_primary(self):
+        """Test that pages that are not reports keep reading from the primary"""
+        response, aliases = self.expense_query_aliases('get', reverse('expenses:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {'default'})
+        
+        # Backups and deltas carry a sync token, so they must not lag behind
+        # it, and cached results would outlive the replica's lag
+        for url in [
+            reverse('expenses:expense_chart_data'),
+            reverse('expenses:expense_forecast'),
+            reverse('expenses:export_data'),
+            reverse('expenses:export_data') + '?stream=1',
+            reverse('expenses:sync_data'),
+        ]:
+            with self.subTest(url=url):
+                response, aliases = self.expense_query_aliases('get', url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(aliases, {'default'})
+        
+        response, aliases = self.expense_query_aliases(
+            'get', reverse('admin:expenses_recurringexpense_change', args=[RecurringExpense.objects.get().pk])
+        )
+        self.assertEqual(aliases, {'default'})
+    
+    def test_writes_pin_to_primary(self):
+        """Test that a request that writes pins the client to the primary for a while"""
+        backup = json.dumps({'categories': [], 'expenses': []}).encode()
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPENSES_IMPORT_WORKER_THREADS=0):
+            response = self.client.post(reverse('expenses:import_data'), {
+                'import_file': SimpleUploadedFile('backup.json', backup, content_type='application/json')
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 15)
+        
+        _, aliases = self.expense_query_aliases('get', reverse('expenses:expense_list_api'))
+        self.assertEqual(aliases, {'default'})
+        
+        # Once the pin expires reports go back to the replica
+        self.client.cookies.pop(PIN_COOKIE)
+        _, aliases = self.expense_query_aliases('get', reverse('expenses:expense_list_api'))
+        self.assertEqual(aliases, {'replica'})
+    
+    def test_write_within_a_report_pins_the_rest_of_the_request(self):
+        """Test that reads after a write in the same block go to the primary"""
+        with use_replica():
+            self.assertEqual(RecurringExpense.objects.all().db, 'replica')
+            Category.objects.create(name='Rent')
+            self.assertEqual(RecurringExpense.objects.all().db, 'default')
+    
+    @override_settings(EXPENSES_READ_REPLICA=None)
+    def test_disabled_without_replica(self):
+        """Test that nothing is routed to the replica unless one is configured"""
+        _, aliases = self.expense_query_aliases('get', reverse('expenses:expense_trend_data'))
+        self.assertEqual(aliases, {'default'})
+
+
+class HomeFragmentCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.today = timezone.now().date()
+        self.category = Category.objects.create(name='Utilities')
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=self.today + timedelta(days=3),
+            user=self.user
+        )
+        cache.clear()
+    
+    def get_home(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('expenses:home'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(queries)
+    
+    def test_repeat_render_skips_queries(self):
+        """Test that a repeat render is served from the fragment cache"""
+        first, first_queries = self.get_home()
+        second, second_queries = self.get_home()
+        
+        self.assertEqual(first, second)
+        self.assertIn('Electricity', second)
+        # Only the session and user lookups remain
+        self.assertEqual(second_queries, 2)
+        self.assertGreater(first_queries, second_queries)
+    
+    def test_changes_invalidate_fragments(self):
+        """Test that expense, payment and category changes show up straight away"""
+        self.get_home()
+        
+        RecurringExpense.objects.create(
+            name='Water',
+            amount=Decimal('20.00'),
+            frequency='MONTHLY',
+            due_date=self.today + timedelta(days=5),
+            user=self.user
+        )
+        self.assertIn('Water', self.get_home()[0])
+        
+        payment = ExpensePayment.objects.create(
+            recurring_expense=self.expense,
+            payment_date=self.today,
+            amount_paid=Decimal('75.00'),
+            notes='Paid online'
+        )
+        self.assertIn('Paid online', self.get_home()[0])
+        
+        payment.delete()
+        self.assertNotIn('Paid online', self.get_home()[0])
+        
+        self.category.name = 'Energy'
+        self.category.save()
+        content = self.get_home()[0]
+        self.assertIn('Energy', content)
+        self.assertNotIn('Utilities', content)
+    
+    def test_other_users_changes_keep_fragments(self):
+        """Test that another user's changes do not invalidate this user's sections"""
+        self.get_home()
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        RecurringExpense.objects.create(
+            name='Other',
+            amount=Decimal('20.00'),
+            frequency='MONTHLY',
+            due_date=self.today,
+            user=other
+        )
+        self.assertEqual(self.get_home()[1], 2)
+    
+    def test_upcoming_rolls_over_with_the_date(self):
+        """Test that the date dependent sections are rendered again the next day"""
+        self.get_home()
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            content, queries = self.get_home()
+        self.assertGreater(queries, 2)
+        self.assertIn('Electricity', content)
+    
+    async def test_async_home_skips_queries_when_cached(self):
+        """Test that the async view does not query when every section is cached"""
+        await sync_to_async(self.get_home)()
+        await self.async_client.aforce_login(self.user)
+        registry.reset()
+        with async_views():
+            response = await self.async_client.get(reverse('expenses:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Electricity', response.content.decode())
+        # Only the session and user lookups, as counted by the metrics middleware
+        self.assertEqual(registry.snapshot()['expenses:home'].queries, 2)
+        self.assertEqual(registry.snapshot()['expenses:home'].count, 1)
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.category = Category.objects.create(name='Utilities')
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=timezone.now().date(),
+            user=self.user
+        )
+        self.payment = ExpensePayment.objects.create(
+            recurring_expense=self.expense,
+            payment_date=timezone.now().date(),
+            amount_paid=Decimal('75.00')
+        )
+        cache.clear()
+    
+    def revalidate(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers=headers)
+        return response, len(queries)
+    
+    def test_responses_carry_validators(self):
+        """Test that the chart and the export send an ETag and Last-Modified"""
+        for name in ['expenses:expense_chart_data', 'expenses:export_data']:
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+    
+    def test_unchanged_data_is_not_modified(self):
+        """Test that a matching validator gets a 304 without running the view"""
+        for name in ['expenses:expense_chart_data', 'expenses:export_data']:
+            url = reverse(name)
+            response = self.client.get(url)
+            
+            with mock.patch('expenses.views.iter_export_json') as export, \
+                    mock.patch('expenses.views._chart_totals') as totals:
+                not_modified, queries = self.revalidate(url, if_none_match=response['ETag'])
+                since, _ = self.revalidate(url, if_modified_since=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(since.status_code, 304)
+            self.assertFalse(export.called)
+            self.assertFalse(totals.called)
+            # Only the session and the user, as the validators are cached
+            self.assertEqual(queries, 2)
+    
+    def test_changes_alter_the_etag(self):
+        """Test that edits, new rows and deletions all change the ETag"""
+        url = reverse('expenses:export_data')
+        changes = [
+            lambda: ExpensePayment.objects.create(
+                recurring_expense=self.expense,
+                payment_date=timezone.now().date(),
+                amount_paid=Decimal('10.00')
+            ),
+            lambda: self.payment.delete(),
+            lambda: Category(pk=self.category.pk, name='Power').save(),
+            lambda: self.category.delete(),
+            lambda: self.expense.delete(),
+        ]
+        etag = self.client.get(url)['ETag']
+        for change in changes:
+            change()
+            response, _ = self.revalidate(url, if_none_match=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+    
+    def test_validators_take_no_query(self):
+        """Test that the validators come from the data version without reading the payments"""
+        for i in range(20):
+            ExpensePayment.objects.create(
+                recurring_expense=self.expense,
+                payment_date=timezone.now().date() - timedelta(days=i + 1),
+                amount_paid=Decimal('75.00')
+            )
+        cache.clear()
+        with self.assertNumQueries(0):
+            etag, last_modified = user_data_validators(self.user)
+        self.assertEqual(user_data_validators(self.user), (etag, last_modified))
+        self.assertIsNotNone(last_modified)
+    
+    def test_validators_are_per_user(self):
+        """Test that another user's changes leave this user's ETag alone"""
+        url = reverse('expenses:expense_chart_data')
+        etag = self.client.get(url)['ETag']
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        RecurringExpense.objects.create(
+            name='Other',
+            amount=Decimal('20.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=timezone.now().date(),
+            user=other
+        )
+        response, _ = self.revalidate(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    async def test_async_chart_is_not_modified(self):
+        """Test that the async chart answers conditional requests too"""
+        await self.async_client.aforce_login(self.user)
+        with async_views():
+            url = reverse('expenses:expense_chart_data')
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            not_modified = await self.async_client.get(url, headers={'if_none_match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+
+class DeltaSyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client = Client()
+        self.client.login(username='testuser', password='testpassword')
+        self.category = Category.objects.create(name='Utilities')
+        self.expense = RecurringExpense.objects.create(
+            name='Electricity',
+            amount=Decimal('75.00'),
+            category=self.category,
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=self.user
+        )
+        self.payment = ExpensePayment.objects.create(
+            recurring_expense=self.expense,
+            payment_date=date.today(),
+            amount_paid=Decimal('75.00')
+        )
+        self.url = reverse('expenses:sync_data')
+    
+    def sync(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+    
+    def token_after_overlap(self):
+        """A token old enough that the rows from setUp fall before it"""
+        return make_sync_token(self.user, timezone.now() + SYNC_OVERLAP)
+    
+    def test_delta_holds_only_changes(self):
+        """Test that a delta lists changed rows and tombstones but nothing else"""
+        token = self.token_after_overlap()
+        self.assertEqual(self.sync(token=token)['expenses'], [])
+        
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + 2 * SYNC_OVERLAP):
+            rent = RecurringExpense.objects.create(
+                name='Rent',
+                amount=Decimal('1000.00'),
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+            payment = ExpensePayment.objects.create(
+                recurring_expense=self.expense,
+                payment_date=date.today(),
+                amount_paid=Decimal('80.00')
+            )
+            self.payment.delete()
+        
+        with CaptureQueriesContext(connection) as queries:
+            delta = self.sync(token=token)
+        self.assertEqual([row['sync_id'] for row in delta['expenses']], [str(rent.sync_id)])
+        self.assertEqual([row['sync_id'] for row in delta['payments']], [str(payment.sync_id)])
+        self.assertEqual(delta['payments'][0]['expense_sync_id'], str(self.expense.sync_id))
+        self.assertEqual(delta['deleted'], {'expenses': [], 'payments': [str(self.payment.sync_id)]})
+        # Session, user, the category registry, expenses, payments and
+        # tombstones; the registry reloads since the test runs in a transaction
+        self.assertEqual(len(queries), 6)
+    
+    def test_category_rename_resends_its_expenses(self):
+        """Test that the expenses of a renamed category are part of the delta"""
+        token = self.token_after_overlap()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + 2 * SYNC_OVERLAP):
+            self.category.name = 'Power'
+            self.category.save()
+        delta = self.sync(token=token)
+        self.assertEqual([row['category_name'] for row in delta['expenses']], ['Power'])
+        self.assertEqual(delta['categories'], [{'id': self.category.pk, 'name': 'Power'}])
+    
+    def test_category_delete_resends_its_expenses(self):
+        """Test that the expenses of a deleted category are sent again without it"""
+        token = self.token_after_overlap()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + 2 * SYNC_OVERLAP):
+            self.category.delete()
+        delta = self.sync(token=token)
+        self.assertEqual(
+            [(row['sync_id'], row['category_id']) for row in delta['expenses']],
+            [(str(self.expense.sync_id), None)]
+        )
+        self.assertEqual(delta['categories'], [])
+    
+    def test_cascaded_deletes_leave_one_tombstone(self):
+        """Test that deleting an expense records it but not its payments, and users leave none"""
+        sync_id = self.expense.sync_id
+        self.expense.delete()
+        self.assertEqual(list(Tombstone.objects.values_list('kind', 'sync_id')), [('EXPENSE', sync_id)])
+        
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        RecurringExpense.objects.create(
+            name='Other',
+            amount=Decimal('20.00'),
+            frequency='MONTHLY',
+            due_date=date.today(),
+            user=other
+        )
+        other.delete()
+        self.assertEqual(Tombstone.objects.count(), 1)
+    
+    def test_payment_queryset_delete_leaves_tombstones(self):
+        """Test that deleting payments in bulk, as the admin does, records every one"""
+        second = ExpensePayment.objects.create(
+            recurring_expense=self.expense,
+            payment_date=date.today() - timedelta(days=30),
+            amount_paid=Decimal('75.00')
+        )
+        ExpensePayment.objects.filter(recurring_expense=self.expense).delete()
+        self.assertEqual(
+            set(Tombstone.objects.values_list('kind', 'sync_id')),
+            {('PAYMENT', self.payment.sync_id), ('PAYMENT', second.sync_id)}
+        )
+    
+    def test_deleting_an_expense_does_not_load_its_payments(self):
+        """Test that an expense's payments are removed with one query however many there are"""
+        def delete_queries(payments):
+            expense = RecurringExpense.objects.create(
+                name=f'Expense with {payments} payments',
+                amount=Decimal('10.00'),
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+            for i in range(payments):
+                ExpensePayment.objects.create(
+                    recurring_expense=expense,
+                    payment_date=date.today() - timedelta(days=i),
+                    amount_paid=Decimal('10.00')
+                )
+            with CaptureQueriesContext(connection) as queries:
+                expense.delete()
+            return [query['sql'] for query in queries]
+        
+        few, many = delete_queries(1), delete_queries(30)
+        self.assertEqual(len(few), len(many))
+        self.assertFalse([sql for sql in many if sql.startswith('SELECT') and 'expenses_expensepayment' in sql])
+    
+    def test_invalid_parameters(self):
+        """Test that tokens from other users and bad timestamps are rejected"""
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        for params in [
+            {'token': 'garbage'},
+            {'token': make_sync_token(other, timezone.now())},
+            {'since': 'yesterday'},
+        ]:
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(len(self.sync(since='2000-01-01T00:00:00')['expenses']), 1)
+    
+    def test_full_backup_and_deltas_restore_the_account(self):
+        """Test that a full export followed by deltas reproduces the data"""
+        def snapshot(user):
+            return sorted(
+                (e.sync_id, e.name, e.amount, e.category.name if e.category else None, e.is_active,
+                 sorted((p.sync_id, p.payment_date, p.amount_paid) for p in e.expensepayment_set.all()))
+                for e in RecurringExpense.objects.filter(user=user)
+            )
+        
+        backup = json.loads(self.client.get(reverse('expenses:export_data')).content)
+        restored = User.objects.create_user(username='restored', password='testpassword')
+        BackupImporter(restored).import_data(backup)
+        self.assertEqual(snapshot(restored), snapshot(self.user))
+        
+        # A day of changes: an edit, a new expense with a payment and two deletions
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + 2 * SYNC_OVERLAP):
+            self.expense.amount = Decimal('90.00')
+            self.expense.save()
+            rent = RecurringExpense.objects.create(
+                name='Rent',
+                amount=Decimal('1000.00'),
+                category=Category.objects.create(name='Housing'),
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+            ExpensePayment.objects.create(
+                recurring_expense=rent,
+                payment_date=date.today(),
+                amount_paid=Decimal('1000.00')
+            )
+            self.payment.delete()
+        delta = self.sync(token=backup['sync_token'])
+        
+        restore_client = Client()
+        restore_client.login(username='restored', password='testpassword')
+        response = restore_client.post(self.url, json.dumps(delta), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'expenses_created': 1, 'expenses_updated': 1, 'expenses_deleted': 0,
+            'payments_created': 1, 'payments_updated': 0, 'payments_deleted': 1,
+        })
+        self.assertEqual(snapshot(restored), snapshot(self.user))
+        
+        # Applying the same delta again changes nothing
+        apply_delta(restored, delta)
+        self.assertEqual(snapshot(restored), snapshot(self.user))
+        
+        self.expense.delete()
+        delta = self.sync(token=delta['sync_token'])
+        apply_delta(restored, delta)
+        self.assertEqual(snapshot(restored), snapshot(self.user))
+        self.assertEqual(CategoryTotal.objects.get(user=restored, category__name='Housing').total, Decimal('1000.00'))
+    
+    def test_invalid_delta_changes_nothing(self):
+        """Test that a delta with a payment for an unknown expense is rejected as a whole"""
+        delta = self.sync()
+        delta['payments'][0]['expense_sync_id'] = '00000000-0000-0000-0000-000000000000'
+        delta['expenses'][0]['name'] = 'Renamed'
+        response = self.client.post(self.url, json.dumps(delta), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('unknown expense', response.json()['error'])
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.name, 'Electricity')
+
+
+class CategoryRegistryTest(TransactionTestCase):
+    # Outside a test transaction, so the registry keeps what it loads
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(username='admin', password='adminpassword')
+        self.utilities = Category.objects.create(name='Utilities', description='Monthly utility bills')
+        self.housing = Category.objects.create(name='Housing')
+        for name, category in [('Electricity', self.utilities), ('Rent', self.housing)]:
+            expense = RecurringExpense.objects.create(
+                name=name,
+                amount=Decimal('75.00'),
+                category=category,
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+            ExpensePayment.objects.create(
+                recurring_expense=expense,
+                payment_date=date.today(),
+                amount_paid=Decimal('75.00')
+            )
+        self.client.force_login(self.user)
+    
+    def tearDown(self):
+        # Versions restart from the clock, so no other test sees these categories
+        cache.clear()
+    
+    def category_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries if 'FROM "expenses_category"' in query['sql']]
+    
+    def test_views_need_no_category_queries_once_loaded(self):
+        """Test that pages resolve categories from the registry in the steady state"""
+        urls = [
+            reverse('expenses:home'),
+            reverse('expenses:export_data'),
+            reverse('expenses:export_data') + '?format=csv',
+            reverse('expenses:expense_chart_data'),
+            reverse('expenses:sync_data'),
+            reverse('admin:expenses_recurringexpense_changelist'),
+            reverse('admin:expenses_expensepayment_changelist'),
+        ]
+        for url in urls:
+            self.client.get(url)
+        # New expense data, but the same categories
+        bump_user_version(self.user.pk)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.category_queries(lambda: self.client.get(url)), [])
+        
+        chart = self.client.get(reverse('expenses:expense_chart_data')).json()
+        self.assertEqual(chart['labels'], ['Utilities', 'Housing'])
+        backup = self.client.get(reverse('expenses:export_data')).json()
+        self.assertEqual(
+            [(category['name'], category['description']) for category in backup['categories']],
+            [('Utilities', 'Monthly utility bills'), ('Housing', '')]
+        )
+        response = self.client.get(reverse('admin:expenses_expensepayment_changelist'))
+        self.assertContains(response, f'?recurring_expense__category__id__exact={self.housing.pk}')
+    
+    def test_version_is_checked_once_per_export(self):
+        """Test that an export resolves every expense against a single snapshot"""
+        for i in range(10):
+            RecurringExpense.objects.create(
+                name=f'Expense {i}',
+                amount=Decimal('10.00'),
+                category=self.utilities,
+                frequency='MONTHLY',
+                due_date=date.today(),
+                user=self.user
+            )
+        with mock.patch('expenses.categories.get_categories_version', wraps=get_categories_version) as version:
+            backup = json.loads(''.join(iter_export_json(self.user)))
+        self.assertEqual(len(backup['expenses']), 12)
+        self.assertEqual(version.call_count, 1)
+    
+    def test_import_needs_no_category_queries_once_loaded(self):
+        """Test that importing into existing categories does not look them up"""
+        data = {
+            'categories': [{'id': 99, 'name': 'Utilities', 'description': ''}],
+            'expenses': [{
+                'name': 'Water', 'amount': '20.00', 'category_id': 99, 'category_name': 'Utilities',
+                'frequency': 'MONTHLY', 'due_date': date.today().isoformat(), 'description': '',
+                'is_active': True, 'payments': []
+            }, {
+                'name': 'Internet', 'amount': '40.00', 'category_id': None, 'category_name': 'Housing',
+                'frequency': 'MONTHLY', 'due_date': date.today().isoformat(), 'description': '',
+                'is_active': True, 'payments': []
+            }]
+        }
+        category_registry.snapshot().all()
+        self.assertEqual(self.category_queries(lambda: BackupImporter(self.user).import_data(data)), [])
+        self.assertEqual(RecurringExpense.objects.get(name='Water').category, self.utilities)
+        self.assertEqual(RecurringExpense.objects.get(name='Internet').category, self.housing)
+        
+        # Categories created by bulk_create() still reach the registry
+        data['categories'][0]['name'] = 'Insurance'
+        data['expenses'] = []
+        BackupImporter(self.user).import_data(data)
+        self.assertEqual(category_registry.snapshot().by_name('Insurance'), Category.objects.get(name='Insurance'))
+    
+    def test_category_signals_invalidate_the_registry(self):
+        """Test that saving or deleting a category reloads the registry"""
+        self.assertEqual(category_registry.snapshot().by_name('Utilities'), self.utilities)
+        self.assertEqual(self.category_queries(lambda: category_registry.snapshot().by_name('Utilities')), [])
+        
+        self.utilities.name = 'Bills'
+        self.utilities.save()
+        self.assertIsNone(category_registry.snapshot().by_name('Utilities'))
+        self.assertEqual(category_registry.snapshot().name(self.utilities.pk), 'Bills')
+        
+        self.housing.delete()
+        self.assertIsNone(category_registry.snapshot().get(self.housing.pk))
+        self.assertEqual(category_registry.snapshot().all(), [self.utilities])
+    
+    def test_version_change_from_another_worker(self):
+        """Test that the registry is only reloaded when the shared version moves"""
+        self.assertEqual(category_registry.snapshot().name(self.housing.pk), 'Housing')
+        # A change this process sent no signal for, such as one made by another worker
+        Category.objects.filter(pk=self.housing.pk).update(name='Rent')
+        self.assertEqual(category_registry.snapshot().name(self.housing.pk), 'Housing')
+        
+        bump_categories_version()
+        self.assertEqual(category_registry.snapshot().name(self.housing.pk), 'Rent')
+    
+    def test_rolled_back_categories_are_not_kept(self):
+        """Test that categories from a transaction that rolls back are forgotten"""
+        category_registry.snapshot().all()
+        try:
+            with transaction.atomic():
+                Category.objects.create(name='Phantom')
+                self.assertIsNotNone(category_registry.snapshot().by_name('Phantom'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertIsNone(category_registry.snapshot().by_name('Phantom'))
+        with transaction.atomic():
+            self.assertIsNone(category_registry.snapshot().by_name('Phantom'))
@@ -0,0 +1,92 @@
+"""Maintenance of the per-user CategoryTotal summary rows"""
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, Sum
+
+from .cache import bump_categories_version, bump_user_version
+from .models import CategoryTotal, RecurringExpense
+
+
+def apply_category_delta(user_id, category_id, amount, count, using=None):
+    """Add amount and count to a user's total for one category (None for uncategorized)"""
+    if not amount and not count:
+        return
+    with transaction.atomic(using=using):
+        rows = CategoryTotal.objects.using(using).filter(user_id=user_id, category_id=category_id)
+        updated = rows.update(total=F('total') + amount, expense_count=F('expense_count') + count)
+        if updated or count <= 0:
+            # Never create a row just to take something away from it
+            return
+        try:
+            with transaction.atomic(using=using):
+                CategoryTotal.objects.using(using).create(
+                    user_id=user_id,
+                    category_id=category_id,
+                    total=amount,
+                    expense_count=count
+                )
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(total=F('total') + amount, expense_count=F('expense_count') + count)
+
+
+def add_category_totals(user_id, deltas, using=None):
+    """Add {category_id: (amount, count)} to a user's totals in one statement
+
+    Categorized and uncategorized totals are unique on different partial
+    indexes, so the upsert has an ON CONFLICT clause for each (SQLite 3.35+).
+    Counts must be positive, as missing rows are created.
+    """
+    if not deltas:
+        return
+    connection = connections[using or router.db_for_write(CategoryTotal)]
+    opts = CategoryTotal._meta
+    quote = connection.ops.quote_name
+    table = quote(opts.db_table)
+    user, category, total, count = (
+        quote(opts.get_field(name).column) for name in ['user', 'category', 'total', 'expense_count']
+    )
+    total_field = opts.get_field('total')
+    params = []
+    for category_id, (amount, expense_count) in deltas.items():
+        params += [user_id, category_id, total_field.get_db_prep_save(amount, connection), expense_count]
+    update = f'DO UPDATE SET {total} = {total} + excluded.{total}, {count} = {count} + excluded.{count}'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user}, {category}, {total}, {count}) '
+            f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(deltas))} '
+            f'ON CONFLICT ({user}, {category}) WHERE {category} IS NOT NULL {update} '
+            f'ON CONFLICT ({user}) WHERE {category} IS NULL {update}',
+            params
+        )
+
+
+def rebuild_category_totals(users=None):
+    """Recompute the totals from the expenses, for the given users or everyone"""
+    expenses = RecurringExpense.objects.filter(is_active=True)
+    totals = CategoryTotal.objects.all()
+    if users is not None:
+        expenses = expenses.filter(user__in=users)
+        totals = totals.filter(user__in=users)
+
+    rows = expenses.values('user', 'category').annotate(
+        total=Sum('amount'),
+        expense_count=Count('id')
+    ).order_by()
+    with transaction.atomic():
+        totals.delete()
+        if users is None:
+            bump_categories_version()
+        else:
+            for user in users:
+                bump_user_version(user.pk)
+        return len(CategoryTotal.objects.bulk_create([
+            CategoryTotal(
+                user_id=row['user'],
+                category_id=row['category'],
+                total=row['total'] or Decimal('0.00'),
+                expense_count=row['expense_count']
+            )
+            for row in rows
+        ]))
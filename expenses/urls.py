@@ -1,13 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'expenses'
 
+# recurringtracker/asgi.py turns on the async dashboard views under ASGI
+if settings.EXPENSES_ASYNC_VIEWS:
+    home, expense_chart_data = views.async_home, views.async_expense_chart_data
+else:
+    home, expense_chart_data = views.home, views.expense_chart_data
+
 urlpatterns = [
-    path('', views.home, name='home'),
+    path('', home, name='home'),
     path('export/', views.export_data, name='export_data'),
     path('import/', views.import_data, name='import_data'),
-    path('chart/expense-data/', views.expense_chart_data, name='expense_chart_data'),
+    path('sync/', views.sync_data, name='sync_data'),
+    path('import/<int:job_id>/status/', views.import_status, name='import_status'),
+    path('chart/expense-data/', expense_chart_data, name='expense_chart_data'),
+    path('chart/expense-trend/', views.expense_trend_data, name='expense_trend_data'),
+    path('forecast/', views.expense_forecast, name='expense_forecast'),
+    path('api/expenses/', views.expense_list_api, name='expense_list_api'),
+    path('api/payments/', views.payment_list_api, name='payment_list_api'),
+    path('cache-stats/', views.cache_stats_view, name='cache_stats'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('logout/', views.logout_view, name='logout'),
 ] 
\ No newline at end of file
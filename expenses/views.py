@@ -1,103 +1,157 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Prefetch, Sum
+from .functions import TruncMonth
 from django.utils import timezone
 from datetime import timedelta, date
 from dateutil.relativedelta import relativedelta
-from .models import RecurringExpense, Category, ExpensePayment
+from .models import RecurringExpense, CategoryTotal, ExpensePayment, ImportJob
+from .jobs import describe_import_error, enqueue_import, is_stale, job_status, recover_stale_jobs
+from .importers import CSV_FIELDS, apply_delta
+from .conditional import conditional_on_user_data
+from .categories import category_registry
+from .cache import acached_for_user, adata_version, cache_stats, cached_for_user, data_version
+from .forecast import forecast
+from .pagination import keyset_page
+from .metrics import render_metrics
+from .routers import replica_view
+from .sync import changed_since, make_sync_token, parse_since, read_sync_token
+import asyncio
+import csv
 import json
-from django.http import HttpResponse, JsonResponse
-from django.core.serializers.json import DjangoJSONEncoder
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
-import datetime
 import io
-from django.core.exceptions import ValidationError
+import textwrap
+import zlib
 from django.db import transaction
 from django.contrib.auth import logout
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils.functional import SimpleLazyObject
 
 # Create your views here.
 
-@login_required
-def home(request):
-    # Get all active expenses for the current user
-    expenses = RecurringExpense.objects.filter(
-        user=request.user,
-        is_active=True
-    ).order_by('due_date')
+def _home_querysets(user):
+    """The independent queries behind the home page, by context name"""
+    today = timezone.now().date()
+    thirty_days_ago = today - timedelta(days=30)
+    return {
+        # All active expenses for the user
+        'expenses': RecurringExpense.objects.for_user(user).active().list_rows().order_by('due_date'),
+        # Category totals are maintained incrementally, one row per category
+        'totals': CategoryTotal.objects.filter(
+            user=user,
+            expense_count__gt=0
+        ).order_by('category'),
+        # Recent expense payments (last 30 days) along with their expenses,
+        # found through payment_user_date_id_idx on the payments' own user
+        'recent_payments': ExpensePayment.objects.filter(
+            user=user,
+            payment_date__gte=thirty_days_ago
+        ).select_related('recurring_expense').order_by('-payment_date')[:5],  # Limit to 5 items
+        # Upcoming payments (due in the next 30 days), with whether each has
+        # been paid worked out by the database
+        'upcoming': RecurringExpense.objects.for_user(user).active().filter(
+            due_date__lte=today + timedelta(days=30)
+        ).with_payment_status(since=thirty_days_ago).order_by('due_date').rows('is_satisfied')[:5],  # Limit to 5 items
+    }
+
+def _home_context(expenses, totals, recent_payments, upcoming):
+    """Build the home page context from the results of _home_querysets()
     
-    # Calculate total by category
-    total_by_category = []
-    categories = Category.objects.all()
-    for category in categories:
-        total = RecurringExpense.objects.filter(
-            user=request.user,
-            category=category,
-            is_active=True
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        if total > 0:
-            total_by_category.append((category.name, total))
-    
-    # Add uncategorized total
-    uncategorized_total = RecurringExpense.objects.filter(
-        user=request.user,
-        category__isnull=True,
-        is_active=True
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    if uncategorized_total > 0:
-        total_by_category.append(('Uncategorized', uncategorized_total))
-    
-    # Get recent expense payments (last 30 days)
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    recent_payments = ExpensePayment.objects.filter(
-        recurring_expense__user=request.user,
-        payment_date__gte=thirty_days_ago
-    ).order_by('-payment_date')
-    
-    # Track which expenses have been paid
-    satisfied_expenses = {}
-    for payment in recent_payments:
-        expense_id = payment.recurring_expense.id
-        due_date = payment.recurring_expense.due_date
+    Nothing is evaluated up front: the querysets and derived lists are only
+    read when the template renders a section that is not already cached.
+    """
+    def category_totals():
+        snapshot = category_registry.snapshot()
+        total_by_category = []
+        uncategorized_total = 0
+        for row in totals:
+            if row.category_id is None:
+                uncategorized_total = row.total
+            elif row.total > 0:
+                total_by_category.append((snapshot.name(row.category_id), row.total))
         
-        # If payment was made after due date and amount is sufficient
-        if payment.payment_date >= due_date and payment.amount_paid >= payment.recurring_expense.amount:
-            satisfied_expenses[expense_id] = {
-                'payment': payment,
-                'next_recurrence': calculate_next_recurrence(payment.recurring_expense)
-            }
+        # Add uncategorized total
+        if uncategorized_total > 0:
+            total_by_category.append(('Uncategorized', uncategorized_total))
+        return total_by_category
     
-    # Get upcoming payments (due in the next 30 days)
-    thirty_days = timezone.now().date() + timedelta(days=30)
-    upcoming_payments = RecurringExpense.objects.filter(
-        user=request.user,
-        is_active=True,
-        due_date__lte=thirty_days
-    ).order_by('due_date')
-    
-    # Prepare upcoming payments with satisfaction status
-    upcoming_with_status = []
-    for expense in upcoming_payments:
-        is_satisfied = expense.id in satisfied_expenses
-        next_recurrence = None
-        
-        if is_satisfied:
-            next_recurrence = satisfied_expenses[expense.id]['next_recurrence']
-        
-        upcoming_with_status.append({
-            'expense': expense,
-            'is_satisfied': is_satisfied,
-            'next_recurrence': next_recurrence
-        })
+    def upcoming_with_status():
+        # Prepare upcoming payments with satisfaction status
+        return [
+            {
+                'expense': expense,
+                'is_satisfied': expense.is_satisfied,
+                'next_recurrence': calculate_next_recurrence(expense) if expense.is_satisfied else None
+            }
+            for expense in upcoming
+        ]
     
-    context = {
+    return {
         'expenses': expenses,
-        'total_by_category': total_by_category,
-        'upcoming_payments': upcoming_with_status[:5],  # Limit to 5 items
-        'recent_payments': recent_payments[:5],  # Limit to 5 items
+        'total_by_category': SimpleLazyObject(category_totals),
+        'upcoming_payments': SimpleLazyObject(upcoming_with_status),
+        'recent_payments': recent_payments,
     }
-    
+
+# Cached sections of home.html and whether each also changes with the date
+HOME_FRAGMENTS = {
+    'home_expenses': False,
+    'home_categories': False,
+    'home_upcoming': True,
+    'home_recent_payments': True,
+}
+
+def _home_fragment_context(user_id, version):
+    """The values home.html varies its cached sections on"""
+    return {
+        'fragment_key': f'{user_id}:{version}',
+        'fragment_day': timezone.now().date().isoformat(),
+    }
+
+def _home_fragment_keys(fragment_context):
+    keys = []
+    for name, daily in HOME_FRAGMENTS.items():
+        vary_on = [fragment_context['fragment_key']]
+        if daily:
+            vary_on.append(fragment_context['fragment_day'])
+        keys.append(make_template_fragment_key(name, vary_on))
+    return keys
+
+@login_required
+def home(request):
+    context = _home_context(**_home_querysets(request.user))
+    context.update(_home_fragment_context(request.user.pk, data_version(request.user.pk)))
     return render(request, 'expenses/home.html', context)
 
+async def _alist(queryset):
+    return [item async for item in queryset]
+
+@login_required
+async def async_home(request):
+    """home() for ASGI, running its independent queries concurrently"""
+    user = await request.auser()
+    # The auth context processor reads request.user, which is cached separately
+    request.user = user
+    fragment_context = _home_fragment_context(user.pk, await adata_version(user.pk))
+    queries = _home_querysets(user)
+    
+    # Only query when a section has to be rendered again
+    keys = _home_fragment_keys(fragment_context)
+    if len(await cache.aget_many(keys)) < len(keys):
+        results = await asyncio.gather(*(_alist(queryset) for queryset in queries.values()))
+        queries = dict(zip(queries, results))
+    context = _home_context(**queries)
+    context.update(fragment_context)
+    
+    # Rendering may still touch the session, so it runs in a worker thread
+    return await sync_to_async(render)(request, 'expenses/home.html', context)
+
 def calculate_next_recurrence(expense):
     """Calculate the next recurrence date based on frequency"""
     current_due = expense.due_date
@@ -122,171 +176,306 @@ def calculate_next_recurrence(expense):
     # Default fallback
     return current_due
 
-@login_required
-def export_data(request):
-    """Export user data as JSON for backup purposes"""
-    # Get user's categories
-    categories = []
-    for category in Category.objects.all():
-        # Check if the category is used by any of the user's expenses
-        if RecurringExpense.objects.filter(user=request.user, category=category).exists():
-            categories.append({
-                'id': category.id,
-                'name': category.name,
-                'description': category.description
-            })
-    
-    # Get user's recurring expenses
-    expenses = []
-    for expense in RecurringExpense.objects.filter(user=request.user):
-        expense_data = {
-            'name': expense.name,
-            'amount': str(expense.amount),  # Convert Decimal to string for JSON serialization
-            'category_id': expense.category.id if expense.category else None,
-            'category_name': expense.category.name if expense.category else None,
-            'frequency': expense.frequency,
-            'due_date': expense.due_date.isoformat(),
-            'description': expense.description,
-            'is_active': expense.is_active,
-            'payments': []
-        }
-        
-        # Get payments for this expense
-        for payment in ExpensePayment.objects.filter(recurring_expense=expense):
-            expense_data['payments'].append({
-                'payment_date': payment.payment_date.isoformat(),
-                'amount_paid': str(payment.amount_paid),
-                'notes': payment.notes
-            })
-        
-        expenses.append(expense_data)
+def _serialize_payment(payment):
+    return {
+        'payment_date': payment.payment_date.isoformat(),
+        'amount_paid': str(payment.amount_paid),
+        'notes': payment.notes,
+        'sync_id': str(payment.sync_id)
+    }
+
+def _serialize_expense(expense, snapshot, with_payments=True):
+    """Convert an expense and its prefetched payments to the backup schema
     
-    # Create the complete data structure
+    ``snapshot`` is the CategorySnapshot that names the expense's category.
+    """
+    category = snapshot.get(expense.category_id)
     data = {
-        'export_date': timezone.now().isoformat(),
-        'username': request.user.username,
-        'categories': categories,
-        'expenses': expenses
+        'name': expense.name,
+        'amount': str(expense.amount),  # Convert Decimal to string for JSON serialization
+        'category_id': category.id if category else None,
+        'category_name': category.name if category else None,
+        'frequency': expense.frequency,
+        'due_date': expense.due_date.isoformat(),
+        'description': expense.description,
+        'is_active': expense.is_active,
+        'sync_id': str(expense.sync_id)
     }
+    if with_payments:
+        data['payments'] = [_serialize_payment(payment) for payment in expense.expensepayment_set.all()]
+    return data
+
+def _export_querysets(user, snapshot, using=None):
+    """The categories (as backup dicts) and expenses that make up a user's backup"""
+    # Categories used by any of the user's expenses, which only needs the
+    # expenses table; the rest comes from the category registry
+    category_ids = RecurringExpense.objects.using(using).for_user(user).filter(
+        category__isnull=False
+    ).values_list('category_id', flat=True).distinct().order_by('category_id')
+    categories = [
+        {
+            'id': category.id,
+            'name': category.name,
+            'description': category.description
+        }
+        for category in map(snapshot.get, category_ids) if category is not None
+    ]
+    
+    expenses = RecurringExpense.objects.using(using).for_user(user).prefetch_related(
+        Prefetch('expensepayment_set', queryset=ExpensePayment.objects.order_by('id'))
+    ).order_by('id')
+    return categories, expenses
+
+def iter_export_json(user, chunk_size=500, using=None):
+    """Yield the JSON backup for a user piece by piece
+    
+    The output is byte-for-byte what json.dumps(data, indent=4) produces for
+    the whole backup, but only one chunk of expenses (with their payments
+    fetched by a single prefetch query) is held in memory at a time. The
+    queries run as the output is consumed, so ``using`` fixes the database
+    they read from up front.
+    """
+    now = timezone.now()
+    snapshot = category_registry.snapshot()
+    categories, expenses = _export_querysets(user, snapshot, using)
+    
+    # Render the envelope with an empty expense list and splice the expenses into it
+    head = json.dumps({
+        'export_date': now.isoformat(),
+        'username': user.username,
+        'sync_token': make_sync_token(user, now),
+        'categories': categories,
+        'expenses': []
+    }, indent=4)
+    head = head[:-len('[]\n}')]
+    
+    first = True
+    for expense in expenses.iterator(chunk_size=chunk_size):
+        yield head + '[\n' if first else ',\n'
+        yield textwrap.indent(json.dumps(_serialize_expense(expense, snapshot), indent=4), ' ' * 8)
+        first = False
+    
+    if first:
+        # The user has no expenses at all
+        yield head + '[]\n}'
+    else:
+        yield '\n    ]\n}'
+
+def _ndjson_line(record_type, record):
+    return json.dumps({'type': record_type, **record}, separators=(',', ':')) + '\n'
+
+def iter_export_ndjson(user, chunk_size=500, using=None):
+    """Yield the backup as compact newline-delimited JSON, one record per line
+    
+    A header line is followed by a line per category and then a line per
+    expense with its payments, as read back by NDJSONBackupReader.
+    """
+    now = timezone.now()
+    snapshot = category_registry.snapshot()
+    categories, expenses = _export_querysets(user, snapshot, using)
+    yield _ndjson_line('header', {
+        'export_date': now.isoformat(),
+        'username': user.username,
+        'sync_token': make_sync_token(user, now)
+    })
+    for category in categories:
+        yield _ndjson_line('category', category)
+    for expense in expenses.iterator(chunk_size=chunk_size):
+        yield _ndjson_line('expense', _serialize_expense(expense, snapshot))
+
+def iter_export_csv(user, chunk_size=500, using=None):
+    """Yield the backup as CSV rows, each expense followed by its payments"""
+    snapshot = category_registry.snapshot()
+    categories, expenses = _export_querysets(user, snapshot, using)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, restval='', lineterminator='\n')
+    
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+    
+    writer.writeheader()
+    for category in categories:
+        writer.writerow({
+            'type': 'category',
+            'category_id': category['id'],
+            'category_name': category['name'],
+            'description': category['description']
+        })
+    yield flush()
+    
+    for expense in expenses.iterator(chunk_size=chunk_size):
+        data = _serialize_expense(expense, snapshot)
+        payments = data.pop('payments')
+        data['is_active'] = 'true' if data['is_active'] else 'false'
+        writer.writerow({'type': 'expense', **data})
+        for payment in payments:
+            writer.writerow({'type': 'payment', **payment})
+        yield flush()
+
+def _gzip_chunks(chunks):
+    """Compress text chunks into a gzip stream as they are produced"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# format: (content type, file extension)
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+@login_required
+@conditional_on_user_data
+def export_data(request):
+    """Export user data as JSON, NDJSON or CSV for backup purposes
+    
+    ``format`` picks the format (JSON by default) and ``gzip`` compresses
+    the file, which import_data detects by itself. Backups carry a sync
+    token stamped with the primary's time, so they are read from the
+    primary: rows a lagging replica had not seen yet would be older than
+    the token and never sent by a later delta.
+    """
+    export_format = request.GET.get('format', 'json')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"Unknown format '{export_format}'"}, status=400)
+    content_type, extension = EXPORT_FORMATS[export_format]
+    iter_export = {'json': iter_export_json, 'ndjson': iter_export_ndjson, 'csv': iter_export_csv}[export_format]
     
-    # Create the response with the JSON data
-    response = HttpResponse(json.dumps(data, indent=4), content_type='application/json')
-    response['Content-Disposition'] = f'attachment; filename="expenses_backup_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json"'
+    filename = f'expenses_backup_{timezone.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    chunks = iter_export(request.user)
+    if request.GET.get('gzip'):
+        chunks = _gzip_chunks(chunks)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    
+    # Stream the backup when asked to, so large histories never sit in memory
+    if request.GET.get('stream'):
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    else:
+        response = HttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     
     return response
 
+def _delta_payload(user, since, using=None):
+    """The changes to a user's data since ``since``, in the delta schema
+    
+    Payments are listed apart from their expenses, since either can change
+    without the other, and deletions are listed by sync_id.
+    """
+    now = timezone.now()
+    snapshot = category_registry.snapshot()
+    expenses, payments, tombstones = changed_since(user, since, snapshot, using)
+    expenses = [_serialize_expense(expense, snapshot, with_payments=False) for expense in expenses]
+    
+    categories = {}
+    for expense in expenses:
+        if expense['category_id'] is not None:
+            categories[expense['category_id']] = {'id': expense['category_id'], 'name': expense['category_name']}
+    
+    deleted = {'expenses': [], 'payments': []}
+    for kind, sync_id in tombstones.values_list('kind', 'sync_id'):
+        deleted['expenses' if kind == 'EXPENSE' else 'payments'].append(str(sync_id))
+    
+    return {
+        'export_date': now.isoformat(),
+        'username': user.username,
+        'since': since.isoformat() if since else None,
+        'sync_token': make_sync_token(user, now),
+        'categories': list(categories.values()),
+        'expenses': expenses,
+        'payments': [
+            {**_serialize_payment(payment), 'expense_sync_id': str(payment.expense_sync_id)}
+            for payment in payments
+        ],
+        'deleted': deleted
+    }
+
 @login_required
-def import_data(request):
-    """Import user data from a JSON file"""
-    if request.method == 'POST' and request.FILES.get('import_file'):
+def sync_data(request):
+    """GET the changes since ``token`` (or ``since``), or POST such a delta to apply it
+    
+    Without either parameter the delta holds all of the user's data, which
+    is how a client starts syncing.
+    """
+    if request.method == 'POST':
         try:
-            import_file = request.FILES['import_file']
-            
-            # Read and parse the JSON data
-            file_content = import_file.read().decode('utf-8')
-            data = json.loads(file_content)
-            
-            # Validate the data structure
-            if not all(key in data for key in ['categories', 'expenses']):
-                messages.error(request, "Invalid backup file format. Missing required data.")
-                return redirect('expenses:home')
-            
-            # Use a transaction to ensure all-or-nothing import
             with transaction.atomic():
-                # Process categories
-                category_mapping = {}  # Maps original category IDs to new ones
-                
-                for category_data in data['categories']:
-                    # Check if category already exists by name
-                    category, created = Category.objects.get_or_create(
-                        name=category_data['name'],
-                        defaults={'description': category_data.get('description', '')}
-                    )
-                    
-                    # Store the mapping from original ID to the actual category object
-                    category_mapping[category_data['id']] = category
-                
-                # Process expenses
-                for expense_data in data['expenses']:
-                    # Get or create the category if it exists in the mapping
-                    category = None
-                    if expense_data.get('category_id') and expense_data['category_id'] in category_mapping:
-                        category = category_mapping[expense_data['category_id']]
-                    elif expense_data.get('category_name'):
-                        # Try to find by name if ID mapping failed
-                        try:
-                            category = Category.objects.get(name=expense_data['category_name'])
-                        except Category.DoesNotExist:
-                            # Create a new category if it doesn't exist
-                            category = Category.objects.create(
-                                name=expense_data['category_name'],
-                                description=''
-                            )
-                    
-                    # Check if a similar expense already exists
-                    existing_expense = RecurringExpense.objects.filter(
-                        user=request.user,
-                        name=expense_data['name'],
-                        amount=expense_data['amount']
-                    ).first()
-                    
-                    if existing_expense:
-                        # Skip this expense as it already exists
-                        continue
-                    
-                    # Create the expense
-                    expense = RecurringExpense.objects.create(
-                        user=request.user,
-                        name=expense_data['name'],
-                        amount=expense_data['amount'],
-                        category=category,
-                        frequency=expense_data['frequency'],
-                        due_date=datetime.date.fromisoformat(expense_data['due_date']),
-                        description=expense_data.get('description', ''),
-                        is_active=expense_data.get('is_active', True)
-                    )
-                    
-                    # Process payments for this expense
-                    for payment_data in expense_data.get('payments', []):
-                        ExpensePayment.objects.create(
-                            recurring_expense=expense,
-                            payment_date=datetime.date.fromisoformat(payment_data['payment_date']),
-                            amount_paid=payment_data['amount_paid'],
-                            notes=payment_data.get('notes', '')
-                        )
-            
-            messages.success(request, "Data imported successfully!")
-        except json.JSONDecodeError:
-            messages.error(request, "Invalid JSON file. Please upload a valid backup file.")
-        except ValidationError as e:
-            messages.error(request, f"Validation error: {str(e)}")
+                counts = apply_delta(request.user, json.loads(request.body))
         except Exception as e:
-            messages.error(request, f"Error importing data: {str(e)}")
+            return JsonResponse({'error': describe_import_error(e)}, status=400)
+        return JsonResponse(counts)
+    
+    try:
+        if 'token' in request.GET:
+            since = read_sync_token(request.user, request.GET['token'])
+        elif 'since' in request.GET:
+            since = parse_since(request.GET['since'])
+        else:
+            since = None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # From the primary, like export_data(), as the delta carries the next token
+    return JsonResponse(_delta_payload(request.user, since))
+
+@login_required
+def import_data(request):
+    """Queue an uploaded JSON backup for import"""
+    if request.method == 'POST' and request.FILES.get('import_file'):
+        # Only store the upload here; the import itself runs in the background
+        job = enqueue_import(request.user, request.FILES['import_file'])
+        status_url = reverse('expenses:import_status', args=[job.pk])
+        
+        if 'application/json' in request.headers.get('Accept', ''):
+            return JsonResponse({
+                'job_id': job.pk,
+                'status': job.status,
+                'status_url': status_url,
+            }, status=202)
         
+        messages.info(request, f"Import #{job.pk} has been queued and will be processed shortly.")
         return redirect('expenses:home')
     
     # If GET request or no file uploaded, show the import form
     return render(request, 'expenses/import.html')
 
-def expense_chart_data(request):
-    # Query your expense data, grouped by category
-    categories = Category.objects.filter(
-        recurringexpense__user=request.user
-    ).distinct()
-    
+@login_required
+def import_status(request, job_id):
+    """Report the progress of an import job as JSON"""
+    job = get_object_or_404(ImportJob, pk=job_id, user=request.user)
+    if is_stale(job):
+        # Its worker is gone, and polling would otherwise go on forever
+        recover_stale_jobs()
+        job.refresh_from_db()
+    return JsonResponse(job_status(job))
+
+def _chart_totals(user):
+    """The maintained per-category totals shown on the chart"""
+    return CategoryTotal.objects.filter(
+        user=user,
+        category__isnull=False,
+        expense_count__gt=0
+    ).order_by('category')
+
+def _chart_payload(totals):
+    """Build the category chart data from _chart_totals() rows"""
     # Prepare data for chart
-    labels = [category.name for category in categories]
+    snapshot = category_registry.snapshot()
+    labels = []
     data = []
+    for row in totals:
+        labels.append(snapshot.name(row.category_id))
+        data.append(float(row.total))
     
-    for category in categories:
-        total = RecurringExpense.objects.filter(
-            user=request.user, 
-            category=category
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-        data.append(float(total))
-    
-    # Return JSON response
-    return JsonResponse({
+    return {
         'labels': labels,
         'datasets': [{
             'label': 'Expenses by Category',
@@ -296,8 +485,231 @@ def expense_chart_data(request):
                 # Add more colors as needed
             ]
         }]
+    }
+
+@conditional_on_user_data
+def expense_chart_data(request):
+    # Reuse the chart until the user's expenses or categories change
+    payload = cached_for_user(request.user.pk, 'chart', lambda: _chart_payload(_chart_totals(request.user)))
+    
+    # Return JSON response
+    return JsonResponse(payload)
+
+@conditional_on_user_data
+async def async_expense_chart_data(request):
+    """expense_chart_data() for ASGI, using the async cache and ORM"""
+    user = await request.auser()
+    
+    async def compute():
+        # Naming the categories may have to load the registry
+        return await sync_to_async(_chart_payload)(await _alist(_chart_totals(user)))
+    
+    return JsonResponse(await acached_for_user(user.pk, 'chart', compute))
+
+def _parse_month(value):
+    """Parse a YYYY-MM string into the first day of that month"""
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise ValueError(f"Invalid month '{value}', expected YYYY-MM")
+
+@login_required
+@replica_view
+def expense_trend_data(request):
+    """Monthly paid totals for the trend chart, optionally split by category"""
+    # Work out the range of months to report, end month included
+    try:
+        this_month = timezone.now().date().replace(day=1)
+        end = _parse_month(request.GET['end']) if 'end' in request.GET else this_month
+        if 'start' in request.GET:
+            start = _parse_month(request.GET['start'])
+        else:
+            months = int(request.GET.get('months', 12))
+            if not 1 <= months <= 120:
+                raise ValueError("months must be between 1 and 120")
+            start = end - relativedelta(months=months - 1)
+        if start > end:
+            raise ValueError("start must not be after end")
+        # The payments query stops at the start of the following month
+        after_end = end + relativedelta(months=1)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    month_starts = []
+    month = start
+    while month < after_end:
+        month_starts.append(month)
+        month += relativedelta(months=1)
+    if len(month_starts) > 120:
+        return JsonResponse({'error': "The range can span at most 120 months"}, status=400)
+    
+    by_category = request.GET.get('by_category') in ('1', 'true')
+    group_by = ['month', 'recurring_expense__category__name'] if by_category else ['month']
+    
+    # A single grouped query over the user's payments in the range, found
+    # through payment_user_date_id_idx
+    rows = ExpensePayment.objects.filter(
+        user=request.user,
+        payment_date__gte=start,
+        payment_date__lt=after_end
+    ).annotate(month=TruncMonth('payment_date')).values(*group_by).annotate(
+        total=Sum('amount_paid')
+    ).order_by(*group_by)
+    
+    # Fill in months without payments with zeros
+    position = {month: i for i, month in enumerate(month_starts)}
+    series = {}
+    for row in rows:
+        label = (row['recurring_expense__category__name'] or 'Uncategorized') if by_category else 'Monthly Expenses'
+        data = series.setdefault(label, [0.0] * len(month_starts))
+        data[position[row['month']]] += float(row['total'])
+    if not series and not by_category:
+        series['Monthly Expenses'] = [0.0] * len(month_starts)
+    
+    return JsonResponse({
+        'labels': [month.strftime('%b %Y') for month in month_starts],
+        'datasets': [{'label': label, 'data': data} for label, data in series.items()]
     })
 
+def _forecast_payload(user, today, months):
+    """Build the forecast response for a user's active expenses"""
+    expenses = RecurringExpense.objects.for_user(user).active().list_rows()
+    result = forecast(expenses, today, months)
+    
+    return {
+        'start': result['start'].isoformat(),
+        'end': result['end'].isoformat(),
+        'months': months,
+        'total': str(result['total']),
+        'by_month': [
+            {'month': month.strftime('%Y-%m'), 'total': str(total)}
+            for month, total in result['by_month']
+        ],
+        'by_category': [
+            {'category': name or 'Uncategorized', 'total': str(total)}
+            for name, total in result['by_category']
+        ],
+    }
+
+@login_required
+def expense_forecast(request):
+    """Forecast the outflow of active expenses over the coming months"""
+    try:
+        months = int(request.GET.get('months', 12))
+        if not 1 <= months <= 120:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': "months must be a whole number between 1 and 120"}, status=400)
+    
+    # The forecast only changes with the user's data or the date
+    today = timezone.now().date()
+    payload = cached_for_user(
+        request.user.pk,
+        f'forecast:{today.isoformat()}:{months}',
+        lambda: _forecast_payload(request.user, today, months)
+    )
+    return JsonResponse(payload)
+
+def _page_limit(request):
+    limit = int(request.GET.get('limit', 50))
+    if not 1 <= limit <= 500:
+        raise ValueError("limit must be between 1 and 500")
+    return limit
+
+def _page_response(request, results, next_cursor):
+    next_url = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_url = f"{request.path}?{params.urlencode()}"
+    return JsonResponse({'results': results, 'next_cursor': next_cursor, 'next': next_url})
+
+@login_required
+@replica_view
+def expense_list_api(request):
+    """List the user's expenses by due date, a page at a time
+    
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the next one.
+    ``active=1`` or ``active=0`` filters on whether expenses are active.
+    """
+    expenses = RecurringExpense.objects.for_user(request.user)
+    if request.GET.get('active') in ('0', '1'):
+        expenses = expenses.filter(is_active=request.GET['active'] == '1')
+    
+    try:
+        rows, next_cursor = keyset_page(
+            expenses.rows('description'),
+            'due_date',
+            cursor=request.GET.get('cursor'),
+            limit=_page_limit(request)
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    results = [
+        {
+            'id': row.id,
+            'name': row.name,
+            'amount': str(row.amount),
+            'category_name': row.category_name,
+            'frequency': row.frequency,
+            'due_date': row.due_date.isoformat(),
+            'description': row.description,
+            'is_active': row.is_active,
+        }
+        for row in rows
+    ]
+    return _page_response(request, results, next_cursor)
+
+@login_required
+@replica_view
+def payment_list_api(request):
+    """List payments for the user's expenses by payment date, a page at a time
+    
+    ``expense=<id>`` limits the list to one expense.
+    """
+    # Read through payment_user_date_id_idx, without joining the expenses
+    payments = ExpensePayment.objects.filter(user=request.user)
+    
+    try:
+        if 'expense' in request.GET:
+            payments = payments.filter(recurring_expense_id=int(request.GET['expense']))
+        rows, next_cursor = keyset_page(
+            payments.values_list('id', 'recurring_expense_id', 'payment_date', 'amount_paid', 'notes', named=True),
+            'payment_date',
+            cursor=request.GET.get('cursor'),
+            limit=_page_limit(request)
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    results = [
+        {
+            'id': row.id,
+            'expense_id': row.recurring_expense_id,
+            'payment_date': row.payment_date.isoformat(),
+            'amount_paid': str(row.amount_paid),
+            'notes': row.notes,
+        }
+        for row in rows
+    ]
+    return _page_response(request, results, next_cursor)
+
+@staff_member_required
+def cache_stats_view(request):
+    """Report this process's cache hit and miss counts"""
+    stats = cache_stats()
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+    return JsonResponse(stats)
+
+@staff_member_required
+def metrics_view(request):
+    """Expose this process's request metrics for Prometheus to scrape"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@replica_view
 def dashboard(request):
     return render(request, 'expenses/dashboard.html')
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the request metrics cover the rest of the middleware too
+    'expenses.metrics.MetricsMiddleware',
+    # Outside the session middleware, so session writes also pin to the primary
+    'expenses.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,8 +85,52 @@ WSGI_APPLICATION = 'recurringtracker.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Django's SQLite backend with WAL, busy timeouts and BEGIN IMMEDIATE
+        # so that imports and page loads can run at the same time
+        'ENGINE': 'expenses.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 128 * 1024 * 1024,
+            'cache_size': -32000,
+            'busy_timeout': 5000,
+            'busy_retries': 5,
+            'busy_backoff': 0.05,
+        },
+    }
+}
+
+# Optional read-only replica for the reporting views, such as a copy of
+# db.sqlite3 refreshed with `sqlite3 db.sqlite3 ".backup replica.sqlite3"`.
+# Set EXPENSES_REPLICA_PATH to turn it on; without it the alias points at the
+# primary file and nothing is routed to it.
+_replica_path = os.environ.get('EXPENSES_REPLICA_PATH')
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': _replica_path or DATABASES['default']['NAME'],
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['expenses.routers.ReplicaRouter']
+
+# The alias reporting reads go to, or None to read everything from the primary
+EXPENSES_READ_REPLICA = 'replica' if _replica_path else None
+
+# How long a browser that has just written keeps reading from the primary
+EXPENSES_REPLICA_PIN_SECONDS = 15
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The local-memory cache is private to each process. When serving with more
+# than one worker process, switch to a shared backend such as
+# 'django.core.cache.backends.filebased.FileBasedCache' so that cache
+# invalidation and import progress are seen by every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -130,6 +179,9 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# Uploaded files (queued backup imports)
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -139,3 +191,18 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
+
+# Backup imports run in the background. Set to 0 to leave them to
+# `manage.py run_import_worker` instead of an in-process thread pool.
+EXPENSES_IMPORT_WORKER_THREADS = 1
+
+# A running import that has reported no progress for this many seconds has
+# lost its worker and is queued again, up to EXPENSES_IMPORT_MAX_ATTEMPTS
+# claims in all before it is marked failed.
+EXPENSES_IMPORT_STALE_SECONDS = 300
+EXPENSES_IMPORT_MAX_ATTEMPTS = 3
+
+# Serve the home page and category chart from async views, which run their
+# independent queries concurrently. recurringtracker/asgi.py turns this on;
+# under WSGI the sync views avoid an event loop per request.
+EXPENSES_ASYNC_VIEWS = os.environ.get('EXPENSES_ASYNC_VIEWS') == '1'
@@ -17,10 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.shortcuts import redirect
+from expenses.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
     path('expenses/', include('expenses.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', lambda request: redirect('expenses:home'), name='home'),
 ]